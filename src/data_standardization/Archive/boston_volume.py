@@ -1,18 +1,134 @@
 import os
-from data.util import read_geocode_cache, lookup_address
+from tools.geocode_cache import GeocodeCache, cache_path
+from concurrent.futures import ProcessPoolExecutor
+import json
 import re
 import openpyxl
 from collections import OrderedDict
-import csv
 from dateutil.parser import parse
 
+# Parsed ATRs, keyed by path, reused while a file's size and mtime match
+ATR_CACHE_NAME = 'parsed_atrs.json'
+
+
+def column_values(sheet, column, first_row, last_row):
+    """
+    Values in one column of a read-only worksheet, streaming only
+    the rows asked for
+    Rows past the end of the sheet are None, as they are with a
+    fully loaded workbook
+    """
+    values = [row[0] for row in sheet.iter_rows(
+        min_row=first_row, max_row=last_row, min_col=column, max_col=column,
+        values_only=True)]
+    return values + [None] * (last_row - first_row + 1 - len(values))
+
+
+def read_ATR(fname):
+    """
+    Function to read ATR data
+    data to collect:
+    mean speed, volume, motos (# of motorcycles), light(# of cars/trucks),
+    and heavy(# of heavy duty vehicles)
+    The workbook is streamed in read-only mode, reading just the rows
+    with the cells we want
+    """
+
+    # data_only=True so as to not read formulas
+    wb = openpyxl.load_workbook(fname, read_only=True, data_only=True)
+    try:
+        sheet_names = wb.sheetnames
+
+        # get total volume cell F106
+        if 'Volume' in sheet_names:
+            vol = column_values(wb['Volume'], 6, 106, 106)[0]
+        else:
+            vol = 0
+
+        # get mean speed data, cell E42
+        if 'Speed Combined' in sheet_names:
+            speed = column_values(wb['Speed Combined'], 5, 42, 42)[0]
+        elif 'Speed-1' in sheet_names:
+            speed = column_values(wb['Speed-1'], 5, 42, 42)[0]
+        else:
+            speed = 0
+
+        # get classification data, D38-D40 and hourly counts in O9-O32
+        counts = []
+        if 'Classification-Combined' in sheet_names \
+           or 'Classification-1' in sheet_names:
+            sheet = wb['Classification-Combined'] \
+                if 'Classification-Combined' in sheet_names \
+                else wb['Classification-1']
+            motos, light, heavy = column_values(sheet, 4, 38, 40)
+            counts = column_values(sheet, 15, 9, 32)
+        else:
+            motos = 0
+            light = 0
+            heavy = 0
+    finally:
+        wb.close()
+
+    date = parse(fname.split('.')[-2].split('_')[-1]).strftime("%Y-%m-%d")
+
+    return vol, speed, motos, light, heavy, date, counts
+
+
+def read_ATRs(fnames, cache_path=None, jobs=None):
+    """
+    Read many ATRs in a pool of processes, skipping the ones
+    whose parsed results are cached and still match the file
+    Args:
+        fnames - list of ATR paths
+        cache_path - json file of parsed results, or None to not cache
+        jobs - number of processes, defaults to one per cpu
+    Returns:
+        dict of path to read_ATR's results
+    """
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    results = {}
+    missing = []
+    for fname in fnames:
+        stat = os.stat(fname)
+        entry = cache.get(os.path.abspath(fname))
+        if entry and entry['size'] == stat.st_size \
+           and entry['mtime'] == stat.st_mtime:
+            results[fname] = tuple(entry['result'])
+        else:
+            missing.append(fname)
+
+    if missing:
+        print("Parsing {} of {} ATRs".format(len(missing), len(fnames)))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for fname, result in zip(missing, executor.map(
+                    read_ATR, missing, chunksize=max(1, len(missing) // 64))):
+                results[fname] = result
+                stat = os.stat(fname)
+                cache[os.path.abspath(fname)] = {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'result': list(result)
+                }
+
+        if cache_path:
+            # Replaced in a single step, so it's never left half written
+            with open(cache_path + '.tmp', 'w') as f:
+                json.dump(cache, f)
+            os.replace(cache_path + '.tmp', cache_path)
+    return results
+
 
 class BostonVolumeParser:
     """
     Read ATRs and TMCs into standardized volume format
     """
 
-    def __init__(self, datadir):
+    def __init__(self, datadir, jobs=None):
+        self.jobs = jobs
         self.BASE_FP = datadir
         self.PROCESSED_DATA_FP = os.path.join(self.BASE_FP, 'processed')
         self.RAW_FP = os.path.join(self.BASE_FP, "raw", "volume")
@@ -36,74 +152,66 @@ class BostonVolumeParser:
             return []
         atrs = os.listdir(self.ATR_FP)
 
-        if not os.path.exists(os.path.join(self.PROCESSED_DATA_FP,
-                                           'geocoded_addresses.csv')):
-            print("No geocoded_addresses.csv found, geocoding addresses")
-
-        cached = read_geocode_cache(filename=os.path.join(
-            self.PROCESSED_DATA_FP, 'geocoded_addresses.csv'))
+        cache = GeocodeCache(cache_path(self.PROCESSED_DATA_FP))
+        # Carry over what an older run geocoded
+        old_cache = os.path.join(self.PROCESSED_DATA_FP, 'geocoded_addresses.csv')
+        if os.path.exists(old_cache):
+            cache.import_csv(old_cache)
+
+        atrs = [atr for atr in atrs
+                if self.is_readable_ATR(os.path.join(self.ATR_FP, atr))]
+        addresses = {atr: self.clean_ATR_fname(os.path.join(self.ATR_FP, atr))
+                     for atr in atrs}
+        # Each result is cached as soon as it arrives
+        geocoded = cache.lookup_many(list(addresses.values()))
+        cache.close()
+
+        parsed = read_ATRs(
+            [os.path.join(self.ATR_FP, atr) for atr in atrs],
+            cache_path=os.path.join(self.PROCESSED_DATA_FP, ATR_CACHE_NAME),
+            jobs=self.jobs)
 
         results = []
         geocoded_count = [0, 0, 0]
         for atr in atrs:
-            if self.is_readable_ATR(os.path.join(self.ATR_FP, atr)):
-                atr_address = self.clean_ATR_fname(
-                    os.path.join(self.ATR_FP, atr))
-                print(atr_address)
-                geocoded_add, lat, lng, status = lookup_address(
-                    atr_address, cached)
-
-                cached[atr_address] = [geocoded_add, lat, lng, status]
-
-                print(str(geocoded_add) + ',' + str(lat) + ',' + str(lng))
-                vol, speed, motos, light, heavy, date, counts = self.read_ATR(
-                    os.path.join(self.ATR_FP, atr))
-                if status == 'S':
-                    geocoded_count[0] += 1
-                elif status == 'F':
-                    geocoded_count[1] += 1
-                else:
-                    geocoded_count[2] += 1
-
-                r = OrderedDict([
-                    ("startDateTime", date),
-                    ("location", OrderedDict([
-                        ("latitude", float(lat) if lat else ''),
-                        ("longitude", float(lng) if lng else ''),
-                        ("address", geocoded_add if geocoded_add else '')
-                    ])),
-                    ("volume", OrderedDict([
-                        ("totalVolume", vol),
-                        ("totalLightVehicles", light),
-                        ("totalHeavyVehicles", heavy),
-                        ("bikes", motos),
-                        ("hourlyVolume", counts)
-                    ])),
-                    ("speed", OrderedDict([
-                        ("averageSpeed", speed)
-                    ]))
-                ])
-                results.append(r)
+            atr_address = addresses[atr]
+            print(atr_address)
+            geocoded_add, lat, lng, status = geocoded[atr_address]
+
+            print(str(geocoded_add) + ',' + str(lat) + ',' + str(lng))
+            vol, speed, motos, light, heavy, date, counts = parsed[
+                os.path.join(self.ATR_FP, atr)]
+            if status == 'S':
+                geocoded_count[0] += 1
+            elif status == 'F':
+                geocoded_count[1] += 1
+            else:
+                geocoded_count[2] += 1
+
+            r = OrderedDict([
+                ("startDateTime", date),
+                ("location", OrderedDict([
+                    ("latitude", float(lat) if lat else ''),
+                    ("longitude", float(lng) if lng else ''),
+                    ("address", geocoded_add if geocoded_add else '')
+                ])),
+                ("volume", OrderedDict([
+                    ("totalVolume", vol),
+                    ("totalLightVehicles", light),
+                    ("totalHeavyVehicles", heavy),
+                    ("bikes", motos),
+                    ("hourlyVolume", counts)
+                ])),
+                ("speed", OrderedDict([
+                    ("averageSpeed", speed)
+                ]))
+            ])
+            results.append(r)
 
         print('Number successfully geocoded: {}'.format(geocoded_count[0]))
         print('Unable to geocode: {}'.format(geocoded_count[1]))
         print('Timed out on {} addresses'.format(geocoded_count[2]))
 
-        # Write out the cache
-        with open(os.path.join(self.PROCESSED_DATA_FP,
-                               'geocoded_addresses.csv'), 'w') as csvfile:
-
-            writer = csv.writer(csvfile, delimiter=',')
-            writer.writerow([
-                'Input Address',
-                'Output Address',
-                'Latitude',
-                'Longitude',
-                'Status'
-            ])
-
-            for name, value in cached.items():
-                writer.writerow([name] + value)
         return results
 
     def is_readable_ATR(self, fname):
@@ -147,62 +255,6 @@ class BostonVolumeParser:
 
     def read_ATR(self, fname):
         """
-        Function to read ATR data
-        data to collect:
-        mean speed, volume, motos (# of motorcycles), light(# of cars/trucks),
-        and heavy(# of heavy duty vehicles)
+        Function to read ATR data, see read_ATR
         """
-
-        # data_only=True so as to not read formulas
-        wb = openpyxl.load_workbook(fname, data_only=True)
-        sheet_names = wb.sheetnames
-
-        # get total volume cell F106
-        if 'Volume' in sheet_names:
-            sheet = wb['Volume']
-            vol = sheet['F106'].value
-        else:
-            vol = 0
-
-        # get mean speed data
-        if 'Speed Combined' in sheet_names:
-            sheet = wb['Speed Combined']
-            speed = sheet['E42'].value
-        elif 'Speed-1' in sheet_names:
-            sheet = wb['Speed-1']
-            speed = sheet['E42'].value
-        else:
-            speed = 0
-
-        # get classification data
-        counts = []
-        if 'Classification-Combined' in sheet_names:
-            sheet = wb['Classification-Combined']
-            motos = sheet['D38'].value
-            light = sheet['D39'].value
-            heavy = sheet['D40'].value
-
-            for row_index in range(9, 33):
-                cell = "{}{}".format('O', row_index)
-                val = sheet[cell].value
-                counts.append(val)
-
-        elif 'Classification-1' in sheet_names:
-            sheet = wb['Classification-1']
-            motos = sheet['D38'].value
-            light = sheet['D39'].value
-            heavy = sheet['D40'].value
-
-            for row_index in range(9, 33):
-                cell = "{}{}".format('O', row_index)
-                val = sheet[cell].value
-                counts.append(val)
-        else:
-            motos = 0
-            light = 0
-            heavy = 0
-
-        date = parse(fname.split('.')[-2].split('_')[-1]).strftime("%Y-%m-%d")
-
-        return vol, speed, motos, light, heavy, date, counts
-
+        return read_ATR(fname)
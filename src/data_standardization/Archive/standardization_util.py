@@ -1,8 +1,18 @@
 import dateutil.parser as date_parser
 from datetime import datetime, timedelta
-import json
-from jsonschema import validate
 from dateutil import tz
+import numpy as np
+import pandas as pd
+from ..json_writer import write_records
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:
+    # Only public from pandas 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
+# How a parsed date's timezone is handled by parse_dates
+LOCAL, UTC, FIXED = 0, 1, 2
 
 
 def parse_date(date, timezone, time=None, time_format=None):
@@ -59,6 +69,157 @@ def parse_date(date, timezone, time=None, time_format=None):
     return date_time
 
 
+def parse_unique_dates(values):
+    """
+    Parse distinct date strings, guessing the format once from the first
+    one and parsing them all together. Strings that don't fit the format
+    are parsed one at a time with dateutil
+    Args:
+        values - list of distinct strings
+    Returns:
+        naive DatetimeIndex of wall clock times (UTC for UTC dates),
+        array of LOCAL/UTC/FIXED, and a dict of position to
+        timezone-aware datetime for the FIXED (non-UTC offset) dates
+    """
+    wall = pd.Series(pd.NaT, index=range(len(values)), dtype='datetime64[ns]')
+    kind = np.full(len(values), LOCAL)
+    fixed = {}
+    if not len(values):
+        return pd.DatetimeIndex(wall), kind, fixed
+
+    fmt = guess_datetime_format(values[0])
+    try:
+        parsed = pd.to_datetime(pd.Index(values), format=fmt, errors='coerce')
+    except (ValueError, TypeError):
+        parsed = None
+    # Mixed offsets come back as objects, leave them to dateutil
+    if isinstance(parsed, pd.DatetimeIndex):
+        if parsed.tz is None:
+            wall[:] = parsed
+        elif str(parsed.tz) == 'UTC':
+            wall[:] = parsed.tz_convert(None)
+            kind[:] = UTC
+        else:
+            for i in np.flatnonzero(parsed.notna()):
+                fixed[i] = parsed[i].to_pydatetime()
+            kind[:] = FIXED
+        missing = np.flatnonzero(parsed.isna())
+    else:
+        missing = range(len(values))
+
+    for i in missing:
+        try:
+            date = date_parser.parse(values[i])
+        except (ValueError, OverflowError):
+            print("{} is badly formatted, skipping".format(values[i]))
+            continue
+        if not date.tzinfo:
+            wall[i] = date
+            kind[i] = LOCAL
+        elif date.tzinfo == tz.tzutc():
+            wall[i] = date.replace(tzinfo=None)
+            kind[i] = UTC
+        else:
+            fixed[i] = date
+            kind[i] = FIXED
+    return pd.DatetimeIndex(wall), kind, fixed
+
+
+def parse_dates(dates, timezone, times=None, time_format=None):
+    """
+    Batch version of parse_date, for whole columns
+    Each distinct date (and time) is only parsed once, and dates are
+    localized to the timezone a column at a time
+    Args:
+        dates - Series (or list) of date strings
+        timezone - pytz timezone
+        times - optional Series of times, used for dates without a time
+        time_format - 'military', 'seconds' or None, as in parse_date
+    Returns:
+        Series of datetime strings in standardized format,
+        None where the date is missing or badly formatted
+    """
+    dates = pd.Series(dates)
+    pairs = pd.DataFrame({
+        'date': dates.fillna('').astype(str).values,
+        'time': pd.Series(times).fillna('').astype(str).values if times is not None else '',
+    })
+    # Memoize: work on each distinct date/time pair once
+    codes, _ = pd.factorize(pairs['date'] + '\x00' + pairs['time'])
+    _, first = np.unique(codes, return_index=True)
+    unique = pairs.iloc[first].reset_index(drop=True)
+
+    present = (unique['date'] != '').values
+    date_codes, date_values = pd.factorize(unique['date'][present])
+    date_wall, date_kind, date_fixed = parse_unique_dates(list(date_values))
+
+    wall = pd.Series(pd.NaT, index=unique.index, dtype='datetime64[ns]')
+    kind = np.full(len(unique), LOCAL)
+    fixed = {}
+    positions = np.flatnonzero(present)
+    wall.iloc[positions] = date_wall.take(date_codes)
+    kind[positions] = date_kind[date_codes]
+    for pos, code in zip(positions, date_codes):
+        if code in date_fixed:
+            fixed[pos] = date_fixed[code]
+
+    # If there's no time in the date given, look at the time field
+    if times is not None:
+        aware_wall = wall.copy()
+        for pos, date in fixed.items():
+            aware_wall[pos] = date.replace(tzinfo=None)
+        time = unique['time']
+        midnight = (aware_wall.notna() & (aware_wall == aware_wall.dt.normalize())
+                    & (time != '') & (time != '0')).values
+
+        if time_format == 'seconds':
+            seconds = pd.to_timedelta(pd.to_numeric(time[midnight]), unit='s')
+            wall[midnight] = wall[midnight] + seconds.values
+            for pos in np.flatnonzero(midnight):
+                if pos in fixed:
+                    fixed[pos] = fixed[pos] + timedelta(seconds=int(time[pos]))
+        elif np.any(midnight):
+            day = aware_wall[midnight].dt.normalize()
+            if time_format == 'military':
+                # military times less than 4 chars require padding with leading zeros
+                # e.g 155 becomes 0155; invalid times are ignored
+                padded = time[midnight].str.zfill(4)
+                hours = pd.to_numeric(padded.str[:-2], errors='coerce')
+                minutes = pd.to_numeric(padded.str[-2:], errors='coerce')
+                valid = (hours * 100 + minutes <= 2359) & (minutes < 60)
+                offset = pd.to_timedelta(hours.where(valid, 0) * 60 + minutes.where(valid, 0),
+                                         unit='m')
+                wall[midnight] = day + offset.values
+            else:
+                combined = (day.dt.strftime('%Y-%m-%d ') + time[midnight]).tolist()
+                combined_wall, _, _ = parse_unique_dates(combined)
+                wall[midnight] = combined_wall
+            # Reparsing drops any timezone from the date
+            kind[midnight] = LOCAL
+            for pos in np.flatnonzero(midnight):
+                fixed.pop(pos, None)
+
+    # Add timezone if it wasn't included in the string formatting originally,
+    # and reformat utc into local time with offset
+    result = pd.Series(None, index=unique.index, dtype=object)
+    local = (kind == LOCAL) & wall.notna().values
+    if local.any():
+        localized = pd.DatetimeIndex(wall[local]).tz_localize(
+            timezone, ambiguous=np.zeros(local.sum(), dtype=bool),
+            nonexistent=timedelta(hours=1))
+        result[local] = [d.isoformat() for d in localized]
+    utc = (kind == UTC) & wall.notna().values
+    if utc.any():
+        converted = pd.DatetimeIndex(wall[utc]).tz_localize('UTC').tz_convert(timezone)
+        result[utc] = [d.isoformat() for d in converted]
+    for pos, date in fixed.items():
+        result[pos] = date.isoformat()
+
+    result = result.values[codes]
+    result[pd.isnull(result)] = None
+    return pd.Series(result, index=dates.index)
+
+
 def parse_address(address):
     """
     Some cities have the lat/lon as part of the address.
@@ -71,19 +232,46 @@ def parse_address(address):
     return None, None
 
 
-def validate_and_write_schema(schema_path, schema_values, output_file):
+def parse_addresses(addresses):
+    """
+    Column version of parse_address
+    Args:
+        addresses - Series (or list) of address strings
+    Returns:
+        latitude and longitude Series of floats,
+        NaN where the address doesn't have them
+    """
+    addresses = pd.Series(addresses)
+    lines = addresses.astype(str).str.split('\n')
+    last = lines.str[2].where(lines.str.len() == 3)
+    present = last.notna() & (last != '')
+    lat = pd.Series(np.nan, index=addresses.index)
+    lon = pd.Series(np.nan, index=addresses.index)
+    if not present.any():
+        return lat, lon
+
+    coords = last[present].str[1:-1].str.split(', ')
+    if (coords.str.len() != 2).any():
+        raise ValueError('Badly formatted coordinates in address')
+    lat[present] = coords.str[0].astype(float)
+    lon[present] = coords.str[1].astype(float)
+    return lat, lon
+
+
+def validate_and_write_schema(schema_path, schema_values, output_file, jobs=1,
+                              fmt='array'):
     """
     Validate a schema according to a schema file, and write to file
+    Records are validated and written in batches, see json_writer
     Args:
         schema_path - the schema filename
-        schema_values - a list of dicts
+        schema_values - a list (or any iterable, e.g. a generator) of dicts
         output_file
+        jobs - number of processes validating
+        fmt - 'array' for a json list, 'ndjson' for one record per line
     """
 
-    with open(schema_path) as schema:
-        validate(schema_values, json.load(schema))
-
-    with open(output_file, "w") as f:
-        json.dump(schema_values, f)
+    count = write_records(schema_values, output_file, schema=schema_path,
+                          fmt=fmt, jobs=jobs)
 
-    print("- output written to {}".format(output_file))
+    print("- {} records written to {}".format(count, output_file))
@@ -2,132 +2,169 @@
 # Author terryf82 https://github.com/terryf82
 
 import argparse
+import fnmatch
 import os
 import pandas as pd
 from collections import OrderedDict
 import yaml
 import pytz
-from .standardization_util import validate_and_write_schema, parse_date
+from .standardization_util import validate_and_write_schema, parse_dates
+from ..store import write_table
 
 
 CURR_FP = os.path.dirname(
     os.path.abspath(__file__))
-BASE_FP = os.path.dirname(os.path.dirname(CURR_FP))
+# The repository root, which has the standards folder
+BASE_FP = os.path.dirname(os.path.dirname(os.path.dirname(CURR_FP)))
+SPEC_DIR = os.path.join(os.path.dirname(CURR_FP), 'concern_specs')
 
+# Standardized concern columns, in output order
+COLUMNS = ['id', 'source', 'dateCreated', 'status', 'category',
+           'latitude', 'longitude', 'summary']
 
-def read_concerns(datadir, folder, timezone):
+
+def load_sources(folder, sources=None):
+    """
+    Descriptions of a city's concern files
+    Each source gives the files it covers (a filename or pattern),
+    the source label, the columns that must be filled in, a mapping
+    from standardized columns to the file's columns, and fixed values
+    for standardized columns the file doesn't have. Without an id
+    column, concerns are numbered in the order they're read
+    Args:
+        folder - the city's folder name
+        sources - list of sources from the city's config, if it has them;
+            otherwise the city's spec in concern_specs is used
+    Returns:
+        list of source dicts, empty if the city has none
+    """
+    if sources:
+        return sources
+    path = os.path.join(SPEC_DIR, folder + '.yml')
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def match_source(sources, filename):
+    """
+    First source whose file pattern matches a filename, or None
+    """
+    for source in sources:
+        if fnmatch.fnmatch(filename, source.get('file', '*')):
+            return source
+    return None
+
+
+def standardize_frame(df, source, timezone, first_id=1):
     """
-    Reads concerns from a directory
-    todo: need to move away from hardcoded cities here
+    Map one concerns file onto the standardized columns, a column at a time
     Args:
-        raw_path - path to the concerns
+        df - the raw file, read with na_filter=False
+        source - source description, see load_sources
         timezone
+        first_id - first id to number concerns from, if the file has no ids
+    Returns:
+        DataFrame with COLUMNS
+    """
+    keep = pd.Series(True, index=df.index)
+    for col in source.get('required', []):
+        keep &= df[col].astype(str) != ''
+    for col, values in source.get('filters', {}).items():
+        keep &= df[col].isin(values)
+    df = df[keep]
+
+    columns = source.get('columns', {})
+    values = source.get('values', {})
+    result = pd.DataFrame(index=df.index)
+    for col in COLUMNS:
+        if col == 'source':
+            result[col] = source['source']
+        elif col == 'dateCreated':
+            result[col] = parse_dates(df[columns[col]], timezone)
+        elif col in columns:
+            result[col] = df[columns[col]]
+        elif col == 'id':
+            result[col] = range(first_id, first_id + len(df))
+        else:
+            result[col] = values.get(col)
+    return result.reset_index(drop=True)
+
+
+def iter_records(df):
+    """
+    Nested concern records from standardized columns
+    """
+    columns = [df[col].tolist() for col in COLUMNS]
+    for concern_id, source, date, status, category, lat, lng, summary in zip(*columns):
+        yield OrderedDict([
+            ("id", concern_id),
+            ("source", source),
+            ("dateCreated", date),
+            ("status", status),
+            ("category", category),
+            ("location", OrderedDict([
+                ("latitude", lat),
+                ("longitude", lng)
+            ])),
+            ("summary", summary)
+        ])
+
+
+def read_concerns(datadir, folder, timezone, sources=None, fmt='all'):
+    """
+    Reads concerns from a directory, standardizes them as described
+    by the city's concern sources and writes them out
+    Args:
+        datadir - the city's data directory
+        folder - the city's folder name
+        timezone
+        sources - concern sources from the city's config, see load_sources
+        fmt - write json (text), parquet, or all of them
     Returns:
         nothing - writes standardized concerns to file
     """
-    concerns = []
-    manual_concern_id = 1
-
     raw_path = os.path.join(datadir, "raw/concerns")
     if not os.path.exists(raw_path):
         print(raw_path + " not found, exiting")
         exit(1)
 
+    sources = load_sources(folder, sources)
     print("searching "+raw_path+" for raw concerns file(s)")
 
+    frames = []
+    next_ids = {}
     for csv_file in os.listdir(raw_path):
         print(csv_file)
-
-        df_concerns = pd.read_csv(os.path.join(raw_path, csv_file), na_filter=False)
-        dict_concerns = df_concerns.to_dict("records")
-
-        for key in dict_concerns:
-            if folder == "boston":
-                # Boston presently has concerns from two sources - VisionZero and SeeClickFix
-                if csv_file == "Vision_Zero_Entry.csv":
-                    # skip concerns that don't have a date or request type
-                    if key["REQUESTDATE"] == "" or key["REQUESTTYPE"] == "":
-                        continue
-
-                    else:
-                        concerns.append(OrderedDict([
-                            ("id", key["OBJECTID"]),
-                            ("source", "visionzero"),
-                            ("dateCreated", parse_date(
-                                key["REQUESTDATE"], timezone)),
-                            ("status", key["STATUS"]),
-                            ("category", key["REQUESTTYPE"]),
-                            ("location", OrderedDict([
-                                ("latitude", key["Y"]),
-                                ("longitude", key["X"])
-                            ])),
-                            ("summary", key["COMMENTS"])
-                        ]))
-
-                elif csv_file == "bos_scf.csv":
-                    # skip concerns that don't have a date or request type
-                    if key["created"] == "" or key["summary"] == "":
-                        continue
-
-                    else:
-                        concerns.append(OrderedDict([
-                            ("id", manual_concern_id),
-                            ("source", "seeclickfix"),
-                            ("dateCreated", parse_date(
-                                key["created"], timezone)),
-                            ("status", "unknown"),
-                            ("category", key["summary"]),
-                            ("location", OrderedDict([
-                                ("latitude", key["Y"]),
-                                ("longitude", key["X"])
-                            ])),
-                            ("summary", key["description"])
-                        ]))
-
-                    manual_concern_id += 1
-
-            if folder == "dc":
-                # skip concerns that don't have a date or request type
-                if key["REQUESTDATE"] == "" or key["REQUESTTYPE"] == "":
-                    continue
-
-                concerns.append(OrderedDict([
-                    ("id", key["OBJECTID"]),
-                    ("source", "visionzero"),
-                    ("dateCreated", parse_date(key["REQUESTDATE"], timezone)),
-                    ("status", key["STATUS"]),
-                    ("category", key["REQUESTTYPE"]),
-                    ("location", OrderedDict([
-                        ("latitude", key["Y"]),
-                        ("longitude", key["X"])
-                    ])),
-                    ("summary", key["COMMENTS"])
-                ]))
-
-            elif folder == "cambridge":
-                # skip concerns that don't have a date or issue type
-                if key["ticket_created_date_time"] == "" or key["issue_type"] == "":
-                    continue
-
-                concerns.append(OrderedDict([
-                    ("id", key["ticket_id"]),
-                    ("source", "seeclickfix"),
-                    ("dateCreated", parse_date(
-                        key["ticket_created_date_time"], timezone)),
-                    ("status", key["ticket_status"]),
-                    ("category", key["issue_type"]),
-                    ("location", OrderedDict([
-                        ("latitude", key["lat"]),
-                        ("longitude", key["lng"])
-                    ])),
-                    ("summary", key["issue_description"])
-                ]))
-
+        source = match_source(sources, csv_file)
+        if source is None:
+            continue
+
+        # Only read the columns the source uses
+        used = set(source.get('columns', {}).values()) \
+            | set(source.get('required', [])) | set(source.get('filters', {}))
+        df = pd.read_csv(os.path.join(raw_path, csv_file), na_filter=False,
+                         usecols=lambda col, used=used: col in used)
+        # Ids carry on from the source's earlier files
+        key = source['source']
+        frame = standardize_frame(df, source, timezone, next_ids.get(key, 1))
+        next_ids[key] = next_ids.get(key, 1) + len(frame)
+        frames.append(frame)
+
+    concerns = pd.concat(frames, ignore_index=True) if frames \
+        else pd.DataFrame(columns=COLUMNS)
     print("done, {} concerns loaded, validating against schema".format(len(concerns)))
 
-    schema_path = os.path.join(BASE_FP, "standards/concerns-schema.json")
     concerns_output = os.path.join(datadir, "standardized/concerns.json")
-    validate_and_write_schema(schema_path, concerns, concerns_output)
+    if fmt in ('text', 'all'):
+        schema_path = os.path.join(BASE_FP, "standards/concerns-schema.json")
+        validate_and_write_schema(schema_path, iter_records(concerns), concerns_output)
+    if fmt in ('parquet', 'all'):
+        table = concerns.astype({'id': str})
+        for col in ['latitude', 'longitude']:
+            table[col] = pd.to_numeric(table[col], errors='coerce')
+        write_table(table, concerns_output, categories=['source', 'status', 'category'])
 
 
 if __name__ == '__main__':
@@ -136,6 +173,8 @@ if __name__ == '__main__':
                         help="config file")
     parser.add_argument("-d", "--datadir", type=str, required=True,
                         help="data directory")
+    parser.add_argument("-f", "--format", choices=['text', 'parquet', 'all'], default='all',
+                        help="write json (text), parquet, or all of them")
 
     args = parser.parse_args()
 
@@ -145,4 +184,5 @@ if __name__ == '__main__':
         config = yaml.safe_load(f)
 
     read_concerns(
-        args.datadir, config['name'], pytz.timezone(config['timezone']))
+        args.datadir, config['name'], pytz.timezone(config['timezone']),
+        sources=config.get('concerns'), fmt=args.format)
@@ -1,67 +1,108 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import os
+import numpy as np
 import pandas as pd
 from collections import OrderedDict
 import yaml
 import pytz
 from . import standardization_util
+from tools import run_report
 
 CURR_FP = os.path.dirname(
     os.path.abspath(__file__))
 BASE_FP = os.path.dirname(CURR_FP)
 
 
-def read_file_info(config, datadir):
-
-    points = []
-    for source_config in list(config['data_source']):
-
-        print("Processing {} data".format(source_config['name']))
+def standardize_source(source_config, datadir, timezone):
+    """
+    Read one supplemental data source into points, a column at a time
+    Runs in a worker process
+    Args:
+        source_config - the source's entry in the config's data_source
+        datadir
+        timezone - the city's timezone name
+    Returns:
+        list of points, number of rows without a lat/lon,
+        and the source's run report step
+    """
+    report = run_report.RunReport()
+    with report.step('standardize_' + source_config['name']) as record:
         csv_file = source_config['filename']
         filepath = os.path.join(datadir, 'raw', 'supplemental', csv_file)
         if not os.path.exists(filepath):
             raise SystemExit(csv_file + " not found, exiting")
 
         df = pd.read_csv(filepath, na_filter=False)
-        rows = df.to_dict("records")
-        missing = 0
-        for row in rows:
-            lat = None
-            lon = None
-            if 'address' in source_config:
-                lat, lon = standardization_util.parse_address(
-                    row[source_config['address']])
-            if lat and lon:
-                time = None
-
-                if 'time' in source_config and source_config['time']:
-                    time = row[source_config['time']]
-
-                date_time = standardization_util.parse_date(
-                    row[source_config['date']], pytz.timezone(
-                        config['timezone']), time=time)
-                updated_row = OrderedDict([
-                    ("feature", source_config["name"]),
-                    ("date", date_time),
-                    ("location", OrderedDict([
-                        ("latitude", lat),
-                        ("longitude", lon)
-                    ]))
-                ])
-
-                if "category" in source_config and source_config['category']:
-                    updated_row['category'] = row[source_config['category']]
-                if "notes" in source_config and source_config['notes']:
-                    updated_row['notes'] = row[source_config['notes']]
-
-                points.append(updated_row)
-            else:
-                missing += 1
-
-        print("{} entries didn't have a lat/lon".format(missing))
+        record['rows_in'] = len(df)
+        if 'address' in source_config:
+            lat, lon = standardization_util.parse_addresses(df[source_config['address']])
+            # Zero is treated as missing, as it always has been
+            keep = (lat.fillna(0) != 0) & (lon.fillna(0) != 0)
+        else:
+            lat = lon = pd.Series(np.nan, index=df.index)
+            keep = lat.notna()
+        df = df[keep]
+
+        times = None
+        if 'time' in source_config and source_config['time']:
+            times = df[source_config['time']]
+        columns = [
+            standardization_util.parse_dates(
+                df[source_config['date']], pytz.timezone(timezone), times=times).tolist(),
+            lat[keep].tolist(),
+            lon[keep].tolist(),
+        ]
+        extras = [name for name in ('category', 'notes')
+                  if name in source_config and source_config[name]]
+        columns += [df[source_config[name]].tolist() for name in extras]
+
+        points = []
+        for values in zip(*columns):
+            point = OrderedDict([
+                ("feature", source_config["name"]),
+                ("date", values[0]),
+                ("location", OrderedDict([
+                    ("latitude", values[1]),
+                    ("longitude", values[2])
+                ]))
+            ])
+            for name, value in zip(extras, values[3:]):
+                point[name] = value
+            points.append(point)
+        record['rows_out'] = len(points)
+    return points, len(keep) - len(points), report.steps[-1]
+
+
+def read_file_info(config, datadir, jobs=None):
+    """
+    Standardize each supplemental data source, in parallel, and
+    write the points out
+    Args:
+        config - the city's config
+        datadir
+        jobs - number of processes, defaults to one per source
+    """
+    sources = list(config['data_source'])
+    points = []
+    with ProcessPoolExecutor(max_workers=jobs or max(1, len(sources))) as executor:
+        futures = [executor.submit(standardize_source, source_config, datadir,
+                                   config['timezone'])
+                   for source_config in sources]
+        for source_config, future in zip(sources, futures):
+            print("Processing {} data".format(source_config['name']))
+            source_points, missing, record = future.result()
+            record = run_report.REPORT.add(record)
+            record['rows_per_second'] = round(
+                record['rows_in'] / max(record['wall_seconds'], 1e-6))
+            points += source_points
+            print("{} entries didn't have a lat/lon".format(missing))
+            print("{} rows in {}s ({} rows/s)".format(
+                record['rows_in'], record['wall_seconds'], record['rows_per_second']))
+
     if points:
 
-        schema_path = os.path.join(os.path.dirname(BASE_FP),
+        schema_path = os.path.join(os.path.dirname(os.path.dirname(BASE_FP)),
                                    "standards", "points-schema.json")
         output = os.path.join(datadir, "standardized", "points.json")
         standardization_util.validate_and_write_schema(
@@ -76,6 +117,8 @@ if __name__ == '__main__':
     parser.add_argument("-d", "--datadir", type=str,
                         help="path to destination's data folder," +
                         "e.g. ../data/boston")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of processes, defaults to one per data source")
 
     args = parser.parse_args()
 
@@ -85,6 +128,6 @@ if __name__ == '__main__':
         config = yaml.safe_load(f)
 
     if 'data_source' in config:
-        read_file_info(config, args.datadir)
+        read_file_info(config, args.datadir, jobs=args.jobs)
 
     
@@ -29,13 +29,16 @@ if __name__ == '__main__':
     parser.add_argument("-d", "--datadir", type=str,
                         help="data directory")
     parser.add_argument("--volume", type=str, help="volume YES or NO")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes reading ATRs")
 
     args = parser.parse_args()
     BASE_FP = os.path.join(args.datadir)
 
     if args.volume is True:
         print('Volume calculations being carried out.')
-        volume_counts = BostonVolumeParser(args.datadir).get_volume()
+        volume_counts = BostonVolumeParser(
+            args.datadir, jobs=args.jobs).get_volume()
         write_volume(volume_counts)
     else:
         print("No volume data given for {}".format(args.city))
@@ -1,17 +1,31 @@
 import argparse
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import itertools
 import os
 from dateutil.parser import parse
 import gzip
 import json
 import yaml
 import datetime
+import numpy as np
+import pandas as pd
 import pytz
+from ..json_writer import write_records
+from tools.snapshot_archive import archive_hour, read_archived, read_index
 
 
 CURR_FP = os.path.dirname(
     os.path.abspath(__file__))
 BASE_FP = os.path.dirname(os.path.dirname(CURR_FP))
 
+# waze_feed.py names each snapshot by the minute it was fetched, in utc
+SNAPSHOT_NAME_FORMAT = '%Y-%m-%d-%H-%M'
+# How far a snapshot's start and end times can be from its filename's time
+SNAPSHOT_MARGIN = datetime.timedelta(hours=1)
+# Format of pubTimeStamp in the standardized data
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
 
 def get_datetime(date, timezone):
     """
@@ -46,95 +60,345 @@ def convert_from_millis(millis, timezone):
     ).strftime('%Y-%m-%d %H:%M:%S')
 
 
-def read_snapshots(dirname, config, startdate=None, enddate=None):
+def to_local_times(dates, timezone):
     """
-    Read in files, either .json.gz or .json from a directory
-    Create a dictionary of lists of jams, alerts, and irregularities
-    To do: handle time zone
+    Column version of get_datetime
+    Args:
+        dates - list of utc date strings in form 2018-10-15 20:13:00:000
+        timezone - a pytz object
+    Returns:
+        DatetimeIndex in the given timezone, to the second
+    """
+    utc = pd.to_datetime(pd.Index(dates), format='%Y-%m-%d %H:%M:%S:%f', utc=True)
+    return utc.floor('s').tz_convert(timezone)
+
+
+def millis_to_local(millis, timezone):
+    """
+    Column version of convert_from_millis, without the formatting
+    Args:
+        millis - list or array of epoch milliseconds
+        timezone - a pytz object
+    Returns:
+        DatetimeIndex in the given timezone
+    """
+    millis = np.asarray(millis, dtype='int64')
+    return pd.to_datetime(millis, unit='ms', utc=True).tz_convert(timezone)
+
+
+def snapshot_time(filename):
+    """
+    Time a snapshot was fetched, from its filename
+    Args:
+        filename - e.g. 2018-10-15-20-13.json.gz
+    Returns:
+        utc datetime, or None if the file isn't named that way
+    """
+    try:
+        date = datetime.datetime.strptime(
+            filename.split('.')[0], SNAPSHOT_NAME_FORMAT)
+    except ValueError:
+        return None
+    return date.replace(tzinfo=datetime.timezone.utc)
+
+
+def outside_dates(fetched, startdate=None, enddate=None):
+    """
+    Whether a snapshot fetched at this time can't be within the dates
+    """
+    if startdate and fetched + SNAPSHOT_MARGIN < startdate:
+        return True
+    if enddate and fetched - SNAPSHOT_MARGIN > enddate + datetime.timedelta(1):
+        return True
+    return False
+
+
+def snapshot_files(dirname, startdate=None, enddate=None):
+    """
+    Sorted snapshot files and hourly archives in a directory, leaving
+    out the ones whose filename shows they're outside the dates,
+    without opening them
+    Args:
+        dirname
+        startdate, enddate - localized datetimes, or None
+    Returns:
+        list of filenames
+    """
+    files = []
+    for filename in sorted(os.listdir(dirname)):
+        hour = archive_hour(filename)
+        if hour is not None:
+            # Keep the archive if any minute of its hour could be in range
+            if outside_dates(hour, enddate=enddate) \
+               or outside_dates(hour + datetime.timedelta(hours=1), startdate=startdate):
+                continue
+            files.append(filename)
+            continue
+        if not (filename.endswith('.json.gz') or filename.endswith('.json')):
+            continue
+        fetched = snapshot_time(filename)
+        if fetched is not None and outside_dates(fetched, startdate, enddate):
+            continue
+        files.append(filename)
+    return files
+
+
+def snapshot_sources(dirname, startdate=None, enddate=None):
+    """
+    Every snapshot to read, in the order they were fetched
+    Snapshots in an hourly archive are listed from its index, and
+    pruned by their names the same way as single files
+    Args:
+        dirname
+        startdate, enddate - localized datetimes, or None
+    Returns:
+        list of (path, offset, length), with offset and length
+        None for snapshots in their own file
+    """
+    sources = []
+    for filename in snapshot_files(dirname, startdate, enddate):
+        path = os.path.join(dirname, filename)
+        if archive_hour(filename) is None:
+            sources.append((snapshot_time(filename), filename, path, None, None))
+            continue
+        for name, offset, length in read_index(path):
+            fetched = snapshot_time(name)
+            if fetched is not None and outside_dates(fetched, startdate, enddate):
+                continue
+            sources.append((fetched, name, path, offset, length))
+    # A directory can hold both, while moving from one file per minute
+    # to archives; unnamed files sort first, as they did by filename
+    sources.sort(key=lambda source: (source[0] is not None, source[0] or 0, source[1]))
+    return [(path, offset, length) for _, _, path, offset, length in sources]
+
+
+def read_snapshot(path, city, timezone, startdate=None, enddate=None,
+                  offset=None, length=None):
+    """
+    Read a single snapshot and pull out this city's events
+    Runs in a worker process
+    Args:
+        path - .json.gz or .json snapshot, or an hourly archive
+        city
+        timezone - a pytz object
+        startdate, enddate - localized datetimes, or None
+        offset, length - where the snapshot is in an archive
+    Returns:
+        start, end, list of events (None if the snapshot is outside
+        the dates), with snapshotId left to be filled in
+    """
+    if offset is not None:
+        data = json.loads(read_archived(path, offset, length).decode('utf-8'))
+    elif path.endswith('.gz'):
+        with gzip.GzipFile(path, 'r') as f:
+            data = json.loads(f.read().decode('utf-8'))
+    else:
+        with open(path) as f:
+            data = json.load(f)
+
+    start, end = to_local_times([data['startTime'], data['endTime']], timezone)
+    if (startdate and start < startdate) \
+       or (enddate and end > enddate + datetime.timedelta(1)):
+        return start, end, None
+
+    # We care about jams, alerts, and irregularities
+    jams = [x for x in data.get('jams', []) if 'city' in x and city in x['city']]
+    alerts = [x for x in data.get('alerts', []) if 'city' in x and city in x['city']]
+    irregularities = [x for x in data.get('irregularities', [])
+                      if 'city' in x and city in x['city']]
+
+    # Convert every publication time in the snapshot at once
+    published = millis_to_local(
+        [x['pubMillis'] for x in jams + alerts], timezone).strftime(TIMESTAMP_FORMAT)
+
+    events = [
+        dict(x, eventType=event_type, pubTimeStamp=timestamp, snapshotId=None)
+        for x, event_type, timestamp in zip(
+            jams + alerts, ['jam'] * len(jams) + ['alert'] * len(alerts), published)]
+    events += [dict(x, eventType='irregularity', snapshotId=None)
+               for x in irregularities]
+    return start, end, events
+
+
+def ordered_results(executor, func, tasks, window):
+    """
+    Run func over tasks in the executor, yielding results in task order
+    Only window tasks are in flight at once, so results that haven't
+    been consumed yet don't pile up in memory
+    """
+    pending = deque()
+    tasks = iter(tasks)
+    for args in itertools.islice(tasks, max(1, window)):
+        pending.append(executor.submit(func, *args))
+    while pending:
+        result = pending.popleft().result()
+        for args in itertools.islice(tasks, 1):
+            pending.append(executor.submit(func, *args))
+        yield result
+
+
+def iter_snapshot_events(dirname, config, startdate=None, enddate=None, jobs=1):
+    """
+    Stream the snapshots in a directory, in filename order
+    Files are left out by their name where possible, and read and
+    parsed in a pool of processes
     Args:
         dirname - directory the waze data lives in
         config - configuration dict for city
         startdate - drop days before this date
         enddate - drop days after this date
-    returns
-        a list of all jams, alerts and irregularities for this city
+        jobs - number of processes reading snapshots
+    Yields:
+        snapshotId, snapshot start datetime, list of this city's events
     """
-    files = os.listdir(dirname)
     city = config['city'].split(',')[0]
-
-    all_data = []
-    min_start = None
-    max_end = None
-
     timezone = pytz.timezone(config['timezone'])
-    count = 0
     if startdate:
         startdate = timezone.localize(parse(startdate))
     if enddate:
         enddate = timezone.localize(parse(enddate))
 
-    files.sort()
-    for jsonfilename in files:
-        _, ext = os.path.splitext(jsonfilename)
-
-        if ext == '.gz':
-            with gzip.GzipFile(os.path.join(dirname, jsonfilename), 'r') as f:
-                json_bytes = f.read()
-                json_str = json_bytes.decode('utf-8')
-                data = json.loads(json_str)
-        elif ext == '.json':
-            with open(os.path.join(dirname, jsonfilename)) as f:
-                data = json.load(f)
-        else:
-            continue
+    tasks = [(path, city, timezone, startdate, enddate, offset, length)
+             for path, offset, length in snapshot_sources(dirname, startdate, enddate)]
 
-        end = get_datetime(data['endTime'], timezone)
-        if max_end is None or max_end < end:
-            max_end = end
-
-        start = get_datetime(data['startTime'], timezone)
-        if min_start is None or min_start > start:
-            min_start = start
-
-        if (startdate and start < startdate) \
-           or (enddate and end > enddate + datetime.timedelta(1)):
-            continue
-        count += 1
-
-        # We care about jams, alerts, and irregularities
-        if 'jams' in data:
-            all_data += [
-                dict(x, eventType='jam',
-                     pubTimeStamp=convert_from_millis(
-                         x['pubMillis'],
-                         timezone
-                     ),
-                     snapshotId=count
-                )
-                for x in data['jams']
-                if 'city' in x and city in x['city']
-            ]
-        if 'alerts' in data:
-            all_data += [
-                dict(x, eventType='alert',
-                     pubTimeStamp=convert_from_millis(
-                         x['pubMillis'],
-                         timezone
-                     ),
-                     snapshotId=count
-                )
-                for x in data['alerts']
-                if 'city' in x and city in x['city']]
-        if 'irregularities' in data:
-            all_data += [
-                dict(x, eventType='irregularity',
-                     snapshotId=count) for x in data['irregularities']
-                if 'city' in x and city in x['city']]
+    min_start = None
+    max_end = None
+    count = 0
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for start, end, events in ordered_results(executor, read_snapshot, tasks, 4 * jobs):
+            if max_end is None or max_end < end:
+                max_end = end
+            if min_start is None or min_start > start:
+                min_start = start
+            if events is None:
+                continue
+            count += 1
+            for event in events:
+                event['snapshotId'] = count
+            yield count, start, events
 
     print("Reading waze data from {} snapshots between {} and {}".format(
         count, min_start, max_end))
 
-    return all_data
+
+def iter_snapshots(dirname, config, startdate=None, enddate=None, jobs=1):
+    """
+    Stream the jams, alerts and irregularities for this city from
+    the snapshots in a directory, one record per event per snapshot
+    Args:
+        as for iter_snapshot_events
+    Yields:
+        event dicts
+    """
+    for _, _, events in iter_snapshot_events(
+            dirname, config, startdate=startdate, enddate=enddate, jobs=jobs):
+        for event in events:
+            yield event
+
+
+def event_key(event):
+    """
+    Key identifying the same Waze event across snapshots
+    Returns:
+        (eventType, uuid) or None if the event has no id
+    """
+    uuid = event.get('uuid', event.get('id'))
+    if uuid is None:
+        return None
+    return event['eventType'], uuid
+
+
+class EventCompactor():
+    """
+    Collapses the repeats of each event across snapshots into one record
+    Each record keeps the event's attributes as first seen, plus
+    firstSeen/lastSeen, first/last snapshotId and snapshotCount, and a
+    list of changes with only the attributes that changed and when
+    """
+
+    def __init__(self):
+        self.records = OrderedDict()
+        self.latest = {}
+        self.unkeyed = []
+
+    def add(self, snapshot_id, seen, events):
+        """
+        Add a snapshot's events
+        Args:
+            snapshot_id
+            seen - snapshot time string
+            events - list of event dicts
+        """
+        for event in events:
+            key = event_key(event)
+            if key is None:
+                self.unkeyed.append(event)
+                continue
+            attributes = {k: v for k, v in event.items() if k != 'snapshotId'}
+
+            record = self.records.get(key)
+            if record is None:
+                self.records[key] = dict(
+                    attributes, snapshotId=snapshot_id,
+                    firstSeen=seen, lastSeen=seen,
+                    firstSnapshotId=snapshot_id, lastSnapshotId=snapshot_id,
+                    snapshotCount=1, changes=[])
+                self.latest[key] = attributes
+                continue
+            if record['lastSnapshotId'] == snapshot_id:
+                # Listed twice in the same snapshot
+                continue
+
+            previous = self.latest[key]
+            changed = {k: v for k, v in attributes.items() if previous.get(k) != v}
+            changed.update({k: None for k in previous if k not in attributes})
+            if changed:
+                record['changes'].append(
+                    {'snapshotId': snapshot_id, 'seen': seen, 'attributes': changed})
+                self.latest[key] = attributes
+            record['lastSeen'] = seen
+            record['lastSnapshotId'] = snapshot_id
+            record['snapshotCount'] += 1
+
+    def compacted(self):
+        """
+        Compacted events in the order they were first seen,
+        followed by any events without an id
+        """
+        return list(self.records.values()) + self.unkeyed
+
+
+def compact_snapshots(dirname, config, startdate=None, enddate=None, jobs=1):
+    """
+    Read snapshots and collapse each event's repeats into one record
+    Args:
+        as for iter_snapshot_events
+    Returns:
+        list of compacted events, see EventCompactor
+    """
+    compactor = EventCompactor()
+    for snapshot_id, start, events in iter_snapshot_events(
+            dirname, config, startdate=startdate, enddate=enddate, jobs=jobs):
+        compactor.add(snapshot_id, start.strftime(TIMESTAMP_FORMAT), events)
+    return compactor.compacted()
+
+
+def read_snapshots(dirname, config, startdate=None, enddate=None, jobs=1):
+    """
+    Read in files, either .json.gz or .json, or hourly archives
+    from a directory
+    Create a dictionary of lists of jams, alerts, and irregularities
+    Args:
+        dirname - directory the waze data lives in
+        config - configuration dict for city
+        startdate - drop days before this date
+        enddate - drop days after this date
+        jobs - number of processes reading snapshots
+    returns
+        a list of all jams, alerts and irregularities for this city
+    """
+    return list(iter_snapshots(dirname, config, startdate=startdate,
+                               enddate=enddate, jobs=jobs))
 
 
 if __name__ == '__main__':
@@ -149,6 +413,11 @@ if __name__ == '__main__':
                         help="If given, start date in format YYYY-MM-DD")
     parser.add_argument("-e", "--enddate",
                         help="If given, last day included in format YYYY-MM-DD")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes reading snapshots")
+    parser.add_argument("--compact", action='store_true',
+                        help="write one record per event to waze_events.json, " +
+                        "instead of one per event per snapshot to waze.json")
     args = parser.parse_args()
 
     # load config for this city
@@ -156,15 +425,18 @@ if __name__ == '__main__':
     with open(config_file) as f:
         config = yaml.safe_load(f)
 
-    snapshots = read_snapshots(
-        os.path.join(args.datadir, 'raw', 'waze'),
-        config,
-        startdate=args.startdate,
-        enddate=args.enddate
-    )
-
-    jsonfile = os.path.join(
-        args.datadir, 'standardized', 'waze.json')
-    print("output {} records to {}".format(len(snapshots), jsonfile))
-    with open(jsonfile, 'w') as f:
-        json.dump(snapshots, f)
+    snapshot_dir = os.path.join(args.datadir, 'raw', 'waze')
+    if args.compact:
+        snapshots = compact_snapshots(
+            snapshot_dir, config, startdate=args.startdate,
+            enddate=args.enddate, jobs=args.jobs)
+        jsonfile = os.path.join(args.datadir, 'standardized', 'waze_events.json')
+    else:
+        snapshots = iter_snapshots(
+            snapshot_dir, config, startdate=args.startdate,
+            enddate=args.enddate, jobs=args.jobs)
+        jsonfile = os.path.join(args.datadir, 'standardized', 'waze.json')
+
+    # Written as the snapshots are read, rather than held in memory
+    count = write_records(snapshots, jsonfile)
+    print("output {} records to {}".format(count, jsonfile))
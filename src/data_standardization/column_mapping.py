@@ -0,0 +1,261 @@
+# Declarative column mapping for crash standardization
+# A spec (see crash_specs/vicroads.yml) describes the raw files, how they
+# are joined, the lookup tables and the derived columns; MappingEngine
+# compiles it into whole-column pandas operations
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import pandas as pd
+import yaml
+from tools import run_report
+
+SPEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crash_specs')
+DEFAULT_SPEC = 'vicroads'
+
+
+def load_spec(spec=None):
+    """
+    Load a crash standardization spec
+    Args:
+        spec - the name of a spec in crash_specs (e.g. 'vicroads'),
+            a path to a yml file, or an already loaded dict
+    Returns:
+        spec dict
+    """
+    if isinstance(spec, dict):
+        return spec
+    spec = spec or DEFAULT_SPEC
+    path = spec if os.path.exists(spec) else os.path.join(SPEC_DIR, spec + '.yml')
+    if not os.path.exists(path):
+        raise ValueError('Crash standardization spec {} not found'.format(spec))
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def parse_unique(values, fmt):
+    """
+    Parse a column of date/time strings, parsing each distinct string once
+    Returns:
+        DatetimeIndex, NaT where values are missing
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = pd.to_datetime(pd.Index(uniques), format=fmt)
+    return parsed.take(codes, allow_fill=True, fill_value=pd.NaT)
+
+
+def plain_dtypes(df):
+    """
+    Turn nullable and categorical columns back into numpy dtypes,
+    the types the rest of the pipeline expects
+    """
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+        elif pd.api.types.is_extension_array_dtype(dtype) and pd.api.types.is_integer_dtype(dtype):
+            df[col] = df[col].astype('int64' if not df[col].isna().any() else 'float64')
+        elif pd.api.types.is_signed_integer_dtype(dtype) and dtype != 'int64':
+            # e.g. small int codes read back from parquet
+            df[col] = df[col].astype('int64')
+    return df
+
+
+def op_lookup(args):
+    def apply(df, lookups):
+        table = lookups[args['table']]
+        mapping = pd.Series(table[args['value']].values, index=table[args['key']].values)
+        df[args['column']] = df[args['source']].map(mapping)
+        return df
+    return apply
+
+
+def op_fillna(args):
+    def apply(df, lookups):
+        return df.fillna(args)
+    return apply
+
+
+def op_dropna(args):
+    def apply(df, lookups):
+        return df.dropna(subset=args)
+    return apply
+
+
+def op_require_complete(args):
+    def apply(df, lookups):
+        if args and df.isna().values.any():
+            print('There are still NA values left within crashes_df during standardization')
+            print('Please check this manually. Exiting.')
+            sys.exit(1)
+        return df
+    return apply
+
+
+def op_rename(args):
+    def apply(df, lookups):
+        return df.rename(columns=args)
+    return apply
+
+
+def op_astype(args):
+    def apply(df, lookups):
+        return df.astype(args)
+    return apply
+
+
+def op_flag(args):
+    def apply(df, lookups):
+        df[args['column']] = (df[args['source']] > args['above']).astype(int)
+        return df
+    return apply
+
+
+def op_datetime(args):
+    def apply(df, lookups):
+        value = parse_unique(df[args['date']], args['date_format'])
+        if args.get('time'):
+            # Times are parsed as times on 1900-01-01, keep the offset from midnight
+            times = parse_unique(df[args['time']], args['time_format'])
+            value = value + (times - pd.Timestamp('1900-01-01'))
+        df[args['column']] = value
+        return df
+    return apply
+
+
+def op_datepart(args):
+    def apply(df, lookups):
+        for column, (source, part) in args.items():
+            df[column] = getattr(df[source].dt, part)
+        return df
+    return apply
+
+
+OPERATIONS = {
+    'lookup': op_lookup,
+    'fillna': op_fillna,
+    'dropna': op_dropna,
+    'require_complete': op_require_complete,
+    'rename': op_rename,
+    'astype': op_astype,
+    'flag': op_flag,
+    'datetime': op_datetime,
+    'datepart': op_datepart,
+}
+
+
+class MappingEngine():
+    """
+    Compiled crash standardization spec
+    """
+
+    def __init__(self, spec=None):
+        self.spec = load_spec(spec)
+        self.key = self.spec['key']
+        self.sources = self.spec['sources']
+        self.stream = self.spec.get('stream')
+        self.output = self.spec['output']
+        self.steps = []
+        for step in self.spec.get('steps', []):
+            (name, args), = step.items()
+            if name not in OPERATIONS:
+                raise ValueError('Unknown standardization step {}'.format(name))
+            self.steps.append(OPERATIONS[name](args))
+
+    def read_source(self, raw_dir, name, **kwargs):
+        """
+        Read only the used columns of a raw file, with explicit types
+        Extra keyword arguments (e.g. chunksize) go to read_csv
+        """
+        source = self.sources[name]
+        columns = source['columns']
+        return pd.read_csv(os.path.join(raw_dir, source['file']),
+                           usecols=list(columns), dtype=columns, **kwargs)
+
+    def read_sources(self, raw_dir, names=None):
+        """
+        Read several sources at the same time, one thread per file
+        The C parser releases the GIL while tokenizing, so the reads
+        overlap. Each read is timed in the run report as read_<source>
+        Args:
+            raw_dir
+            names - sources to read, all of them by default
+        Returns:
+            dict of source name to raw DataFrame
+        """
+        names = list(self.sources) if names is None else list(names)
+        parent = run_report.REPORT.current()
+
+        def read(name):
+            with run_report.step('read_' + name, parent=parent) as record:
+                df = self.read_source(raw_dir, name)
+                record['rows_out'] = len(df)
+                record['file'] = self.sources[name]['file']
+            return df
+
+        with ThreadPoolExecutor(max_workers=max(1, len(names))) as executor:
+            return dict(zip(names, executor.map(read, names)))
+
+    def reduce(self, name, df):
+        """
+        Keep a source's join columns, and its first row for each key
+        """
+        return df[self.sources[name]['keep']].drop_duplicates(subset=self.key)
+
+    def make_lookups(self, frames):
+        """
+        Make the lookup tables from the raw (unreduced) source frames
+        Lookups from sources missing from frames are left out
+        Returns:
+            dict of lookup name to DataFrame
+        """
+        lookups = {}
+        for name, lookup in self.spec.get('lookups', {}).items():
+            if 'table' in lookup:
+                lookups[name] = pd.DataFrame(lookup['table'])
+            elif lookup['source'] in frames:
+                lookups[name] = self.merge_lookup(
+                    [frames[lookup['source']][lookup['columns']]])
+        return lookups
+
+    def lookups_from(self, source):
+        """
+        Names of the lookup tables taken from a source
+        """
+        return [name for name, lookup in self.spec.get('lookups', {}).items()
+                if lookup.get('source') == source]
+
+    def merge_lookup(self, parts):
+        """
+        Combine parts of a lookup table, sorted on its code
+        """
+        lookup = plain_dtypes(pd.concat(parts).drop_duplicates())
+        return lookup.sort_values(by=lookup.columns[0]).reset_index(drop=True)
+
+    def join(self, frames, node=None):
+        """
+        Outer join the reduced source frames, following the spec's join order
+        """
+        node = self.spec['join'] if node is None else node
+        if not isinstance(node, list):
+            return frames[node]
+        joined = self.join(frames, node[0])
+        for child in node[1:]:
+            joined = pd.merge(joined, self.join(frames, child), on=self.key,
+                              how='outer', validate='one_to_one')
+        return joined
+
+    def combine(self, frames, lookups):
+        """
+        Join the reduced source frames and apply the spec's steps
+        Args:
+            frames - dict of source name to reduced DataFrame
+            lookups - dict of lookup tables, from make_lookups
+        Returns:
+            standardized DataFrame
+        """
+        df = self.join(frames)
+        for step in self.steps:
+            df = step(df, lookups)
+        df = df[[self.output['index']] + self.output['columns']]
+        df = plain_dtypes(df.set_index(self.output['index']))
+        return df
@@ -0,0 +1,227 @@
+# Streaming json output
+# Writes DataFrames and lists of records a chunk at a time, so the whole
+# serialized document never has to be held in memory, and validates
+# records against a schema in batches, optionally in worker processes
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import itertools
+import json
+import os
+from jsonschema.validators import validator_for
+
+FORMATS = ['array', 'ndjson']
+FRAME_FORMATS = ['index', 'records', 'ndjson']
+
+# Validator for the worker process, set by init_validator
+_WORKER = {'validator': None}
+
+
+class RecordValidationError(ValueError):
+    """
+    Raised when records don't match their schema
+    Args:
+        failures - list of (row number, error message), the first
+            max_errors failures found
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__('{} records failed validation:\n{}'.format(
+            len(failures),
+            '\n'.join('  row {}: {}'.format(row, message) for row, message in failures)))
+
+
+def item_schema(schema):
+    """
+    Schema for a single record
+    The standards' schemas describe an array of records, so use its items
+    """
+    if schema.get('type') == 'array' and 'items' in schema:
+        item = dict(schema['items'])
+        if '$schema' in schema:
+            item['$schema'] = schema['$schema']
+        return item
+    return schema
+
+
+def compile_validator(schema):
+    """
+    Build a validator for a single record once, to be reused for every record
+    Args:
+        schema - schema dict, either for a record or an array of records
+    """
+    schema = item_schema(schema)
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def init_validator(schema):
+    _WORKER['validator'] = compile_validator(schema)
+
+
+def validate_batch(start, records, max_errors, validator=None):
+    """
+    Validate a batch of records
+    Args:
+        start - row number of the first record in the batch
+        records - list of dicts
+        max_errors - stop after this many failures
+        validator - compiled validator, defaults to the worker's
+    Returns:
+        list of (row number, error message)
+    """
+    validator = validator or _WORKER['validator']
+    failures = []
+    for i, record in enumerate(records):
+        for error in validator.iter_errors(record):
+            failures.append((start + i, error.message))
+            break
+        if len(failures) >= max_errors:
+            break
+    return failures
+
+
+def batches(records, batch_size):
+    """
+    Split an iterable of records into lists of at most batch_size
+    """
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_records(records, output_file, schema=None, fmt='array', batch_size=10000,
+                  jobs=1, max_errors=10):
+    """
+    Validate and write records a batch at a time
+    The output is written to a temporary file and only moved into place
+    once every record has passed validation
+    Args:
+        records - iterable of json-serializable dicts, e.g. a generator
+        output_file
+        schema - path to a schema file, or a schema dict; no validation if None
+        fmt - 'array' for a json array (the same as json.dump),
+            'ndjson' for one record per line
+        batch_size - records per batch
+        jobs - number of processes validating batches
+        max_errors - number of failures to report
+    Returns:
+        number of records written
+    Raises:
+        RecordValidationError with the first max_errors failures
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Unknown json format {}'.format(fmt))
+    if schema is not None and not isinstance(schema, dict):
+        with open(schema) as f:
+            schema = json.load(f)
+
+    validator = None
+    executor = None
+    if schema is not None:
+        if jobs > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=jobs, initializer=init_validator, initargs=(schema,))
+        else:
+            validator = compile_validator(schema)
+
+    failures = []
+    pending = deque()
+
+    def collect(future):
+        failures.extend(future.result()[:max_errors - len(failures)])
+
+    tmp_file = output_file + '.tmp'
+    count = 0
+    try:
+        with open(tmp_file, 'w') as f:
+            if fmt == 'array':
+                f.write('[')
+            for batch in batches(records, batch_size):
+                if len(failures) >= max_errors:
+                    # The output will be thrown away, no need to go on
+                    break
+                if schema is not None:
+                    if executor:
+                        pending.append(executor.submit(
+                            validate_batch, count, batch, max_errors))
+                        # Bound the number of batches held for the workers
+                        while len(pending) > 2 * jobs:
+                            collect(pending.popleft())
+                    else:
+                        failures.extend(validate_batch(
+                            count, batch, max_errors - len(failures), validator))
+
+                lines = [json.dumps(record) for record in batch]
+                if fmt == 'array':
+                    f.write((', ' if count else '') + ', '.join(lines))
+                else:
+                    f.write('\n'.join(lines) + '\n')
+                count += len(batch)
+            if fmt == 'array':
+                f.write(']')
+
+        while pending:
+            collect(pending.popleft())
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    finally:
+        if executor:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    if failures:
+        os.remove(tmp_file)
+        raise RecordValidationError(failures)
+    os.replace(tmp_file, output_file)
+    return count
+
+
+def write_frame(df, output_file, fmt='index', chunksize=100000, date_format=None):
+    """
+    Write a DataFrame as json a chunk of rows at a time, using pandas'
+    own serializer for each chunk
+    Args:
+        df
+        output_file
+        fmt - 'index' for the same document as to_json(orient='index'),
+            'records' for a json array, 'ndjson' for one row per line
+        chunksize - rows serialized at a time
+        date_format - passed to to_json, e.g. 'iso'
+    Returns:
+        number of rows written
+    """
+    if fmt not in FRAME_FORMATS:
+        raise ValueError('Unknown json format {}'.format(fmt))
+    if fmt == 'index' and not df.index.is_unique:
+        raise ValueError('DataFrame index must be unique for index format')
+
+    tmp_file = output_file + '.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            if fmt != 'ndjson':
+                f.write('{' if fmt == 'index' else '[')
+            for start in range(0, len(df), chunksize):
+                chunk = df.iloc[start:start + chunksize]
+                if fmt == 'ndjson':
+                    f.write(chunk.to_json(orient='records', lines=True,
+                                          date_format=date_format).rstrip('\n') + '\n')
+                    continue
+                text = chunk.to_json(orient=fmt, date_format=date_format)
+                # Drop the chunk's own brackets, and join it onto the previous one
+                f.write((',' if start else '') + text[1:-1])
+            if fmt != 'ndjson':
+                f.write('}' if fmt == 'index' else ']')
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, output_file)
+    return len(df)
@@ -1,134 +1,280 @@
-# Standardize crash data from VicRoads
+# Standardize crash data, by default from VicRoads
+# The raw files and how they map to standardized columns are described
+# by a spec in crash_specs, see column_mapping.py
 import argparse
+import hashlib
+import json
 import os
 import pandas as pd
 import yaml
-import sys
+from tools import run_report
+from data_standardization.store import write_table, write_partitions, read_table, columnar_path
+from data_standardization.column_mapping import MappingEngine, load_spec, plain_dtypes
+from data_standardization.json_writer import write_frame
 
 pd.options.mode.chained_assignment = None
 
+# Rough number of copies of a chunk alive at once while it is merged
+CHUNK_OVERHEAD = 4
+# Per-accident hashes of the raw rows behind the standardized store,
+# used by incremental standardization to find new and changed accidents
+HASHES_NAME = 'crash_hashes.parquet'
+# Partition of crashes without a date in crashes.parquet
+NO_DATE_PARTITION = 'unknown'
+
+
+@run_report.profiled()
+def read_clean_combine_crash(RAW_CRASH_DIR, max_memory_mb=None, spec=None):
+    """
+    Read the raw crash files and standardize them
+    Args:
+        RAW_CRASH_DIR - directory holding the raw files named in the spec
+        max_memory_mb - if given, stream the largest file in chunks sized
+            to stay under roughly this much memory
+        spec - standardization spec name, path or dict, see column_mapping
+    Returns:
+        crashes DataFrame, dict of mapping name to mapping DataFrame
+    """
+    engine = MappingEngine(spec)
+    if max_memory_mb:
+        return read_clean_combine_crash_chunked(RAW_CRASH_DIR, max_memory_mb, engine)
+
+    frames = engine.read_sources(RAW_CRASH_DIR)
+    run_report.annotate(rows_in=len(frames[engine.stream]))
+
+    # Establish the mappings, then drop unwanted columns from each file
+    # Note: most of the duplicates dropped are legitimate
+    # Chain effects of a crash are given different incident numbers. We will treat it as one crash however.
+    mappings = engine.make_lookups(frames)
+    reduced = {name: engine.reduce(name, df) for name, df in frames.items()}
+    del frames
 
-def read_clean_combine_crash(RAW_CRASH_DIR):
-    # Get file names and read in csv's
-    crash_file = os.path.join(RAW_CRASH_DIR, 'crash.csv')
-    map_file = os.path.join(RAW_CRASH_DIR, 'map.csv')
-    map_inters_file = os.path.join(RAW_CRASH_DIR, 'map_inters.csv')
-    atmosphere_file = os.path.join(RAW_CRASH_DIR, 'atmosphere.csv')
-
-    crash_df = pd.read_csv(crash_file)
-    map_df = pd.read_csv(map_file)
-    map_inters_df = pd.read_csv(map_inters_file)
-    atmosphere_df = pd.read_csv(atmosphere_file)
-
-    # crash_df: drop unwanted columns and establish mappings
-    crash_df_cols_reduced = ['ACCIDENT_NO', 'ACCIDENTDATE', 'ACCIDENTTIME', 'DAY_OF_WEEK', 'LIGHT_CONDITION', 'NODE_ID', 'ROAD_GEOMETRY', 'SPEED_ZONE']
-    geom_mapping_cols = ['ROAD_GEOMETRY', 'Road Geometry Desc']
-    accident_type_mapping_cols = ['ACCIDENT_TYPE', 'Accident Type Desc']
-    DCA_code_mapping_cols = ['DCA_CODE', 'DCA Description']
-    light_condition_mapping_cols = ['LIGHT_CONDITION', 'Light Condition Desc']
-
-    geom_mapping = crash_df[geom_mapping_cols]
-    geom_mapping = geom_mapping.drop_duplicates().sort_values(by='ROAD_GEOMETRY').reset_index(drop=True)
-
-    accident_type_mapping = crash_df[accident_type_mapping_cols]
-    accident_type_mapping = accident_type_mapping.drop_duplicates().sort_values(by='ACCIDENT_TYPE').reset_index(drop=True)
-
-    light_condition_mapping = crash_df[light_condition_mapping_cols]
-    light_condition_mapping = light_condition_mapping.drop_duplicates().sort_values(by='LIGHT_CONDITION').reset_index(drop=True)
-
-    DCA_code_mapping = crash_df[DCA_code_mapping_cols]
-    DCA_code_mapping = DCA_code_mapping.drop_duplicates().sort_values(by="DCA_CODE").reset_index(drop=True)
-
-    crash_df_reduced = crash_df[crash_df_cols_reduced]
-
-    # Map_df: drop unwanted columns, create node type mapping
-    node_type_mapping = pd.DataFrame({'NODE_TYPE_INT': [0, 1, 2, 3], 'NODE_TYPE': ['I', 'N', 'O', 'U'], 'NODE_DESC': ['Intersection', 'Non-intersection', 'Off-road', 'Unknown']})
-
-    map_df['NODE_TYPE_INT'] = ""
-    for index, row in node_type_mapping.iterrows():
-        map_df['NODE_TYPE_INT'].loc[map_df['NODE_TYPE'] == row['NODE_TYPE']] = row['NODE_TYPE_INT']
+    crashes_df = engine.combine(reduced, mappings)
+    return crashes_df, mappings
 
-    map_df_reduced_cols = ['ACCIDENT_NO', 'NODE_ID', 'NODE_TYPE_INT', 'LGA_NAME', 'Deg Urban Name', 'Lat', 'Long']
-    map_df_reduced = map_df[map_df_reduced_cols]
 
-    # map_iters_df: drop unwanted columns, creat node-to-complex node mapping
-    complex_node_mapping_cols = ['NODE_ID', 'COMPLEX_INT_NO']
-    complex_node_mapping = map_inters_df[complex_node_mapping_cols]
-    complex_node_mapping = complex_node_mapping.drop_duplicates().sort_values(by="NODE_ID").reset_index(drop=True)
+def chunk_rows(engine, RAW_CRASH_DIR, budget_bytes, sample_rows=1000):
+    """
+    Number of rows of the streamed file per chunk that fit in the
+    memory budget, estimated from the size of the first few rows
+    """
+    sample = engine.read_source(RAW_CRASH_DIR, engine.stream, nrows=sample_rows)
+    if len(sample) == 0:
+        return sample_rows
+    row_bytes = sample.memory_usage(deep=True).sum() / len(sample)
+    return max(sample_rows, int(budget_bytes / (row_bytes * CHUNK_OVERHEAD)))
+
+
+def outer_merge_sorts():
+    """
+    Whether outer merges sort their keys
+    pandas before 2.2 keeps the left frame's order, later versions sort
+    """
+    left = pd.DataFrame({'key': ['b', 'a']})
+    right = pd.DataFrame({'key': ['a', 'b']})
+    merged = pd.merge(left, right, on='key', how='outer')
+    return list(merged['key']) == ['a', 'b']
+
+
+def read_clean_combine_crash_chunked(RAW_CRASH_DIR, max_memory_mb, engine):
+    """
+    Same output as read_clean_combine_crash, but the spec's stream file
+    is read in chunks
+    Args:
+        RAW_CRASH_DIR
+        max_memory_mb - approximate memory ceiling for the raw data
+        engine - MappingEngine for the spec
+    Returns:
+        crashes DataFrame, dict of mappings
+    """
+    key = engine.key
+
+    # The smaller files are needed in full to look up each chunk's accidents
+    side = engine.read_sources(
+        RAW_CRASH_DIR, [name for name in engine.sources if name != engine.stream])
+    mappings = engine.make_lookups(side)
+    side = {name: engine.reduce(name, df).set_index(key, drop=False)
+            for name, df in side.items()}
+
+    lookup_bytes = sum(df.memory_usage(deep=True).sum() for df in side.values())
+    budget_bytes = max_memory_mb * 1024 * 1024 - lookup_bytes
+    if budget_bytes <= 0:
+        print('Lookup tables alone use {:.0f}MB, over the {}MB ceiling'.format(
+            lookup_bytes / (1024 * 1024), max_memory_mb))
+    chunksize = chunk_rows(engine, RAW_CRASH_DIR, budget_bytes)
+    print('Reading {} in chunks of {} rows'.format(
+        engine.sources[engine.stream]['file'], chunksize))
+
+    lookup_parts = {name: [] for name in engine.lookups_from(engine.stream)}
+    seen = set()
+    crash_parts = []
+    rows_in = 0
+    for chunk in engine.read_source(RAW_CRASH_DIR, engine.stream, chunksize=chunksize):
+        rows_in += len(chunk)
+        for name, table in engine.make_lookups({engine.stream: chunk}).items():
+            if name in lookup_parts:
+                lookup_parts[name].append(table)
+
+        # Keep the first row for each accident across all chunks
+        chunk = engine.reduce(engine.stream, chunk)
+        chunk = chunk[~chunk[key].isin(seen)]
+        if len(chunk) == 0:
+            continue
+        seen.update(chunk[key])
+
+        frames = {name: df.loc[df.index.intersection(chunk[key])].reset_index(drop=True)
+                  for name, df in side.items()}
+        frames[engine.stream] = chunk
+        crash_parts.append(engine.combine(frames, mappings))
+    run_report.annotate(rows_in=rows_in)
+
+    # Accidents missing from the stream file go through the spec's steps
+    # like the rest, so they are dropped or rejected the same way
+    orphans = {name: df[~df.index.isin(seen)].reset_index(drop=True)
+               for name, df in side.items()}
+    if any(len(df) for df in orphans.values()):
+        orphans[engine.stream] = pd.DataFrame(
+            columns=engine.sources[engine.stream]['keep'])
+        crash_parts.append(engine.combine(orphans, mappings))
+
+    # Put the chunks in the same order the full outer joins would
+    crashes_df = pd.concat(crash_parts)
+    if outer_merge_sorts():
+        crashes_df = crashes_df.sort_index()
+
+    # Combine the mappings found in each chunk, in the spec's order
+    for name, parts in lookup_parts.items():
+        mappings[name] = engine.merge_lookup(parts)
+    mappings = {name: mappings[name] for name in engine.spec['lookups']}
 
-    map_inters_df_reduced = map_inters_df[['ACCIDENT_NO', 'COMPLEX_INT_NO']]
+    return crashes_df, mappings
 
-    # atmosphere_df: drop unwanted columns, create atmosphere mapping
-    atmosphere_mapping_cols = ['ATMOSPH_COND', 'Atmosph Cond Desc']
-    atmosphere_mapping = atmosphere_df[atmosphere_mapping_cols]
-    atmosphere_mapping = atmosphere_mapping.drop_duplicates().sort_values(by="ATMOSPH_COND").reset_index(drop=True)
 
-    atmosphere_df_reduced_cols = ['ACCIDENT_NO', 'ATMOSPH_COND']
-    atmosphere_df_reduced = atmosphere_df[atmosphere_df_reduced_cols]
-
-    # Drop duplicates from all dataframes
-    # Note: most of these duplicates are legitimate
-    # Chain effects of a crash are given different incident numbers. We will treat it as one crash however.
-    crash_df_reduced.drop_duplicates(subset="ACCIDENT_NO", inplace=True)
-    map_df_reduced.drop_duplicates(subset="ACCIDENT_NO", inplace=True)
-    map_inters_df_reduced.drop_duplicates(subset="ACCIDENT_NO", inplace=True)
-    atmosphere_df_reduced.drop_duplicates(subset="ACCIDENT_NO", inplace=True)
-
-    # Begin joining dataframes on 'ACCIDENT_NO'.
-    # Joining by 'outer', means that if some accident numbers are in one DF but not in another, the accident will still be recorded but will be missing columns
-    # The validate option ensures that when merging, each DF only has one instance of each accident number
-    crashes_and_atmos = pd.merge(crash_df_reduced, atmosphere_df_reduced, on='ACCIDENT_NO', how='outer', validate='one_to_one')
-    inters_and_complex = pd.merge(map_df_reduced, map_inters_df_reduced, on='ACCIDENT_NO', how='outer', validate='one_to_one')
-    crashes_df = pd.merge(crashes_and_atmos, inters_and_complex, on='ACCIDENT_NO', how='outer', validate='one_to_one')
-
-    # Many NA's within the 'COMPLEX_INT_NO' column. Fill some of these.
-    # Some NA's associated with strange NODE_ID's from original crash DF, meaning we couldn't map to Lat / Lon. Remove these.
-    # Drop the extra 'NODE_ID' column we have gained
-    crashes_df['COMPLEX_INT_NO'] = crashes_df['COMPLEX_INT_NO'].fillna(0)
-    crashes_df.dropna(subset=['Lat', 'Long'], inplace=True)
-    crashes_df.drop(['NODE_ID_y'], axis=1, inplace=True)
-
-    # Make sure there are no more NA values left anywhere within DF
-    if len(crashes_df[crashes_df.isna().any(axis=1)]) != 0:
-        print('There are still NA values left within crashes_df during standardization')
-        print('Please check this manually. Exiting.')
-        sys.exit(1)
-
-    # Standardize column names
-    crashes_df.rename(columns={"NODE_ID_x": "NODE_ID", "ACCIDENTDATE": "ACCIDENT_DATE", "ACCIDENTTIME": "ACCIDENT_TIME",
-                               "LGA_NAME": "SUBURB", "Deg Urban Name": "DEGREE_URBAN", "Lat": "LAT", "Long": "LON", "LIGHT_CONDITION": "LIGHT_COND"}, inplace=True)
-
-    # Change dtype of columns to integers [these were changed due to the merge step creating NA values]
-    crashes_df[['NODE_ID', 'COMPLEX_INT_NO']] = crashes_df[['NODE_ID', 'COMPLEX_INT_NO']].astype(int)
-
-    # Feature engineering
-    # Add a binary value for if a crash occured at a complex node
-    # Add values for Hour / Month as seasonality features
-    crashes_df['COMPLEX_NODE'] = 0
-    crashes_df['COMPLEX_NODE'].loc[crashes_df['COMPLEX_INT_NO'] > 0] = 1
-    crashes_df['DATE_TIME'] = pd.to_datetime(crashes_df['ACCIDENT_DATE'] + " " + crashes_df['ACCIDENT_TIME'], format="%d/%m/%Y %H.%M.%S")
-    crashes_df['HOUR'] = crashes_df.DATE_TIME.dt.hour
-    crashes_df['MONTH'] = crashes_df.DATE_TIME.dt.month
-
-    # Once again drop unwanted columns
-    crashes_df.drop(['ACCIDENT_DATE', 'ACCIDENT_TIME', 'COMPLEX_INT_NO'], axis=1, inplace=True)
-
-    # Reorder columns for easier reading
-    crashes_df = crashes_df[['ACCIDENT_NO', 'DATE_TIME', 'MONTH', 'HOUR', 'DAY_OF_WEEK', 'LAT', 'LON', 'SUBURB', 'NODE_ID', 'NODE_TYPE_INT', 'COMPLEX_NODE', 'LIGHT_COND', 'ATMOSPH_COND', 'SPEED_ZONE', 'ROAD_GEOMETRY', 'DEGREE_URBAN']]
-
-    # Set 'ACCIDENT_NO' to be the index
-    crashes_df.set_index('ACCIDENT_NO', inplace=True)
-
-    # Put various mappings into a tuple to allow for easier transport
-    mappings = (geom_mapping, accident_type_mapping, DCA_code_mapping, light_condition_mapping, node_type_mapping, atmosphere_mapping)
-
-    return crashes_df, mappings
+def key_hashes(engine, frames):
+    """
+    Hash the raw rows of each key across all of the spec's sources
+    A key's hash changes when any of its rows in any file changes
+    (including their order), or when the spec itself changes
+    Args:
+        engine - MappingEngine for the spec
+        frames - dict of source name to raw DataFrame, as read by read_source
+    Returns:
+        Series of uint64 hashes indexed by key
+    """
+    key = engine.key
+    per_source = {}
+    for name, df in frames.items():
+        rows = df.assign(_ROW=df.groupby(key).cumcount())
+        row_hashes = pd.util.hash_pandas_object(rows, index=False)
+        # uint64 sums wrap around, which is fine for combining hashes
+        per_source[name] = pd.Series(row_hashes.values, index=df[key].values).groupby(level=0).sum()
+
+    keys = pd.Index([])
+    for hashes in per_source.values():
+        keys = keys.union(hashes.index)
+    combined = pd.DataFrame({name: hashes.reindex(keys, fill_value=0)
+                             for name, hashes in per_source.items()}, index=keys)
+    combined['_SPEC'] = hashlib.sha256(
+        json.dumps(engine.spec, sort_keys=True).encode('utf-8')).hexdigest()
+    hashes = pd.util.hash_pandas_object(combined, index=True)
+    hashes.index.name = key
+    return hashes
+
+
+def read_hashes(PROCESSED_CRASH_DIR):
+    """
+    Read the key hashes saved by output_crash_hashes
+    Returns:
+        Series of hashes indexed by key, or None if there aren't any
+    """
+    path = os.path.join(PROCESSED_CRASH_DIR, HASHES_NAME)
+    if not os.path.exists(path):
+        return None
+    return read_table(path)['ROW_HASH']
+
+
+def read_mappings(PROCESSED_MAPPING_DIR, engine):
+    """
+    Read the previously written mappings taken from the raw files
+    Returns:
+        dict of mapping name to DataFrame, for the mappings found
+    """
+    mappings = {}
+    for name, lookup in engine.spec.get('lookups', {}).items():
+        path = os.path.join(PROCESSED_MAPPING_DIR, name + '.csv')
+        if 'source' in lookup and (os.path.exists(path) or os.path.exists(columnar_path(path))):
+            mappings[name] = read_table(path, index_col=0)
+    return mappings
+
+
+@run_report.profiled()
+def read_clean_combine_crash_incremental(RAW_CRASH_DIR, PROCESSED_CRASH_DIR,
+                                         PROCESSED_MAPPING_DIR, spec=None):
+    """
+    Standardize only the accidents that are new or changed since the
+    standardized store was written, and upsert them into it
+    Accidents no longer in the raw files are kept, the store is append-only
+    With no saved hashes or store, everything is standardized
+    Args:
+        RAW_CRASH_DIR
+        PROCESSED_CRASH_DIR - holds the existing crashes and their hashes
+        PROCESSED_MAPPING_DIR - holds the existing mappings
+        spec - standardization spec name, path or dict
+    Returns:
+        crashes DataFrame, dict of mappings, Series of key hashes
+        to save with output_crash_hashes once the crashes are written,
+        and the crashes.parquet partitions the new and changed accidents
+        are in (None if the whole store is new), see output_crash_parquet
+    """
+    engine = MappingEngine(spec)
+    key = engine.key
+    frames = engine.read_sources(RAW_CRASH_DIR)
+    run_report.annotate(rows_in=len(frames[engine.stream]))
+    hashes = key_hashes(engine, frames)
+
+    old_hashes = read_hashes(PROCESSED_CRASH_DIR)
+    existing = None
+    if old_hashes is not None:
+        crashes_path = os.path.join(PROCESSED_CRASH_DIR, 'crashes.csv')
+        if os.path.exists(crashes_path) or os.path.exists(columnar_path(crashes_path)):
+            existing = plain_dtypes(read_crashes(PROCESSED_CRASH_DIR))
+
+    if existing is None:
+        delta = hashes.index
+    else:
+        common = hashes.index.intersection(old_hashes.index)
+        changed = common[hashes[common].values != old_hashes[common].values]
+        delta = hashes.index.difference(old_hashes.index).append(changed)
+        kept = old_hashes.index.difference(hashes.index)
+        # Keep the hashes of accidents no longer in the raw files,
+        # so they don't look new if they come back unchanged
+        hashes = pd.concat([hashes, old_hashes[kept]])
+        print('{} new, {} changed and {} missing accidents'.format(
+            len(delta) - len(changed), len(changed), len(kept)))
+    run_report.annotate(rows_changed=len(delta))
+
+    frames = {name: df[df[key].isin(delta)] for name, df in frames.items()}
+    mappings = engine.make_lookups(frames)
+    if existing is not None:
+        for name, mapping in read_mappings(PROCESSED_MAPPING_DIR, engine).items():
+            mappings[name] = engine.merge_lookup([mapping, mappings[name]])
+
+    reduced = {name: engine.reduce(name, df) for name, df in frames.items()}
+    del frames
+    crashes_df = engine.combine(reduced, mappings)
+    partitions = None
+    if existing is not None:
+        # Changed accidents are replaced, or removed if the spec now drops them
+        replaced = existing.index.isin(delta)
+        partitions = set(crash_partitions(existing[replaced])) \
+            | set(crash_partitions(crashes_df))
+        crashes_df = pd.concat([existing[~replaced], crashes_df])
+
+    return crashes_df, mappings, hashes, partitions
 
 
 def output_crash_csv(PROCESSED_CRASH_DIR, PROCESSED_MAPPING_DIR, crashes_df, mappings):
 
-    geom_mapping, accident_type_mapping, DCA_code_mapping, light_condition_mapping, node_type_mapping, atmosphere_mapping = mappings
-
     # Output resulting crashes_df and all mappings
     if not os.path.exists(PROCESSED_CRASH_DIR):
         os.makedirs(PROCESSED_CRASH_DIR)
@@ -139,19 +285,80 @@ def output_crash_csv(PROCESSED_CRASH_DIR, PROCESSED_MAPPING_DIR, crashes_df, map
     crashes_path = os.path.join(PROCESSED_CRASH_DIR, 'crashes.csv')
     crashes_df.to_csv(crashes_path)
 
-    mapping_dfs = [geom_mapping, accident_type_mapping, DCA_code_mapping,
-                   light_condition_mapping, node_type_mapping, atmosphere_mapping]
-    mapping_names = ['geom_mapping.csv', 'accident_type_mapping.csv', 'DCA_code_mapping.csv',
-                     'light_condition_mapping.csv', 'node_type_mapping.csv', 'atmosphere_mapping.csv']
-
-    for mapping_df, mapping_name in zip(mapping_dfs, mapping_names):
-        save_path = os.path.join(PROCESSED_MAPPING_DIR, mapping_name)
+    for mapping_name, mapping_df in mappings.items():
+        save_path = os.path.join(PROCESSED_MAPPING_DIR, mapping_name + '.csv')
         mapping_df.to_csv(save_path)
 
 
-def output_crash_json(PROCESSED_CRASH_DIR, crashes_df):
-    output_file = PROCESSED_CRASH_DIR + '/crashes.json'
-    crashes_df.to_json(output_file, orient='index')
+def output_crash_json(PROCESSED_CRASH_DIR, crashes_df, fmt='index'):
+    """
+    Write crashes as json, a chunk of rows at a time
+    Args:
+        PROCESSED_CRASH_DIR
+        crashes_df
+        fmt - 'index' for crashes.json, keyed by ACCIDENT_NO,
+            or 'ndjson' for crashes.ndjson, one crash per line
+    """
+    if fmt == 'ndjson':
+        write_frame(crashes_df.reset_index(), os.path.join(PROCESSED_CRASH_DIR, 'crashes.ndjson'),
+                    fmt='ndjson', date_format='iso')
+    else:
+        write_frame(crashes_df, os.path.join(PROCESSED_CRASH_DIR, 'crashes.json'), fmt='index')
+
+
+def crash_partitions(crashes_df):
+    """
+    Partition of each crash in crashes.parquet, the year of its date
+    """
+    years = pd.to_datetime(crashes_df['DATE_TIME']).dt.year
+    return years.astype('Int64').astype(str).where(years.notna(), NO_DATE_PARTITION)
+
+
+def output_crash_parquet(PROCESSED_CRASH_DIR, PROCESSED_MAPPING_DIR, crashes_df, mappings,
+                         spec=None, partitions=None):
+    """
+    Write crashes and mappings in typed columnar form
+    DATE_TIME stays a timestamp, the spec's code columns are stored
+    as small ints and its category columns dictionary encoded
+    Crashes are stored a year per file in crashes.parquet, so an
+    incremental run only rewrites the years it changed. The mappings
+    are small lookup tables and are always written in full
+    Args:
+        partitions - only rewrite these partitions of crashes.parquet,
+            e.g. from read_clean_combine_crash_incremental; all of them
+            by default
+    """
+    output = load_spec(spec)['output']
+    write_partitions(crashes_df, os.path.join(PROCESSED_CRASH_DIR, 'crashes.parquet'),
+                     crash_partitions(crashes_df), names=partitions,
+                     codes=output.get('codes'), categories=output.get('categories'))
+
+    for mapping_name, mapping_df in mappings.items():
+        write_table(mapping_df, os.path.join(PROCESSED_MAPPING_DIR, mapping_name + '.parquet'))
+
+
+def output_crash_hashes(PROCESSED_CRASH_DIR, hashes):
+    """
+    Save the key hashes of the standardized crashes, for the next
+    incremental run. Write these after the crashes themselves, so an
+    interrupted run is redone rather than skipped
+    """
+    write_table(hashes.to_frame('ROW_HASH'), os.path.join(PROCESSED_CRASH_DIR, HASHES_NAME))
+
+
+def read_crashes(PROCESSED_CRASH_DIR, columns=None):
+    """
+    Read standardized crashes, from crashes.parquet if it exists
+    and from crashes.csv otherwise
+    Args:
+        PROCESSED_CRASH_DIR
+        columns - optional list of columns to read
+    Returns:
+        DataFrame indexed by ACCIDENT_NO
+    """
+    return read_table(os.path.join(PROCESSED_CRASH_DIR, 'crashes.csv'),
+                      columns=columns, index_col='ACCIDENT_NO',
+                      parse_dates=['DATE_TIME'])
 
 
 if __name__ == '__main__':
@@ -163,6 +370,17 @@ if __name__ == '__main__':
                         help="data directory")
     parser.add_argument("-v", "--verbose", type=bool, required=False,
                         help="verbose logging: True or False")
+    parser.add_argument("-f", "--format", choices=['text', 'parquet', 'all'], default='all',
+                        help="write csv/json (text), parquet, or all of them; " +
+                        "incremental runs always write parquet")
+    parser.add_argument("-m", "--max_memory_mb", type=int, required=False,
+                        help="stream the crash file to stay under this much memory (MB)")
+    parser.add_argument("-s", "--spec", type=str, required=False,
+                        help="crash standardization spec, a name in crash_specs or a path")
+    parser.add_argument("-i", "--incremental", action='store_true',
+                        help="only standardize accidents that are new or changed since the last run")
+    parser.add_argument("--json_format", choices=['index', 'ndjson'], default='index',
+                        help="crashes.json keyed by accident, or crashes.ndjson with a crash per line")
     args = parser.parse_args()
 
     # Load config
@@ -181,6 +399,30 @@ if __name__ == '__main__':
         print('Did not find data_dir file')
         raise SystemExit(RAW_CRASH_DIR + " not found, exiting")
 
-    crashes_df, mappings = read_clean_combine_crash(RAW_CRASH_DIR)
-    output_crash_csv(PROCESSED_CRASH_DIR, PROCESSED_MAPPING_DIR, crashes_df, mappings)
-    output_crash_json(PROCESSED_CRASH_DIR, crashes_df)
+    spec = args.spec or config.get('crash_standardization')
+    hashes = None
+    partitions = None
+    if args.incremental:
+        crashes_df, mappings, hashes, partitions = read_clean_combine_crash_incremental(
+            RAW_CRASH_DIR, PROCESSED_CRASH_DIR, PROCESSED_MAPPING_DIR, spec=spec)
+    else:
+        crashes_df, mappings = read_clean_combine_crash(
+            RAW_CRASH_DIR, max_memory_mb=args.max_memory_mb, spec=spec)
+    # The csv and json are single files read whole by data generation,
+    # and changed accidents can be anywhere in them, so they're always
+    # rewritten in full; incremental runs only rewrite changed years of
+    # the parquet store
+    if args.format in ('text', 'all'):
+        with run_report.step('output_crash_csv', rows_in=len(crashes_df)):
+            output_crash_csv(PROCESSED_CRASH_DIR, PROCESSED_MAPPING_DIR, crashes_df, mappings)
+        with run_report.step('output_crash_json', rows_in=len(crashes_df)):
+            output_crash_json(PROCESSED_CRASH_DIR, crashes_df, fmt=args.json_format)
+    # The saved hashes describe the parquet store, which the next
+    # incremental run reads, so it's always written in incremental mode
+    if args.format in ('parquet', 'all') or args.incremental:
+        with run_report.step('output_crash_parquet', rows_in=len(crashes_df)):
+            output_crash_parquet(PROCESSED_CRASH_DIR, PROCESSED_MAPPING_DIR, crashes_df, mappings,
+                                 spec=spec, partitions=partitions)
+    if hashes is not None:
+        output_crash_hashes(PROCESSED_CRASH_DIR, hashes)
+    run_report.REPORT.write(os.path.join(data_dir, 'processed'))
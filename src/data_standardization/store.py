@@ -0,0 +1,166 @@
+# Typed columnar (parquet) storage for standardized and processed data
+# Parquet keeps dtypes (timestamps, small integer codes, categoricals)
+# so readers don't have to re-parse text and re-infer types,
+# and lets them read only the columns they need
+# A table can also be stored as a directory of partitions, one parquet
+# file per partition, so an update only rewrites the partitions it touches
+import os
+import shutil
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+TEXT_EXTENSIONS = ['.csv.gz', '.csv', '.json.gz', '.json', '.pk']
+
+
+def columnar_path(path):
+    """
+    Path of the parquet file stored alongside a text/pickle file
+    e.g. processed/crash/crashes.csv -> processed/crash/crashes.parquet
+    """
+    for ext in TEXT_EXTENSIONS:
+        if path.endswith(ext):
+            return path[:-len(ext)] + '.parquet'
+    if path.endswith('.parquet'):
+        return path
+    return path + '.parquet'
+
+
+def downcast_codes(df, columns):
+    """
+    Store integer code columns in the smallest integer type that fits
+    Columns that aren't in the DataFrame are ignored
+    """
+    for col in columns:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+
+def write_table(df, path, codes=None, categories=None):
+    """
+    Write a DataFrame (and its index) to parquet
+    Args:
+        df
+        path - output path; text extensions are swapped for .parquet
+        codes - integer code columns to downcast to small ints
+        categories - string columns to store dictionary encoded
+    Returns:
+        the path written to
+    """
+    path = columnar_path(path)
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    df = df.copy()
+    downcast_codes(df, codes or [])
+    for col in categories or []:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    df.to_parquet(path, engine='pyarrow')
+    return path
+
+
+def partition_path(path, name):
+    return os.path.join(columnar_path(path), '{}.parquet'.format(name))
+
+
+def write_partitions(df, path, partitions, names=None, codes=None, categories=None):
+    """
+    Write a DataFrame as a directory of parquet partitions
+    Args:
+        df
+        path - output path, the directory; text extensions are swapped
+            for .parquet
+        partitions - partition name of each row, aligned with df
+        names - only rewrite these partitions, removing any left without
+            rows, and keep the others as they are; by default the whole
+            table is rewritten
+        codes, categories - see write_table
+    Returns:
+        list of the partition files written or removed
+    """
+    directory = columnar_path(path)
+    partitions = pd.Series(partitions, index=df.index).astype(str)
+    if names is None or not os.path.isdir(directory):
+        # A full rewrite, which also replaces a table stored as one file
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        elif os.path.exists(directory):
+            os.remove(directory)
+        names = partitions.unique()
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    changed = []
+    for name in sorted(set(str(n) for n in names)):
+        part = partition_path(path, name)
+        rows = df[(partitions == name).values]
+        if len(rows):
+            # Written aside and moved into place, hidden from readers meanwhile
+            tmp = os.path.join(directory, '.{}.tmp.parquet'.format(name))
+            write_table(rows, tmp, codes=codes, categories=categories)
+            os.replace(tmp, part)
+        elif os.path.exists(part):
+            os.remove(part)
+        else:
+            continue
+        changed.append(part)
+    return changed
+
+
+def read_partitions(directory, columns=None):
+    """
+    Read a directory of parquet partitions back into one DataFrame,
+    in partition name order
+    """
+    frames = [pd.read_parquet(os.path.join(directory, name), columns=columns, engine='pyarrow')
+              for name in sorted(os.listdir(directory))
+              if name.endswith('.parquet') and not name.startswith('.')]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    # Each partition has its own categories
+    categorical = [col for col in frames[0].columns
+                   if isinstance(frames[0][col].dtype, pd.CategoricalDtype)]
+    merged = {col: union_categoricals([df[col] for df in frames]) for col in categorical}
+    df = pd.concat(frames)
+    for col, values in merged.items():
+        df[col] = pd.Categorical(values, categories=values.categories)
+    return df
+
+
+def read_table(path, columns=None, index_col=None, parse_dates=None):
+    """
+    Read a table, preferring the parquet copy if there is one
+    Args:
+        path - path of the table, either the parquet file or its
+            text equivalent (csv, csv.gz, json or pickle)
+        columns - optional list of columns to read
+        index_col - index column of the text version, if any
+        parse_dates - date columns to parse when reading csv
+    Returns:
+        DataFrame
+    """
+    parquet = columnar_path(path)
+    if os.path.isdir(parquet):
+        return read_partitions(parquet, columns=columns)
+    if os.path.exists(parquet):
+        return pd.read_parquet(parquet, columns=columns, engine='pyarrow')
+
+    if path.endswith('.pk'):
+        df = pd.read_pickle(path)
+    elif path.endswith('.json') or path.endswith('.json.gz'):
+        df = pd.read_json(path, orient='index')
+    else:
+        usecols = None
+        if columns is not None:
+            usecols = list(columns) + ([index_col] if index_col else [])
+        if parse_dates and columns is not None:
+            parse_dates = [c for c in parse_dates if c in columns]
+        return pd.read_csv(path, usecols=usecols, index_col=index_col,
+                           parse_dates=parse_dates)
+
+    if columns is not None:
+        df = df[columns]
+    return df
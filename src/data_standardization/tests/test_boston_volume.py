@@ -0,0 +1,65 @@
+import os
+import openpyxl
+from ..Archive import boston_volume
+
+ATR_NAME = '7362_NA_NA_147_TRAIN-ST_DORCHESTER_24-HOURS_XXX_03-19-2014.XLSX'
+
+
+def write_atr(path, volume=120):
+    wb = openpyxl.Workbook()
+    wb.active.title = 'Volume'
+    wb['Volume']['F106'] = volume
+    wb.create_sheet('Speed-1')['E42'] = 31.5
+    sheet = wb.create_sheet('Classification-Combined')
+    sheet['D38'], sheet['D39'], sheet['D40'] = 2, 100, 18
+    for row in range(9, 33):
+        sheet['O{}'.format(row)] = row
+    wb.save(path)
+
+
+def test_read_ATR(tmpdir):
+    path = str(tmpdir.join(ATR_NAME))
+    write_atr(path)
+    assert boston_volume.read_ATR(path) == (
+        120, 31.5, 2, 100, 18, '2014-03-19', list(range(9, 33)))
+
+
+def test_read_ATRs_cached(tmpdir, monkeypatch):
+    paths = [str(tmpdir.join(ATR_NAME)),
+             str(tmpdir.join(ATR_NAME.replace('7362', '7363')))]
+    for path in paths:
+        write_atr(path)
+    cache_path = str(tmpdir.join('parsed_atrs.json'))
+
+    results = boston_volume.read_ATRs(paths, cache_path=cache_path, jobs=2)
+    assert results[paths[0]] == boston_volume.read_ATR(paths[0])
+
+    # Unchanged files are never reopened, changed ones are
+    write_atr(paths[1], volume=7)
+    os.utime(paths[1], (0, 0))
+    opened = []
+    monkeypatch.setattr(boston_volume, 'ProcessPoolExecutor', FakeExecutor)
+    monkeypatch.setattr(boston_volume, 'read_ATR',
+                        lambda path: opened.append(path) or ('reread',))
+    results = boston_volume.read_ATRs(paths, cache_path=cache_path)
+    assert opened == [paths[1]]
+    assert results[paths[0]][0] == 120
+    assert results[paths[1]] == ('reread',)
+
+
+class FakeExecutor():
+    """
+    Runs in this process, so read_ATR can be patched
+    """
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def map(self, func, items, chunksize=1):
+        return map(func, items)
@@ -0,0 +1,110 @@
+import os
+import pandas as pd
+import pytest
+from .. import column_mapping
+from tools import run_report
+
+
+def make_spec():
+    return {
+        'key': 'ID',
+        'sources': {
+            'crash': {
+                'file': 'crash.csv',
+                'columns': {'ID': 'str', 'DATE': 'str', 'TIME': 'str',
+                            'TYPE': 'Int8', 'Type Desc': 'str'},
+                'keep': ['ID', 'DATE', 'TIME', 'TYPE'],
+            },
+            'place': {
+                'file': 'place.csv',
+                'columns': {'ID': 'str', 'KIND': 'str', 'Lat': 'float64'},
+                'keep': ['ID', 'KIND', 'Lat'],
+            },
+        },
+        'stream': 'crash',
+        'join': ['crash', 'place'],
+        'lookups': {
+            'type_mapping': {'source': 'crash', 'columns': ['TYPE', 'Type Desc']},
+            'kind_mapping': {'table': {'KIND_INT': [0, 1], 'KIND': ['A', 'B']}},
+        },
+        'steps': [
+            {'lookup': {'column': 'KIND_INT', 'source': 'KIND', 'table': 'kind_mapping',
+                        'key': 'KIND', 'value': 'KIND_INT'}},
+            {'dropna': ['Lat']},
+            {'require_complete': True},
+            {'rename': {'Lat': 'LAT'}},
+            {'flag': {'column': 'IS_B', 'source': 'KIND_INT', 'above': 0}},
+            {'datetime': {'column': 'DATE_TIME', 'date': 'DATE', 'date_format': '%d/%m/%Y',
+                          'time': 'TIME', 'time_format': '%H.%M.%S'}},
+            {'datepart': {'HOUR': ['DATE_TIME', 'hour']}},
+        ],
+        'output': {
+            'index': 'ID',
+            'columns': ['DATE_TIME', 'HOUR', 'TYPE', 'KIND_INT', 'IS_B', 'LAT'],
+        },
+    }
+
+
+def test_load_spec():
+    spec = column_mapping.load_spec('vicroads')
+    assert spec['key'] == 'ACCIDENT_NO'
+    assert column_mapping.load_spec(spec) is spec
+    with pytest.raises(ValueError):
+        column_mapping.load_spec('not_a_spec')
+
+
+def test_unknown_step():
+    spec = make_spec()
+    spec['steps'].append({'explode': True})
+    with pytest.raises(ValueError):
+        column_mapping.MappingEngine(spec)
+
+
+def test_combine(tmpdir):
+    pd.DataFrame({
+        'ID': ['a', 'b', 'b', 'c'],
+        'DATE': ['01/02/2006', '13/01/2006', '13/01/2006', '01/02/2006'],
+        'TIME': ['12.42.00', '19.10.00', '19.10.00', '01.00.00'],
+        'TYPE': [2, 1, 1, 2],
+        'Type Desc': ['two', 'one', 'one', 'two'],
+        'UNUSED': [0, 0, 0, 0],
+    }).to_csv(os.path.join(str(tmpdir), 'crash.csv'), index=False)
+    pd.DataFrame({
+        'ID': ['a', 'b', 'c'],
+        'KIND': ['A', 'B', 'A'],
+        'Lat': [-37.8, -37.9, None],
+    }).to_csv(os.path.join(str(tmpdir), 'place.csv'), index=False)
+
+    engine = column_mapping.MappingEngine(make_spec())
+    frames = {name: engine.read_source(str(tmpdir), name) for name in engine.sources}
+    lookups = engine.make_lookups(frames)
+    assert list(lookups['type_mapping']['TYPE']) == [1, 2]
+
+    reduced = {name: engine.reduce(name, df) for name, df in frames.items()}
+    result = engine.combine(reduced, lookups)
+
+    assert list(result.index) == ['a', 'b']
+    assert list(result['DATE_TIME']) == [pd.Timestamp('2006-02-01 12:42'),
+                                         pd.Timestamp('2006-01-13 19:10')]
+    assert list(result['HOUR']) == [12, 19]
+    assert list(result['KIND_INT']) == [0, 1]
+    assert list(result['IS_B']) == [0, 1]
+    assert result['TYPE'].dtype == 'int64'
+
+
+def test_read_sources(tmpdir):
+    pd.DataFrame({'ID': ['a'], 'DATE': ['01/02/2006'], 'TIME': ['12.42.00'],
+                  'TYPE': [2], 'Type Desc': ['two']}).to_csv(
+        os.path.join(str(tmpdir), 'crash.csv'), index=False)
+    pd.DataFrame({'ID': ['a', 'b'], 'KIND': ['A', 'B'], 'Lat': [-37.8, -37.9]}).to_csv(
+        os.path.join(str(tmpdir), 'place.csv'), index=False)
+
+    engine = column_mapping.MappingEngine(make_spec())
+    before = len(run_report.REPORT.steps)
+    frames = engine.read_sources(str(tmpdir))
+    assert list(frames) == ['crash', 'place']
+    assert len(frames['place']) == 2
+
+    records = {r['name']: r for r in run_report.REPORT.steps[before:]}
+    assert records['read_place']['rows_out'] == 2
+    assert records['read_crash']['file'] == 'crash.csv'
@@ -0,0 +1,69 @@
+import json
+import os
+import pandas as pd
+import pytest
+from .. import json_writer
+
+SCHEMA = {
+    "$schema": "http://json-schema.org/draft-06/schema#",
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": ["string", "number"]},
+            "location": {
+                "type": "object",
+                "properties": {"latitude": {"type": "number"}}
+            }
+        },
+        "required": ["id", "location"]
+    }
+}
+
+
+def make_records(count, bad=()):
+    for i in range(count):
+        if i in bad:
+            yield {'id': i}
+        else:
+            yield {'id': i, 'location': {'latitude': -37.8 + i}}
+
+
+def test_write_records_array(tmpdir):
+    output = os.path.join(str(tmpdir), 'out.json')
+    count = json_writer.write_records(make_records(25), output, schema=SCHEMA, batch_size=4)
+    assert count == 25
+    with open(output) as f:
+        text = f.read()
+    assert text == json.dumps(list(make_records(25)))
+
+
+def test_write_records_ndjson(tmpdir):
+    output = os.path.join(str(tmpdir), 'out.ndjson')
+    json_writer.write_records(make_records(5), output, fmt='ndjson', batch_size=2)
+    with open(output) as f:
+        assert [json.loads(line) for line in f] == list(make_records(5))
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_write_records_failures(tmpdir, jobs):
+    output = os.path.join(str(tmpdir), 'out.json')
+    with pytest.raises(json_writer.RecordValidationError) as error:
+        json_writer.write_records(make_records(40, bad=[3, 17, 18, 30]), output,
+                                  schema=SCHEMA, batch_size=5, jobs=jobs, max_errors=3)
+    assert [row for row, _ in error.value.failures] == [3, 17, 18]
+    assert "'location' is a required property" in str(error.value)
+    assert not os.path.exists(output)
+    assert not os.path.exists(output + '.tmp')
+
+
+@pytest.mark.parametrize('fmt', ['index', 'records'])
+def test_write_frame(tmpdir, fmt):
+    df = pd.DataFrame({
+        'DATE_TIME': pd.date_range('2006-01-01', periods=7, freq='H'),
+        'LAT': [-37.8 - i for i in range(7)],
+    }, index=['T{}'.format(i) for i in range(7)])
+    output = os.path.join(str(tmpdir), 'out.json')
+    json_writer.write_frame(df, output, fmt=fmt, chunksize=3)
+    with open(output) as f:
+        assert f.read() == df.to_json(orient=fmt)
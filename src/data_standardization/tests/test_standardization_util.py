@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+import pytz
+from ..Archive import standardization_util
+
+TIMEZONE = pytz.timezone('America/New_York')
+
+
+@pytest.mark.parametrize('dates,times,time_format', [
+    (['2018-01-01 12:00:00', '2018-07-01 09:30:00', '2018-01-01 12:00:00'], None, None),
+    (['01/13/2018', 'Jan 5 2018 5:00PM', '2018-01-01T05:00:00Z'], None, None),
+    (['2018-01-01T05:00:00-07:00', '2018-07-01T05:00:00-07:00'], None, None),
+    (['2018-01-01', '2018-01-02 13:00', '2018-01-03'], ['155', '1200', '2400'], 'military'),
+    (['2018-01-01', '2018-01-02 13:00', '2018-01-03'], ['3600', '60', '0'], 'seconds'),
+    (['2018-01-01', '2018-01-02', '2018-01-03'], ['5:00PM', '13:45', ''], None),
+])
+def test_parse_dates_matches_parse_date(dates, times, time_format):
+    result = standardization_util.parse_dates(
+        pd.Series(dates), TIMEZONE,
+        times=pd.Series(times) if times else None, time_format=time_format)
+    expected = [
+        standardization_util.parse_date(
+            date, TIMEZONE, time=times[i] if times else None, time_format=time_format)
+        for i, date in enumerate(dates)]
+    assert list(result) == expected
+
+
+def test_parse_dates_missing():
+    result = standardization_util.parse_dates(
+        pd.Series(['2018-01-01 12:00:00', '', 'not a date'], index=[5, 6, 7]), TIMEZONE)
+    assert list(result.index) == [5, 6, 7]
+    assert list(result) == ['2018-01-01T12:00:00-05:00', None, None]
+
+
+def test_parse_addresses_matches_parse_address():
+    addresses = ['1 Main St\nBoston, MA\n(42.35, -71.06)', '1 Main St', '',
+                 'a\nb\n', 'a\nb\n(0.0, -71.0)', 'a\nb\nc\n(1.0, 2.0)']
+    lat, lon = standardization_util.parse_addresses(pd.Series(addresses))
+    expected = [standardization_util.parse_address(a) for a in addresses]
+    assert [(None, None) if pd.isnull(x) else (x, y) for x, y in zip(lat, lon)] == expected
@@ -0,0 +1,61 @@
+import json
+import os
+import pandas as pd
+import pytz
+from ..Archive import standardize_concerns
+
+
+def write_csv(directory, filename, text):
+    with open(os.path.join(directory, filename), 'w') as f:
+        f.write(text)
+
+
+def test_read_concerns(tmpdir):
+    datadir = str(tmpdir)
+    raw = os.path.join(datadir, 'raw', 'concerns')
+    os.makedirs(raw)
+    os.makedirs(os.path.join(datadir, 'standardized'))
+    write_csv(raw, 'Vision_Zero_Entry.csv',
+              'OBJECTID,REQUESTDATE,REQUESTTYPE,STATUS,Y,X,COMMENTS,UNUSED\n'
+              '7,2016-01-15T08:31:00.000Z,speeding,Unassigned,42.3,-71.1,fast,a\n'
+              '8,,speeding,Unassigned,42.3,-71.1,no date,b\n')
+    write_csv(raw, 'bos_scf.csv',
+              'created,summary,description,Y,X\n'
+              '2017-03-01 10:00:00,Pothole,,42.2,-71.0\n'
+              '2017-03-02 10:00:00,,no summary,42.2,-71.0\n'
+              '2017-03-03 10:00:00,Signal,broken,42.1,-71.2\n')
+    write_csv(raw, 'other.csv', 'a\n1\n')
+
+    standardize_concerns.read_concerns(datadir, 'boston', pytz.timezone('America/New_York'))
+
+    with open(os.path.join(datadir, 'standardized', 'concerns.json')) as f:
+        concerns = sorted(json.load(f), key=lambda c: (c['source'], c['id']))
+    assert [(c['source'], c['id'], c['category']) for c in concerns] == [
+        ('seeclickfix', 1, 'Pothole'), ('seeclickfix', 2, 'Signal'),
+        ('visionzero', 7, 'speeding')]
+    assert concerns[1]['status'] == 'unknown'
+    assert concerns[1]['location'] == {'latitude': 42.1, 'longitude': -71.2}
+    assert concerns[2]['dateCreated'] == '2016-01-15T03:31:00-05:00'
+
+    table = pd.read_parquet(os.path.join(datadir, 'standardized', 'concerns.parquet'))
+    assert list(table.columns) == standardize_concerns.COLUMNS
+    assert len(table) == 3
+
+
+def test_sources_from_config(tmpdir):
+    source = {'source': 'seeclickfix', 'required': ['when'],
+              'filters': {'kind': ['road']},
+              'columns': {'id': 'n', 'dateCreated': 'when', 'category': 'kind',
+                          'latitude': 'lat', 'longitude': 'lng', 'summary': 'text',
+                          'status': 'state'}}
+    df = pd.DataFrame({'n': [1, 2, 3], 'when': ['2018-01-01', '', '2018-01-02'],
+                       'kind': ['road', 'road', 'park'], 'lat': [1., 2., 3.],
+                       'lng': [4., 5., 6.], 'text': ['x', 'y', 'z'],
+                       'state': ['open'] * 3})
+    assert standardize_concerns.load_sources('boston', [source]) == [source]
+    assert standardize_concerns.load_sources('nowhere') == []
+    assert standardize_concerns.match_source([source], 'anything.csv') is source
+
+    result = standardize_concerns.standardize_frame(df, source, pytz.timezone('UTC'))
+    assert result['id'].tolist() == [1]
+    assert result['dateCreated'].tolist() == ['2018-01-01T00:00:00+00:00']
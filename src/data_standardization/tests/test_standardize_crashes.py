@@ -0,0 +1,196 @@
+import os
+import pandas as pd
+from .. import standardize_crashes
+from ..store import columnar_path
+
+
+def make_crashes():
+    crashes_df = pd.DataFrame({
+        'ACCIDENT_NO': ['T20060000010', 'T20060000018'],
+        'DATE_TIME': pd.to_datetime(['2006-01-13 12:42:00', '2006-01-13 19:10:00']),
+        'MONTH': [1, 1],
+        'HOUR': [12, 19],
+        'DAY_OF_WEEK': [6, 6],
+        'LAT': [-37.8, -37.81],
+        'LON': [144.96, 144.97],
+        'SUBURB': ['MELBOURNE', 'YARRA'],
+        'NODE_ID': [43078, 12345],
+        'NODE_TYPE_INT': [0, 1],
+        'COMPLEX_NODE': [0, 1],
+        'LIGHT_COND': [1, 3],
+        'ATMOSPH_COND': [1, 1],
+        'SPEED_ZONE': [60, 50],
+        'ROAD_GEOMETRY': [1, 5],
+        'DEGREE_URBAN': ['MELB_URBAN', 'MELB_URBAN'],
+    }).set_index('ACCIDENT_NO')
+    mappings = {
+        name: pd.DataFrame({'CODE': [1, 2], 'Desc': ['a', 'b']})
+        for name in ['geom_mapping', 'atmosphere_mapping']}
+    return crashes_df, mappings
+
+
+def test_output_crash_parquet(tmpdir):
+    crash_dir = os.path.join(str(tmpdir), 'crash')
+    mapping_dir = os.path.join(str(tmpdir), 'mapping')
+    crashes_df, mappings = make_crashes()
+
+    standardize_crashes.output_crash_parquet(crash_dir, mapping_dir, crashes_df, mappings)
+    assert os.path.exists(os.path.join(mapping_dir, 'geom_mapping.parquet'))
+
+    result = standardize_crashes.read_crashes(crash_dir)
+    pd.testing.assert_frame_equal(result, crashes_df, check_dtype=False,
+                                  check_categorical=False)
+    assert str(result['DATE_TIME'].dtype).startswith('datetime64')
+    assert result['HOUR'].dtype.itemsize == 1
+    assert result['NODE_ID'].dtype.itemsize == 4
+
+    # Column projection keeps the index
+    result = standardize_crashes.read_crashes(crash_dir, columns=['LAT', 'LON'])
+    assert list(result.columns) == ['LAT', 'LON']
+    assert list(result.index) == list(crashes_df.index)
+
+
+def test_read_crashes_csv_fallback(tmpdir):
+    crash_dir = str(tmpdir)
+    crashes_df, _ = make_crashes()
+    crashes_df.to_csv(os.path.join(crash_dir, 'crashes.csv'))
+    assert not os.path.exists(columnar_path(os.path.join(crash_dir, 'crashes.csv')))
+
+    result = standardize_crashes.read_crashes(crash_dir, columns=['DATE_TIME', 'HOUR'])
+    assert list(result.columns) == ['DATE_TIME', 'HOUR']
+    assert str(result['DATE_TIME'].dtype).startswith('datetime64')
+
+
+def write_raw_crashes(directory, count=40):
+    """
+    Write a small set of raw VicRoads files, with the chained
+    duplicate rows the real files have
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    ids = ['T2006{:07d}'.format(i) for i in range(count)]
+    crash_ids = ids + ids[::5]
+    pd.DataFrame({
+        'ACCIDENT_NO': crash_ids,
+        'ACCIDENTDATE': ['{:02d}/0{}/2006'.format(i % 28 + 1, i % 9 + 1) for i in range(len(crash_ids))],
+        'ACCIDENTTIME': ['{:02d}.{:02d}.00'.format(i % 24, i % 60) for i in range(len(crash_ids))],
+        'ACCIDENT_TYPE': [i % 3 + 1 for i in range(len(crash_ids))],
+        'Accident Type Desc': ['type {}'.format(i % 3 + 1) for i in range(len(crash_ids))],
+        'DAY_OF_WEEK': [i % 7 + 1 for i in range(len(crash_ids))],
+        'DCA_CODE': [100 + i % 4 for i in range(len(crash_ids))],
+        'DCA Description': ['dca {}'.format(100 + i % 4) for i in range(len(crash_ids))],
+        'LIGHT_CONDITION': [i % 2 + 1 for i in range(len(crash_ids))],
+        'Light Condition Desc': ['light {}'.format(i % 2 + 1) for i in range(len(crash_ids))],
+        'NODE_ID': [1000 + i for i in range(len(crash_ids))],
+        'ROAD_GEOMETRY': [i % 5 + 1 for i in range(len(crash_ids))],
+        'Road Geometry Desc': ['geom {}'.format(i % 5 + 1) for i in range(len(crash_ids))],
+        'SPEED_ZONE': [40 + 10 * (i % 5) for i in range(len(crash_ids))],
+        'SEVERITY': [3] * len(crash_ids),
+    }).to_csv(os.path.join(directory, 'crash.csv'), index=False)
+    pd.DataFrame({
+        'ACCIDENT_NO': ids,
+        'NODE_ID': [1000 + i for i in range(count)],
+        'NODE_TYPE': [['I', 'N', 'O', 'U'][i % 4] for i in range(count)],
+        'LGA_NAME': [['MELBOURNE', 'YARRA'][i % 2] for i in range(count)],
+        'Deg Urban Name': ['MELB_URBAN'] * count,
+        'Lat': [-37.8 - i / 1000.0 for i in range(count)],
+        'Long': [144.9 + i / 1000.0 for i in range(count)],
+    }).to_csv(os.path.join(directory, 'map.csv'), index=False)
+    pd.DataFrame({
+        'ACCIDENT_NO': ids[::3],
+        'NODE_ID': [1000 + i for i in range(count)][::3],
+        'COMPLEX_INT_NO': [i % 2 * 7 for i in range(len(ids[::3]))],
+    }).to_csv(os.path.join(directory, 'map_inters.csv'), index=False)
+    pd.DataFrame({
+        'ACCIDENT_NO': ids + ids[:3],
+        'ATMOSPH_COND': [i % 3 + 1 for i in range(count + 3)],
+        'Atmosph Cond Desc': ['atmos {}'.format(i % 3 + 1) for i in range(count + 3)],
+    }).to_csv(os.path.join(directory, 'atmosphere.csv'), index=False)
+
+
+def test_read_clean_combine_crash_chunked(tmpdir, monkeypatch):
+    raw_dir = os.path.join(str(tmpdir), 'raw')
+    write_raw_crashes(raw_dir)
+    crashes_df, mappings = standardize_crashes.read_clean_combine_crash(raw_dir)
+    assert len(crashes_df) == 40
+
+    # Force several chunks for the small test files
+    monkeypatch.setattr(standardize_crashes, 'chunk_rows', lambda *args: 7)
+    chunked_df, chunked_mappings = standardize_crashes.read_clean_combine_crash(
+        raw_dir, max_memory_mb=64)
+
+    pd.testing.assert_frame_equal(chunked_df, crashes_df, check_dtype=False)
+    assert list(chunked_mappings) == list(mappings)
+    for name, mapping in mappings.items():
+        pd.testing.assert_frame_equal(chunked_mappings[name], mapping, check_dtype=False)
+
+
+def test_read_clean_combine_crash_incremental(tmpdir, monkeypatch):
+    raw_dir = os.path.join(str(tmpdir), 'raw')
+    crash_dir = os.path.join(str(tmpdir), 'crash')
+    mapping_dir = os.path.join(str(tmpdir), 'mapping')
+    write_raw_crashes(raw_dir)
+
+    # Without a previous run everything is standardized
+    crashes_df, mappings, hashes, partitions = \
+        standardize_crashes.read_clean_combine_crash_incremental(raw_dir, crash_dir, mapping_dir)
+    full_df, _ = standardize_crashes.read_clean_combine_crash(raw_dir)
+    pd.testing.assert_frame_equal(crashes_df, full_df)
+    assert partitions is None
+    standardize_crashes.output_crash_parquet(crash_dir, mapping_dir, crashes_df, mappings)
+    standardize_crashes.output_crash_hashes(crash_dir, hashes)
+
+    # Change one accident's speed zone and add a new accident
+    crash_file = os.path.join(raw_dir, 'crash.csv')
+    raw = pd.read_csv(crash_file)
+    raw.loc[raw['ACCIDENT_NO'] == 'T20060000003', 'SPEED_ZONE'] = 110
+    new_row = raw.iloc[[0]].assign(ACCIDENT_NO='T20069999999', DCA_CODE=999,
+                                   **{'DCA Description': 'new dca'})
+    pd.concat([raw, new_row]).to_csv(crash_file, index=False)
+    for name in ['map.csv', 'atmosphere.csv']:
+        raw_file = os.path.join(raw_dir, name)
+        raw = pd.read_csv(raw_file)
+        pd.concat([raw, raw.iloc[[0]].assign(ACCIDENT_NO='T20069999999')]).to_csv(
+            raw_file, index=False)
+
+    combined = []
+    combine = standardize_crashes.MappingEngine.combine
+
+    def counting_combine(self, frames, lookups):
+        result = combine(self, frames, lookups)
+        combined.append(len(result))
+        return result
+    monkeypatch.setattr(standardize_crashes.MappingEngine, 'combine', counting_combine)
+
+    crashes_df, mappings, _, partitions = standardize_crashes.read_clean_combine_crash_incremental(
+        raw_dir, crash_dir, mapping_dir)
+    assert combined == [2]
+    assert partitions == set(standardize_crashes.crash_partitions(
+        crashes_df.loc[['T20060000003', 'T20069999999']]))
+    full_df, full_mappings = standardize_crashes.read_clean_combine_crash(raw_dir)
+    pd.testing.assert_frame_equal(crashes_df.sort_index(), full_df.sort_index())
+    assert crashes_df.loc['T20060000003', 'SPEED_ZONE'] == 110
+    pd.testing.assert_frame_equal(mappings['DCA_code_mapping'], full_mappings['DCA_code_mapping'])
+
+
+def test_output_crash_parquet_partitions(tmpdir):
+    crash_dir = os.path.join(str(tmpdir), 'crash')
+    mapping_dir = os.path.join(str(tmpdir), 'mapping')
+    crashes_df, mappings = make_crashes()
+    crashes_df.loc['T20060000018', 'DATE_TIME'] = pd.Timestamp('2007-02-01 10:00')
+    crashes_df.loc['T20060000018', 'SUBURB'] = 'RICHMOND'
+    standardize_crashes.output_crash_parquet(crash_dir, mapping_dir, crashes_df, mappings)
+    parts = os.path.join(crash_dir, 'crashes.parquet')
+    assert sorted(os.listdir(parts)) == ['2006.parquet', '2007.parquet']
+
+    # Only the changed year is rewritten
+    mtime = os.stat(os.path.join(parts, '2006.parquet')).st_mtime_ns
+    crashes_df.loc['T20060000018', 'SPEED_ZONE'] = 80
+    standardize_crashes.output_crash_parquet(
+        crash_dir, mapping_dir, crashes_df, mappings, partitions={'2007'})
+    assert os.stat(os.path.join(parts, '2006.parquet')).st_mtime_ns == mtime
+
+    result = standardize_crashes.read_crashes(crash_dir)
+    pd.testing.assert_frame_equal(result, crashes_df, check_dtype=False,
+                                  check_categorical=False)
+    assert list(result['SUBURB'].cat.categories) == ['MELBOURNE', 'RICHMOND']
@@ -0,0 +1,43 @@
+import json
+import os
+from ..Archive import standardize_point_data
+from tools import run_report
+
+
+def test_read_file_info(tmpdir):
+    datadir = str(tmpdir)
+    raw = os.path.join(datadir, 'raw', 'supplemental')
+    os.makedirs(raw)
+    os.makedirs(os.path.join(datadir, 'standardized'))
+    with open(os.path.join(raw, 'tickets.csv'), 'w') as f:
+        f.write('Date,Time,Location,Kind\n'
+                '2018-01-01,1:55,"1 Main St\nBoston, MA\n(42.35, -71.06)",speeding\n'
+                '2018-01-02,1200,2 Main St,parking\n'
+                '2018-01-03,,"3 Main St\nBoston, MA\n(42.36, -71.07)",speeding\n')
+    with open(os.path.join(raw, 'signals.csv'), 'w') as f:
+        f.write('Installed,Address\n2017-05-01,"x\ny\n(42.1, -71.1)"\n')
+    config = {
+        'timezone': 'America/New_York',
+        'data_source': [
+            {'name': 'tickets', 'filename': 'tickets.csv', 'address': 'Location',
+             'date': 'Date', 'time': 'Time', 'category': 'Kind'},
+            {'name': 'signals', 'filename': 'signals.csv', 'address': 'Address',
+             'date': 'Installed'},
+        ]
+    }
+    standardize_point_data.read_file_info(config, datadir, jobs=2)
+
+    with open(os.path.join(datadir, 'standardized', 'points.json')) as f:
+        points = json.load(f)
+    assert points == [
+        {'feature': 'tickets', 'date': '2018-01-01T01:55:00-05:00',
+         'location': {'latitude': 42.35, 'longitude': -71.06}, 'category': 'speeding'},
+        {'feature': 'tickets', 'date': '2018-01-03T00:00:00-05:00',
+         'location': {'latitude': 42.36, 'longitude': -71.07}, 'category': 'speeding'},
+        {'feature': 'signals', 'date': '2017-05-01T00:00:00-04:00',
+         'location': {'latitude': 42.1, 'longitude': -71.1}},
+    ]
+    steps = {s['name']: s for s in run_report.REPORT.steps}
+    assert (steps['standardize_tickets']['rows_in'],
+            steps['standardize_tickets']['rows_out']) == (3, 2)
+    assert steps['standardize_signals']['rows_per_second'] > 0
@@ -0,0 +1,105 @@
+import datetime
+import gzip
+import json
+import os
+from tools.snapshot_archive import ArchiveWriter
+from ..Archive import standardize_waze_data
+
+CONFIG = {'city': 'Boston, Massachusetts, USA', 'timezone': 'America/New_York'}
+
+
+def write_snapshot(directory, filename, minute, jams=(), alerts=()):
+    data = {
+        'startTime': '2018-10-15 20:{:02d}:00:000'.format(minute),
+        'endTime': '2018-10-15 20:{:02d}:00:000'.format(minute + 1),
+        'jams': list(jams),
+        'alerts': list(alerts),
+    }
+    with gzip.open(os.path.join(directory, filename), 'wb') as f:
+        f.write(json.dumps(data).encode('utf-8'))
+
+
+def make_event(uuid, city='Boston'):
+    return {'uuid': uuid, 'city': city, 'pubMillis': 1539634380000}
+
+
+def test_read_snapshots(tmpdir):
+    directory = str(tmpdir)
+    write_snapshot(directory, '2018-10-15-20-13.json.gz', 13,
+                   jams=[make_event('a'), make_event('b', city='Cambridge')])
+    write_snapshot(directory, '2018-10-15-20-14.json.gz', 14,
+                   alerts=[make_event('c')])
+    # Outside the dates by its name, so it is never opened
+    with open(os.path.join(directory, '2018-09-01-00-00.json.gz'), 'w') as f:
+        f.write('not gzip')
+    with open(os.path.join(directory, 'notes.txt'), 'w') as f:
+        f.write('not a snapshot')
+
+    events = standardize_waze_data.read_snapshots(
+        directory, CONFIG, startdate='2018-10-15', enddate='2018-10-15', jobs=2)
+
+    assert [(e['uuid'], e['eventType'], e['snapshotId']) for e in events] == [
+        ('a', 'jam', 1), ('c', 'alert', 2)]
+    assert events[0]['pubTimeStamp'] == '2018-10-15 16:13:00'
+
+
+def test_read_archived_snapshots(tmpdir):
+    directory = str(tmpdir)
+    writer = ArchiveWriter(directory)
+    for minute, uuid in [(14, 'b'), (15, 'c')]:
+        data = {
+            'startTime': '2018-10-15 20:{:02d}:00:000'.format(minute),
+            'endTime': '2018-10-15 20:{:02d}:00:000'.format(minute + 1),
+            'jams': [make_event(uuid)],
+        }
+        fetched = datetime.datetime(2018, 10, 15, 20, minute, tzinfo=datetime.timezone.utc)
+        writer.append(fetched, json.dumps(data).encode('utf-8'))
+    # Single files and archives are read together, in the order they were fetched
+    write_snapshot(directory, '2018-10-15-20-13.json.gz', 13, jams=[make_event('a')])
+    writer.append(datetime.datetime(2018, 9, 1, tzinfo=datetime.timezone.utc), b'not json')
+
+    assert standardize_waze_data.snapshot_files(
+        directory, startdate=datetime.datetime(2018, 10, 15, tzinfo=datetime.timezone.utc)) == [
+        '2018-10-15-20-13.json.gz', '2018-10-15-20.snapshots.gz']
+    events = standardize_waze_data.read_snapshots(
+        directory, CONFIG, startdate='2018-10-15', enddate='2018-10-15', jobs=2)
+    assert [(e['uuid'], e['snapshotId']) for e in events] == [('a', 1), ('b', 2), ('c', 3)]
+
+
+def test_snapshot_time():
+    fetched = standardize_waze_data.snapshot_time('2018-10-15-20-13.json.gz')
+    assert (fetched.hour, fetched.minute, fetched.utcoffset().total_seconds()) == (20, 13, 0)
+    assert standardize_waze_data.snapshot_time('waze.json') is None
+
+
+def test_event_compactor():
+    compactor = standardize_waze_data.EventCompactor()
+    jam = {'uuid': 'a', 'eventType': 'jam', 'speed': 10, 'level': 2}
+    compactor.add(1, '2018-10-15 16:13:00', [dict(jam, snapshotId=1), {'eventType': 'jam'}])
+    compactor.add(2, '2018-10-15 16:14:00', [dict(jam, snapshotId=2),
+                                             {'uuid': 'a', 'eventType': 'alert'}])
+    compactor.add(3, '2018-10-15 16:15:00', [dict(jam, speed=5, snapshotId=3)])
+
+    jam_record, alert_record, unkeyed = compactor.compacted()
+    assert jam_record['speed'] == 10
+    assert jam_record['snapshotId'] == 1
+    assert (jam_record['firstSeen'], jam_record['lastSeen']) == (
+        '2018-10-15 16:13:00', '2018-10-15 16:15:00')
+    assert (jam_record['firstSnapshotId'], jam_record['lastSnapshotId']) == (1, 3)
+    assert jam_record['snapshotCount'] == 3
+    assert jam_record['changes'] == [
+        {'snapshotId': 3, 'seen': '2018-10-15 16:15:00', 'attributes': {'speed': 5}}]
+    assert alert_record['snapshotCount'] == 1
+    assert unkeyed == {'eventType': 'jam'}
+
+
+def test_local_time_columns():
+    timezone = standardize_waze_data.pytz.timezone(CONFIG['timezone'])
+    dates = ['2018-10-15 20:13:00:000', '2018-11-04 06:30:59:999']
+    result = standardize_waze_data.to_local_times(dates, timezone)
+    assert list(result) == [standardize_waze_data.get_datetime(d, timezone) for d in dates]
+
+    millis = [1539634380000, 1541313059999]
+    result = standardize_waze_data.millis_to_local(millis, timezone)
+    assert list(result.strftime('%Y-%m-%d %H:%M:%S')) == [
+        standardize_waze_data.convert_from_millis(m, timezone) for m in millis]
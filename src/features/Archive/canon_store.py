@@ -0,0 +1,198 @@
+# Year/week partitioned store of the dense canonical dataset
+# Each week is its own parquet file of dense rows (every segment, with its
+# counts and features), named by year and week. A manifest records a hash
+# of what went into each partition, so an update only rewrites the weeks
+# whose counts or segment features changed, and adds the new ones
+# Every week is still rebuilt and hashed on each update, rather than only
+# appending new weeks, since late crash reports can change past weeks.
+# Hashing only reads each week's non-zero counts, so it stays cheap
+# WeeklyCounts keeps the counts the partitions are built from, so only the
+# weeks whose records changed are recounted
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+MANIFEST_NAME = 'manifest.json'
+WEEK_COUNTS_NAME = 'week_counts.parquet'
+WEEK_DIGESTS_NAME = 'week_digests.parquet'
+
+
+def partition_name(year, week):
+    return '{}-{:02d}.parquet'.format(year, week)
+
+
+class PartitionedCanon():
+    """
+    Dense canonical rows, one parquet file per year and week
+    Args:
+        directory - where the partitions and their manifest live
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def update(self, canon):
+        """
+        Bring the partitions in line with a SparseCanon with year
+        and week periods, rewriting only the weeks that changed
+        Returns:
+            list of the partition files written or removed
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        features = hashlib.sha256(json.dumps(
+            [str(c) for c in canon.features.columns]).encode('utf-8'))
+        features.update(pd.util.hash_pandas_object(canon.features, index=True).values.tobytes())
+        columns = {}
+        for name, matrix in canon.counts.items():
+            matrix = matrix.tocsc()
+            matrix.sort_indices()
+            columns[name] = matrix
+
+        written = []
+        manifest = {}
+        for pos, (year, week) in enumerate(zip(canon.periods['year'], canon.periods['week'])):
+            name = partition_name(year, week)
+            sha = features.copy()
+            for count, matrix in sorted(columns.items()):
+                sha.update(count.encode('utf-8'))
+                start, end = matrix.indptr[pos], matrix.indptr[pos + 1]
+                sha.update(np.ascontiguousarray(matrix.indices[start:end]).tobytes())
+                sha.update(np.ascontiguousarray(matrix.data[start:end]).tobytes())
+            manifest[name] = sha.hexdigest()
+            path = os.path.join(self.directory, name)
+            if self.manifest.get(name) == manifest[name] and os.path.exists(path):
+                continue
+            canon.dense(periods=[pos]).to_parquet(path, index=False)
+            written.append(path)
+
+        # Weeks that are no longer covered
+        for name in set(self.manifest) - set(manifest):
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+                written.append(path)
+
+        self.manifest = manifest
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        return written
+
+    def read(self, years=None, columns=None):
+        """
+        Read partitions back into one DataFrame, ordered by segment,
+        year and week; segments are the int keys of tools.segment_keys
+        Args:
+            years - only read these years, all of them by default
+            columns - only read these columns
+        """
+        names = sorted(name for name in self.manifest
+                       if years is None or int(name.split('-')[0]) in years)
+        frames = [pd.read_parquet(os.path.join(self.directory, name), columns=columns)
+                  for name in names]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True)
+        order = [c for c in ['segment_id', 'year', 'week'] if c in df.columns]
+        if order:
+            df = df.sort_values(order, kind='mergesort').reset_index(drop=True)
+        return df
+
+
+class WeeklyCounts():
+    """
+    Record counts per location per ISO week, kept between runs along with
+    a digest of each week's records, so an update only recounts the weeks
+    whose records changed. Every record is still read and hashed to find
+    those weeks
+    Args:
+        directory - where the counts and digests are kept
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.counts_path = os.path.join(directory, WEEK_COUNTS_NAME)
+        self.digests_path = os.path.join(directory, WEEK_DIGESTS_NAME)
+        self.changed = []
+
+    def read(self):
+        """
+        Saved counts and week digests, or None if there aren't any
+        """
+        if not (os.path.exists(self.counts_path) and os.path.exists(self.digests_path)):
+            return None, None
+        digests = pd.read_parquet(self.digests_path)
+        return pd.read_parquet(self.counts_path), \
+            pd.Series(digests['digest'].values, index=digests['key'].values)
+
+    def update(self, ids, periods, id_name='near_id'):
+        """
+        Counts for the records, recounting only the weeks that changed
+        since the last update, and save them
+        Records without a date or a location are left out
+        Args:
+            ids - Series of location ids, counted as strings
+            periods - Series of the start of each record's week, aligned
+                with ids, from time_buckets.period_start
+            id_name - name of the location level of the result
+        Returns:
+            Series of counts indexed by (id_name, 'year', 'week'), like
+            time_buckets.iso_weeks
+        """
+        ids = pd.Series(ids).reset_index(drop=True)
+        periods = pd.Series(periods).reset_index(drop=True)
+        present = (ids.notna() & periods.notna()).values
+        records = pd.DataFrame({'id': ids[present].astype(str).values})
+        iso = pd.DatetimeIndex(periods.values[present]).isocalendar()
+        records['year'] = iso['year'].astype('int64').values
+        records['week'] = iso['week'].astype('int64').values
+        records['key'] = records['year'] * 100 + records['week']
+
+        # Order independent digest of each week's locations, which is
+        # all its counts depend on
+        codes, keys = pd.factorize(records['key'])
+        hashes = pd.util.hash_pandas_object(records['id'], index=False).values
+        sums = np.zeros(len(keys), dtype='uint64')
+        np.add.at(sums, codes, hashes)
+        sizes = np.bincount(codes, minlength=len(keys))
+        digests = pd.Series(['{}-{}'.format(total, size) for total, size in zip(sums, sizes)],
+                            index=keys)
+
+        old_counts, old_digests = self.read()
+        if old_counts is None:
+            changed = set(digests.index)
+            removed = set()
+            old_counts = pd.DataFrame(columns=['id', 'year', 'week', 'count'])
+        else:
+            changed = set(digests.index[
+                digests.values != old_digests.reindex(digests.index).values])
+            removed = set(old_digests.index) - set(digests.index)
+        self.changed = sorted(changed | removed)
+
+        recount = records[records['key'].isin(changed)]
+        new_counts = recount.groupby(['id', 'year', 'week']).size().rename('count').reset_index()
+        kept = old_counts[~(old_counts['year'] * 100 + old_counts['week']).isin(
+            changed | removed)]
+        counts = pd.concat([kept, new_counts], ignore_index=True)
+        counts = counts.astype({'year': 'int64', 'week': 'int64', 'count': 'int64'})
+        counts = counts.sort_values(['id', 'year', 'week']).reset_index(drop=True)
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        counts.to_parquet(self.counts_path, index=False)
+        pd.DataFrame({'key': digests.index.values.astype('int64'),
+                      'digest': digests.values}).to_parquet(self.digests_path, index=False)
+
+        result = counts.set_index(['id', 'year', 'week'])['count']
+        result.index.names = [id_name, 'year', 'week']
+        result.name = None
+        return result
@@ -0,0 +1,23 @@
+# Counts of concerns (or other spatial-only records) per segment
+# One row per segment and one column per source, built with a single
+# crosstab over the joined records
+import json
+import pandas as pd
+
+
+def read_concerns(fp, id_col):
+    """
+    Turns a json file of spatial only features into a pandas dataframe
+    of counts, one row per segment and one column per source
+    Records without a segment are left out
+    """
+
+    with open(fp) as f:
+        df = pd.DataFrame(json.load(f), columns=['source', id_col])
+    df = df[df[id_col].astype(bool) & df[id_col].notna()]
+    counts = pd.crosstab(df[id_col], df['source'])
+    # Sources in the order they first appear, as before
+    counts = counts[pd.unique(df['source'])]
+    counts.index.name = None
+    counts.columns.name = None
+    return counts
@@ -1,13 +1,23 @@
+import gzip
 import json
 import pandas as pd
 import os
 import argparse
 import sys
+import yaml
 
 CURR_FP = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(CURR_FP)
+sys.path.append(os.path.dirname(os.path.dirname(CURR_FP)))
 
-from util import read_geojson, group_json_by_location, group_json_by_field
+from util import read_geojson
+from time_buckets import count_by_period, iso_weeks, period_start
+from sparse_canon import SparseCanon
+from road_features import stream_road_features
+from canon_store import PartitionedCanon, WeeklyCounts
+from concern_counts import read_concerns
+from tools.stage_cache import StageCache, MANIFEST_NAME
+from tools.segment_keys import SegmentKeys, SEGMENT_KEYS_NAME
 
 BASE_DIR = os.path.dirname(
     os.path.dirname(
@@ -18,29 +28,37 @@ MAP_FP = os.path.join(BASE_DIR, 'data/processed/maps')
 DATA_FP = os.path.join(BASE_DIR, 'data/processed')
 
 
-def read_records(fp, date_col, id_col, agg='week'):
+def read_records(fp, date_col, id_col, agg='week', timezone=None, counts_dir=None):
     """ Read point data, output count by aggregation level
-    agg : datepart for aggregation
+    agg : hour, day, week or month, see time_buckets
+    timezone : city timezone to take the dates' local times in, which
+        matters when their UTC offsets differ across daylight saving;
+        otherwise each date's own offset is used
     date_col : column name with date information
     id_col : column name with inter/non-inter id (for grouping)
+    counts_dir : for weeks, where to keep the counts between runs so
+        only weeks whose records changed are recounted, see WeeklyCounts
+    Returns counts indexed by (id_col, 'year', 'week') for weeks, with
+    the ISO year and week, and by (id_col, 'period') otherwise
     """
 
     with open(fp, 'r') as f:
         data = json.load(f)
     df = pd.DataFrame(data)
 
-    df[date_col] = pd.to_datetime(df[date_col])
     print("total number of records in {}:{}".format(fp, len(df)))
 
-    # get date according to iso calendar
-    df['isodate'] = df[date_col].apply(lambda d: d.isocalendar())
-    df['week'] = df['isodate'].apply(lambda x: x[1])
-    df['year'] = df['isodate'].apply(lambda x: x[0])
-
     # aggregate
     print("aggregating by ", agg)
-    df[agg] = df[date_col].apply(lambda x: getattr(x, agg))
-    df_g = df.groupby([id_col, 'year', agg]).size()
+    if counts_dir and agg == 'week':
+        counts = WeeklyCounts(counts_dir)
+        df_g = counts.update(df[id_col], period_start(df[date_col], agg, timezone),
+                             id_name=id_col)
+        print("{} weeks recounted".format(len(counts.changed)))
+        return df_g
+    df_g = count_by_period(df[id_col], df[date_col], agg, id_name=id_col, timezone=timezone)
+    if agg == 'week':
+        df_g = iso_weeks(df_g)
 
     return(df_g)
 
@@ -51,7 +69,11 @@ def road_make(feats, inters_fp, non_inters_fp, agg='max'):
     agg : aggregation type (default is max)
     IMPORTANT: if the aggregation type changes, need to also update
         how aggregation is calculated in src/data/add_map.py
+    The default max is taken while streaming the files, see road_features
     """
+    if agg == 'max':
+        return stream_road_features(feats, inters_fp, non_inters_fp)
+
     # Read in inters data (json), turn into df with inter index
     df_index = []
     df_records = []
@@ -84,29 +106,14 @@ def road_make(feats, inters_fp, non_inters_fp, agg='max'):
     return(aggregated(), combined['orig_id'])
 
 
-def read_concerns(fp, id_col):
-    """
-    Turns a json file of spatial only features into a pandas dataframe
-    """
-
-    items = json.load(open(fp))
-    grouped_by_source = group_json_by_field(items, 'source')
-
-    data_frames = []
-    for source, items in grouped_by_source.items():
-        results, grouped = group_json_by_location(items)
-        segments = [k for k in list(grouped.keys()) if k]
-        results = {source: [grouped[k]['count'] for k in segments]}
-        df = pd.DataFrame(results, index=segments)
-        data_frames.append((source, df))
-    return data_frames
-
-
-def aggregate_roads(feats, datadir):
+def aggregate_roads(feats, datadir, timezone=None, incremental=False):
 
     # Read / aggregate crash
     # Make sure to use the right date column name.
-    crash = read_records(os.path.join(datadir, 'crash_joined.json'), 'ACCIDENT_DATE', 'near_id')
+    # Incrementally, only the weeks with changed crashes are recounted
+    crash = read_records(os.path.join(datadir, 'crash_joined.json'), 'ACCIDENT_DATE', 'near_id',
+                         timezone=timezone,
+                         counts_dir=os.path.join(datadir, 'canon_counts') if incremental else None)
     cr_con = pd.concat([crash], axis=1)
     cr_con.columns = ['crash']
 
@@ -124,20 +131,12 @@ def aggregate_roads(feats, datadir):
     aggregated, adjacent = road_make(feats, inters_fp, non_inters_fp)
     print("road features being included: ", ', '.join(feats))
 
-    # Add any concern types if applicable
+    # Add any concern types if applicable, all sources at once
     filename = os.path.join(datadir, 'concern_joined.json')
     if os.path.exists(filename):
-
-        concerns = read_concerns(
-            filename, 'near_id'
-        )
-        for concern_type, result in concerns:
-
-            f = {concern_type: result}
-            aggregated = aggregated.assign(**f)
-            aggregated = aggregated.fillna(0)
-    else:
-        aggregated = aggregated.fillna(0)
+        concerns = read_concerns(filename, 'near_id')
+        aggregated = aggregated.join(concerns)
+    aggregated = aggregated.fillna(0)
 
     # All features as int
     aggregated = aggregated.apply(lambda x: x.astype('int'))
@@ -146,52 +145,22 @@ def aggregate_roads(feats, datadir):
 
 
 def group_by_date(cr_con, aggregated):
-    # for each year, get iso week max, observation for each segment
-
-    all_years = cr_con.year.unique()
-    for y in all_years:
-        # 2017 doesn't have full year, use last obs
-        if y == 2017:
-            yr_max = cr_con[cr_con.year == 2017].week.max()
-        else:
-            yr_max = pd.Timestamp('12-31-{}'.format(y)).week
-            # some years the last week = 1, make it 52 in that case
-            if yr_max == 1:
-                yr_max = 52
-
-        # We might have data that starts midyear
-        yr_min = cr_con[cr_con.year == y].week.min()
-
-        # if this is the first year
-        # doing this because multiindex is hard to set up placeholder
-        if y == all_years[0]:
-            all_weeks = pd.MultiIndex.from_product(
-                [aggregated.index, [y], list(range(yr_min, yr_max))],
-                names=['segment_id', 'year', 'week'])
-        else:
-            yr_index = pd.MultiIndex.from_product(
-                [aggregated.index, [y], list(range(yr_min, yr_max))],
-                names=['segment_id', 'year', 'week'])
-            all_weeks = all_weeks.union(yr_index)
-
-    # crash/concern for each week, for each year for each segment
-    cr_con = cr_con.set_index(
-        ['near_id', 'year', 'week']).reindex(all_weeks, fill_value=0)
-
-    cr_con.reset_index(inplace=True)
-
-    # join segment features to crash/concern
-    cr_con_roads = cr_con.merge(
-        aggregated, left_on='segment_id', right_index=True, how='outer')
-
-    return cr_con_roads
+    """
+    Dense crash/concern counts for each week, for each year, for each
+    segment, with the segment features joined on
+    Builds every row, so prefer SparseCanon for the full network
+    """
+    return SparseCanon.from_counts(cr_con, aggregated).dense()
 
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--datadir", type=str,
-                        help="Can give alternate data directory")
+                        help="Can give alternate data directory, e.g. data/<city>, " +
+                        "whose segment keys are shared with the model")
+    parser.add_argument("-c", "--config", type=str,
+                        help="config file for city, whose timezone is used by default")
     parser.add_argument("-features", "--featlist", nargs="+", default=[
         'AADT', 'SPEEDLIMIT', 'Struct_Cnd', 'Surface_Tp', 'F_F_Class'],
         help="List of segment features to include")
@@ -200,6 +169,15 @@ if __name__ == '__main__':
                         "containing filename, latitude, longitude and " +
                         "time columns",
                         default=['concern,Vision_Zero_Entry.csv,,,'])
+    parser.add_argument('-t', '--timezone', type=str,
+                        help="city timezone (e.g. America/New_York) the crash dates' " +
+                        "weeks are taken in, by default the config's, otherwise " +
+                        "each date's own UTC offset")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only recount crashes and rewrite partitions for the weeks " +
+                        "that changed, append new weeks to the csv rather than " +
+                        "rewriting it, and only redo adjacency info when the road " +
+                        "network changes")
 
     args = parser.parse_args()
 
@@ -213,23 +191,70 @@ if __name__ == '__main__':
     if args.featlist:
         feats = args.featlist
 
-    print("Data directory: " + DATA_FP)
-
-    aggregated, adjacent, cr_con = aggregate_roads(feats, DATA_FP)
-
-    # Need to rename?
-    cr_con_roads = group_by_date(cr_con, aggregated)
+    timezone = args.timezone
+    if timezone is None and args.config:
+        with open(args.config) as f:
+            timezone = yaml.safe_load(f).get('timezone')
 
-    # output canon dataset
-    print("exporting canonical dataset to ", DATA_FP)
-
-    cr_con_roads.set_index('segment_id').to_csv(
-        os.path.join(DATA_FP, 'vz_predict_dataset.csv.gz'),
-        compression='gzip')
+    print("Data directory: " + DATA_FP)
 
-    # output adjacency info
+    aggregated, adjacent, cr_con = aggregate_roads(feats, DATA_FP, timezone=timezone,
+                                                   incremental=args.incremental)
+
+    # Segments are keyed by int from here on, and only written out
+    # as ids in the csv. Crashes on unknown segments are left out
+    keys = SegmentKeys(os.path.join(DATA_FP, SEGMENT_KEYS_NAME))
+    aggregated.index = keys.encode(aggregated.index)
+    cr_con['near_id'] = keys.encode(cr_con['near_id'], add=False)
+    keys.save()
+
+    # Counts are kept sparse, with the road features stored once
+    canon = SparseCanon.from_counts(cr_con, aggregated)
+    canon.save(os.path.join(DATA_FP, 'canon_sparse'))
+
+    # Partitioned by week, only changed and new weeks are written
+    store = PartitionedCanon(os.path.join(DATA_FP, 'canon_partitions'))
+    before = dict(store.manifest)
+    written = store.update(canon)
+    print("{} partitions of {} weeks changed in canon_partitions".format(
+        len(written), len(canon.periods)))
+
+    # The model reads the csv. The cache records which partitions it was
+    # last written from, so if the only changes since are new weeks,
+    # those are appended (as another gzip member) instead of rewriting
+    # it. Appended weeks come after the rest, rather than in segment order
+    csv_fp = os.path.join(DATA_FP, 'vz_predict_dataset.csv.gz')
+    cache = StageCache(os.path.join(DATA_FP, MANIFEST_NAME))
+    new_weeks = [path for path in written if os.path.basename(path) not in before
+                 and os.path.exists(path)]
+    if args.incremental and len(new_weeks) == len(written) \
+       and cache.is_fresh('canon_csv', cache.fingerprint(config=before), [csv_fp]):
+        print("Appending {} new weeks to {}".format(len(new_weeks), csv_fp))
+        with gzip.open(csv_fp, 'at') as f:
+            for path in sorted(new_weeks):
+                chunk = pd.read_parquet(path)
+                chunk['segment_id'] = keys.decode(chunk['segment_id'])
+                chunk.set_index('segment_id').to_csv(f, header=False)
+    else:
+        # output canon dataset, materializing a chunk of segments at a time
+        print("exporting canonical dataset to ", DATA_FP)
+
+        with gzip.open(csv_fp, 'wt') as f:
+            for i, chunk in enumerate(canon.iter_dense()):
+                chunk['segment_id'] = keys.decode(chunk['segment_id'])
+                chunk.set_index('segment_id').to_csv(f, header=i == 0)
+    cache.record('canon_csv', cache.fingerprint(config=store.manifest), [csv_fp])
+
+    # output adjacency info, unless the road network and ATRs are unchanged
+    adjacency_fp = os.path.join(DATA_FP, 'adjacency_info.csv')
+    fingerprint = cache.fingerprint(files=[
+        os.path.join(DATA_FP, 'inters_data.json'),
+        os.path.join(DATA_FP, 'maps', 'non_inters_segments.geojson'),
+        os.path.join(DATA_FP, 'snapped_atrs.json')])
+    if args.incremental and cache.is_fresh('adjacency', fingerprint, [adjacency_fp]):
+        print("Road network unchanged, keeping adjacency info")
     # need to include ATRs
-    if os.path.exists(os.path.join(DATA_FP, 'snapped_atrs.json')):
+    elif os.path.exists(os.path.join(DATA_FP, 'snapped_atrs.json')):
         atrs = pd.read_json(os.path.join(DATA_FP, 'snapped_atrs.json'))
         adjacent = adjacent.reset_index()
         adjacent = adjacent.merge(
@@ -240,7 +265,7 @@ if __name__ == '__main__':
         )
         adjacent.drop(['near_id'], axis=1, inplace=True)
         adjacent.columns = ['segment_id', 'orig_id', 'atr_address']
-        adjacent.to_csv(os.path.join(
-            DATA_FP, 'adjacency_info.csv'), index=False)
+        adjacent.to_csv(adjacency_fp, index=False)
+        cache.record('adjacency', fingerprint, [adjacency_fp])
     else:
         print("No ATRs found, skipping...")
@@ -0,0 +1,239 @@
+# Streaming loader for the road feature files
+# inters_data.json and non_inters_segments.geojson are read a chunk at a
+# time, one intersection or feature at a time, keeping only the requested
+# features and orig_id. Intersections are reduced to a single row (the max
+# over their segments) as they are read, so memory stays near the size
+# of the output table rather than the raw json
+# Feature values are kept in typed float64 buffers as they are read,
+# with NaN for missing values, rather than lists of Python objects
+import array
+import json
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+class JsonStream():
+    """
+    Reads json values one at a time out of an open text file
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """
+        Read another chunk, dropping what has already been consumed
+        Returns:
+            False at the end of the file
+        """
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Next character that isn't whitespace, without consuming it
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of json')
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expected one of {} in json, found {}'.format(chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next value, reading more of the file until it's complete
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number could carry on into the next chunk
+                if self.eof or (end < len(self.buf) and not (
+                        isinstance(value, (int, float))
+                        and self.buf[end] in NUMBER_CHARS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def items(self):
+        """
+        Key, value pairs of the object starting here; values are left
+        unread until the caller reads them, so that has to happen
+        before asking for the next item
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """
+        Values of the array starting here, one at a time
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_intersections(fp):
+    """
+    Segments of each intersection in inters_data.json
+    Yields:
+        intersection id, list of its segments' properties
+    """
+    with open(fp) as f:
+        stream = JsonStream(f)
+        for key in stream.items():
+            yield key, stream.value()
+
+
+def iter_geojson_properties(fp):
+    """
+    Properties of each feature in a geojson FeatureCollection
+    """
+    with open(fp) as f:
+        stream = JsonStream(f)
+        for key in stream.items():
+            if key != 'features':
+                stream.value()
+                continue
+            for feature in stream.elements():
+                yield feature['properties']
+
+
+def is_missing(value):
+    return value is None or value != value
+
+
+def column_max(values):
+    """
+    Max of the values that are present, like pandas' max; None if none are
+    Returns:
+        the max, and whether any value was missing
+    """
+    present = [v for v in values if not is_missing(v)]
+    return max(present) if present else None, len(present) < len(values)
+
+
+class FeatureColumn():
+    """
+    A feature's values, as a float64 buffer with NaN for missing values
+    If a value isn't a number, the column falls back to a list
+    """
+
+    def __init__(self):
+        self.values = array.array('d')
+        self.missing = False
+        self.floats = False
+
+    def append(self, value):
+        if is_missing(value):
+            self.missing = True
+            value = np.nan
+        elif isinstance(value, float):
+            self.floats = True
+        if isinstance(self.values, array.array):
+            try:
+                self.values.append(value)
+                return
+            except TypeError:
+                self.values = self.values.tolist()
+        self.values.append(value)
+
+    def array(self):
+        """
+        The values, as ints if they all were and none are missing
+        """
+        if not isinstance(self.values, array.array):
+            return pd.Series(self.values, dtype=object).infer_objects().values
+        values = np.frombuffer(self.values, dtype='float64')
+        if not (self.missing or self.floats):
+            return values.astype('int64')
+        return values
+
+
+def stream_road_features(feats, inters_fp, non_inters_fp):
+    """
+    Road features for intersections and non-intersection segments,
+    read a record at a time
+    Args:
+        feats - features to keep
+        inters_fp - inters_data.json
+        non_inters_fp - non_inters_segments.geojson
+    Returns:
+        DataFrame of feats, the max over each intersection's segments,
+            indexed by segment id and sorted
+        Series of orig_id, one per segment of each intersection and
+            one per non-intersection segment
+    """
+    index = []
+    columns = {feat: FeatureColumn() for feat in feats}
+    orig_index = []
+    orig_ids = []
+
+    print("reading ", inters_fp)
+    for idx, lines in iter_intersections(inters_fp):
+        index.append(idx)
+        for feat in feats:
+            value, any_missing = column_max([line.get(feat) for line in lines])
+            columns[feat].append(value)
+            # Columns with missing values come out as floats, as they do with pandas
+            columns[feat].missing |= any_missing
+        orig_index.extend([idx] * len(lines))
+        orig_ids.extend(line.get('orig_id') for line in lines)
+
+    print("reading ", non_inters_fp)
+    for properties in iter_geojson_properties(non_inters_fp):
+        index.append(properties['id'])
+        for feat in feats:
+            columns[feat].append(properties.get(feat))
+        orig_index.append(properties['id'])
+        orig_ids.append(properties.get('orig_id'))
+
+    aggregated = pd.DataFrame({feat: columns[feat].array() for feat in feats},
+                              index=index, columns=feats)
+    del columns
+    # Only ids in both files still have more than one row
+    if not aggregated.index.is_unique:
+        aggregated = aggregated.groupby(level=0).max()
+    aggregated = aggregated.sort_index()
+    return aggregated, pd.Series(orig_ids, index=orig_index, name='orig_id')
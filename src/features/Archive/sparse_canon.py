@@ -0,0 +1,161 @@
+# Sparse segment x period representation of the canonical dataset
+# Crash/concern counts are kept as sparse matrices, one row per segment
+# and one column per period, holding only the non-zero counts. Static
+# segment features are stored once, and dense rows (one per segment per
+# period, as group_by_date used to build for everything) are only made
+# for the segments and periods asked for
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+FEATURES_NAME = 'segments.parquet'
+PERIODS_NAME = 'periods.parquet'
+COUNTS_PREFIX = 'counts_'
+
+
+def week_periods(cr_con):
+    """
+    The weeks the canonical dataset covers, for each year with counts
+    From the earliest week with a count in the year, up to (but not
+    including) the year's last ISO week, or the last week with a count
+    in 2017, which isn't a full year
+    Args:
+        cr_con - counts with year and week columns
+    Returns:
+        DataFrame of year, week, in order
+    """
+    periods = []
+    for y in cr_con.year.unique():
+        if y == 2017:
+            yr_max = cr_con[cr_con.year == 2017].week.max()
+        else:
+            yr_max = pd.Timestamp('12-31-{}'.format(y)).week
+            # some years the last week = 1, make it 52 in that case
+            if yr_max == 1:
+                yr_max = 52
+        yr_min = cr_con[cr_con.year == y].week.min()
+        periods += [(y, week) for week in range(yr_min, yr_max)]
+    return pd.DataFrame(sorted(set(periods)), columns=['year', 'week'], dtype='int64')
+
+
+class SparseCanon():
+    """
+    Canonical dataset with counts stored sparsely
+    Segments and periods are numbered by their position
+    Args:
+        features - static segment features, indexed by segment id
+        periods - DataFrame of period columns (e.g. year, week)
+        counts - dict of count name to a csr matrix of
+            segments x periods
+    """
+
+    def __init__(self, features, periods, counts):
+        self.features = features
+        self.periods = periods.reset_index(drop=True)
+        self.counts = counts
+
+    @classmethod
+    def from_counts(cls, cr_con, aggregated, periods=None, id_col='near_id'):
+        """
+        Build from long-form counts and segment features
+        Counts for segments without features, or outside the
+        periods, are left out
+        Args:
+            cr_con - DataFrame with id_col, the period columns, and a
+                column per count
+            aggregated - segment features, indexed by segment id
+            periods - DataFrame of period columns, defaults to week_periods
+            id_col - segment id column of cr_con
+        """
+        if periods is None:
+            periods = week_periods(cr_con)
+        period_cols = list(periods.columns)
+
+        rows = aggregated.index.get_indexer(cr_con[id_col])
+        cols = pd.MultiIndex.from_frame(periods).get_indexer(
+            pd.MultiIndex.from_frame(cr_con[period_cols]))
+        keep = (rows >= 0) & (cols >= 0)
+        shape = (len(aggregated), len(periods))
+
+        counts = {}
+        for name in cr_con.columns.drop([id_col] + period_cols):
+            values = cr_con[name].values[keep]
+            nonzero = values != 0
+            counts[name] = sparse.coo_matrix(
+                (values[nonzero].astype('int64'),
+                 (rows[keep][nonzero], cols[keep][nonzero])), shape=shape).tocsr()
+        return cls(aggregated, periods, counts)
+
+    @property
+    def shape(self):
+        return len(self.features), len(self.periods)
+
+    def nonzero_segments(self, name='crash'):
+        """
+        Ids of the segments with any count of this kind
+        """
+        totals = np.asarray(self.counts[name].sum(axis=1)).ravel()
+        return self.features.index[totals > 0]
+
+    def dense(self, segments=None, periods=None, features=True):
+        """
+        Dense rows, one per segment per period, like the old
+        group_by_date output
+        Args:
+            segments - segment ids, all of them by default
+            periods - period positions, all of them by default
+            features - whether to join the static segment features on
+        Returns:
+            DataFrame of segment_id, the period columns, the counts and
+            the segment features, ordered by segment then period
+        """
+        seg_pos = np.arange(len(self.features)) if segments is None \
+            else self.features.index.get_indexer(segments)
+        if (seg_pos < 0).any():
+            raise KeyError('Unknown segment ids')
+        per_pos = np.arange(len(self.periods)) if periods is None \
+            else np.asarray(periods)
+        rows = np.repeat(seg_pos, len(per_pos))
+        cols = np.tile(per_pos, len(seg_pos))
+
+        frame = pd.DataFrame({'segment_id': self.features.index.values[rows]})
+        for col in self.periods.columns:
+            frame[col] = self.periods[col].values[cols]
+        for name, matrix in self.counts.items():
+            # Row-major, matching the repeat/tile order above
+            frame[name] = matrix[seg_pos][:, per_pos].toarray().ravel()
+        if features:
+            frame = pd.concat(
+                [frame, self.features.iloc[rows].reset_index(drop=True)], axis=1)
+        return frame
+
+    def iter_dense(self, chunksize=1000, **kwargs):
+        """
+        Dense rows a chunk of segments at a time
+        """
+        for start in range(0, len(self.features), chunksize):
+            yield self.dense(
+                segments=self.features.index[start:start + chunksize], **kwargs)
+
+    def save(self, directory):
+        """
+        Write the features, periods and count matrices to a directory
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.features.to_parquet(os.path.join(directory, FEATURES_NAME))
+        self.periods.to_parquet(os.path.join(directory, PERIODS_NAME))
+        for name, matrix in self.counts.items():
+            sparse.save_npz(os.path.join(directory, COUNTS_PREFIX + name + '.npz'), matrix)
+
+    @classmethod
+    def load(cls, directory):
+        features = pd.read_parquet(os.path.join(directory, FEATURES_NAME))
+        periods = pd.read_parquet(os.path.join(directory, PERIODS_NAME))
+        counts = {}
+        for filename in sorted(os.listdir(directory)):
+            if filename.startswith(COUNTS_PREFIX) and filename.endswith('.npz'):
+                name = filename[len(COUNTS_PREFIX):-len('.npz')]
+                counts[name] = sparse.load_npz(os.path.join(directory, filename))
+        return cls(features, periods, counts)
@@ -0,0 +1,109 @@
+# Vectorized time bucketing for point records
+# Every record is assigned the start of the hour, day, ISO week (starting
+# Monday) or month it falls in, a whole column at a time, and records
+# are counted per location per period
+# Periods are taken from local (wall clock) times, as the row by row
+# isocalendar() this replaced did
+import pandas as pd
+
+GRANULARITIES = ['hour', 'day', 'week', 'month']
+# Trailing UTC offset of an ISO date string
+UTC_OFFSET = r'(Z|[+-]\d\d:?\d\d)$'
+
+
+def local_times(dates, timezone=None):
+    """
+    Dates as naive local times
+    Args:
+        dates - Series of datetimes or date strings; naive, tz-aware, or
+            with differing UTC offsets (e.g. either side of a daylight
+            saving change)
+        timezone - timezone to convert tz-aware dates to, in which case
+            naive date strings are taken as UTC; without it each date
+            keeps its own offset's wall clock time
+    Returns:
+        Series of naive datetimes
+    """
+    dates = pd.Series(dates)
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        parsed = dates
+    elif timezone is not None:
+        parsed = pd.to_datetime(dates, utc=True)
+    elif pd.api.types.infer_dtype(dates, skipna=True) == 'string':
+        # The wall clock time is the date with its offset left off
+        return pd.to_datetime(dates.str.replace(UTC_OFFSET, '', regex=True))
+    else:
+        parsed = pd.to_datetime(dates)
+        if not pd.api.types.is_datetime64_any_dtype(parsed):
+            # Timestamps with differing offsets, one distinct date at a time
+            codes, uniques = pd.factorize(parsed)
+            wall = pd.DatetimeIndex([d.replace(tzinfo=None) for d in uniques])
+            return pd.Series(wall.take(codes, allow_fill=True, fill_value=pd.NaT),
+                             index=dates.index)
+    if parsed.dt.tz is not None:
+        if timezone is not None:
+            parsed = parsed.dt.tz_convert(timezone)
+        parsed = parsed.dt.tz_localize(None)
+    return parsed
+
+
+def period_start(dates, granularity='week', timezone=None):
+    """
+    Start of the period each date falls in
+    Args:
+        dates - Series of datetimes, see local_times
+        granularity - one of GRANULARITIES
+        timezone - see local_times
+    Returns:
+        Series of naive local datetimes
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError('Unknown granularity {}, expected one of {}'.format(
+            granularity, ', '.join(GRANULARITIES)))
+    dates = local_times(dates, timezone)
+    if granularity == 'hour':
+        return dates.dt.floor('h')
+    day = dates.dt.normalize()
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - pd.to_timedelta(day.dt.dayofweek.fillna(0), unit='D')
+    return day - pd.to_timedelta(day.dt.day.fillna(1) - 1, unit='D')
+
+
+def count_by_period(ids, dates, granularity='week', id_name='near_id', timezone=None):
+    """
+    Number of records for each location in each period
+    Records without a date or a location are left out
+    Args:
+        ids - Series of location ids
+        dates - Series of datetimes, aligned with ids
+        granularity - one of GRANULARITIES
+        id_name - name of the location level of the result
+        timezone - see local_times
+    Returns:
+        Series of counts indexed by (id_name, 'period'), where
+        period is the start of the period
+    """
+    periods = period_start(dates, granularity, timezone)
+    counts = pd.Series(1, index=periods.index).groupby(
+        [pd.Series(ids).values, periods.values]).size()
+    counts.index.names = [id_name, 'period']
+    return counts
+
+
+def iso_weeks(counts):
+    """
+    Re-key weekly counts from count_by_period on ISO year and week
+    Args:
+        counts - Series indexed by (id, 'period') with weekly periods
+    Returns:
+        Series indexed by (id, 'year', 'week')
+    """
+    id_name = counts.index.names[0]
+    frame = counts.reset_index()
+    iso = pd.DatetimeIndex(frame['period']).isocalendar()
+    frame['year'] = iso['year'].astype('int64').values
+    frame['week'] = iso['week'].astype('int64').values
+    value = counts.name if counts.name is not None else 0
+    return frame.set_index([id_name, 'year', 'week'])[value].rename(counts.name)
@@ -0,0 +1,176 @@
+# Snap points (crashes, concerns, waze events) to their nearest road segment
+# Segment geometries from inter_and_non_int.geojson are projected to metres
+# once and kept in an npz file next to the geojson, and an STRtree over them
+# answers nearest-segment queries for whole arrays of points at a time
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+# Mean earth radius, in metres
+EARTH_RADIUS = 6371008.8
+INDEX_SUFFIX = '.index.npz'
+# Points further than this from any segment (in metres) aren't snapped
+MAX_DISTANCE = 30
+BATCH_SIZE = 100000
+
+
+def project(lon, lat, origin):
+    """
+    Longitudes and latitudes to x, y in metres from origin
+    """
+    lon0, lat0 = origin
+    x = np.radians(np.asarray(lon, dtype=float) - lon0) \
+        * EARTH_RADIUS * np.cos(np.radians(lat0))
+    y = np.radians(np.asarray(lat, dtype=float) - lat0) * EARTH_RADIUS
+    return x, y
+
+
+class SegmentIndex():
+    """
+    Spatial index over road segments, in metres
+    Coordinates are projected with an equirectangular projection centred
+    on the network, which is accurate to well under a metre over a city
+    Args:
+        ids - segment ids, kept as strings
+        geometries - array of projected shapely geometries
+        origin - (longitude, latitude) the projection is centred on
+    """
+
+    def __init__(self, ids, geometries, origin):
+        # Ids are strings, however the geojson stores them, so they're
+        # the same whether the index was just built or loaded
+        self.ids = np.array([str(i) for i in ids], dtype=object)
+        self.geometries = geometries
+        self.origin = origin
+        self.tree = shapely.STRtree(geometries)
+
+    @classmethod
+    def from_geojson(cls, path, id_field='id'):
+        """
+        Build the index from a geojson of segments in longitude/latitude
+        """
+        with open(path) as f:
+            features = json.load(f)['features']
+        ids = [feature['properties'][id_field] for feature in features]
+        geometries = np.array([shape(feature['geometry']) for feature in features],
+                              dtype=object)
+        coords = shapely.get_coordinates(geometries)
+        origin = tuple(coords.mean(axis=0)) if len(coords) else (0.0, 0.0)
+        projected = shapely.transform(
+            geometries, lambda xy: np.column_stack(project(xy[:, 0], xy[:, 1], origin)))
+        return cls(ids, projected, origin)
+
+    def save(self, path, source=None):
+        """
+        Write the projected segments to an npz file
+        Args:
+            path
+            source - geojson the index was built from, whose size and
+                mtime are kept so a changed file can be spotted
+        """
+        stat = os.stat(source) if source else None
+        np.savez(path, ids=self.ids.astype(str),
+                 wkb=np.array(shapely.to_wkb(self.geometries), dtype=object),
+                 origin=np.array(self.origin),
+                 source=np.array([stat.st_size, stat.st_mtime] if stat else []))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as data:
+            return cls(data['ids'], shapely.from_wkb(data['wkb']),
+                       tuple(data['origin']))
+
+    @classmethod
+    def cached(cls, geojson, id_field='id'):
+        """
+        Load the index saved next to a geojson, building and saving it
+        first if there isn't one or the geojson has changed since
+        """
+        path = geojson + INDEX_SUFFIX
+        if os.path.exists(path):
+            stat = os.stat(geojson)
+            with np.load(path, allow_pickle=True) as data:
+                source = list(data['source'])
+            if source == [stat.st_size, stat.st_mtime]:
+                return cls.load(path)
+        print("Building segment index for {}".format(geojson))
+        index = cls.from_geojson(geojson, id_field=id_field)
+        index.save(path, source=geojson)
+        return index
+
+    def snap(self, lon, lat, max_distance=MAX_DISTANCE):
+        """
+        Nearest segment to each point
+        Args:
+            lon, lat - arrays of coordinates; missing ones aren't snapped
+            max_distance - metres
+        Returns:
+            array of segment ids (None where nothing is close enough),
+            array of distances in metres (NaN there)
+        """
+        x, y = project(lon, lat, self.origin)
+        near_id = np.full(len(x), None, dtype=object)
+        distance = np.full(len(x), np.nan)
+        present = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+        if not len(present) or not len(self.ids):
+            return near_id, distance
+
+        points = shapely.points(x[present], y[present])
+        # Every segment within range of each point, then the closest of
+        # those; much faster than a nearest query per point
+        point_pos, segment_pos = self.tree.query(
+            points, predicate='dwithin', distance=max_distance)
+        found = shapely.distance(points[point_pos], self.geometries[segment_pos])
+        order = np.lexsort((segment_pos, found, point_pos))
+        point_pos, segment_pos, found = point_pos[order], segment_pos[order], found[order]
+        closest = np.r_[True, point_pos[1:] != point_pos[:-1]] if len(order) \
+            else np.zeros(0, dtype=bool)
+        near_id[present[point_pos[closest]]] = self.ids[segment_pos[closest]]
+        distance[present[point_pos[closest]]] = found[closest]
+        return near_id, distance
+
+
+def snap_frame(df, index, lat_col='LAT', lon_col='LON', max_distance=MAX_DISTANCE,
+               batch_size=BATCH_SIZE):
+    """
+    Add near_id and near_distance columns to a frame of points,
+    a batch of rows at a time
+    Returns:
+        the frame, with the two columns added
+    """
+    near_id = np.full(len(df), None, dtype=object)
+    distance = np.full(len(df), np.nan)
+    lat = pd.to_numeric(df[lat_col], errors='coerce').values
+    lon = pd.to_numeric(df[lon_col], errors='coerce').values
+    for start in range(0, len(df), batch_size):
+        end = start + batch_size
+        near_id[start:end], distance[start:end] = index.snap(
+            lon[start:end], lat[start:end], max_distance=max_distance)
+    df['near_id'] = near_id
+    df['near_distance'] = distance
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--segments", type=str, required=True,
+                        help="segment geojson, e.g. processed/maps/inter_and_non_int.geojson")
+    parser.add_argument("-p", "--points", type=str, required=True,
+                        help="csv of points to snap")
+    parser.add_argument("-o", "--output", type=str,
+                        help="csv to write, defaults to overwriting the points")
+    parser.add_argument("--lat", type=str, default='LAT', help="latitude column")
+    parser.add_argument("--lon", type=str, default='LON', help="longitude column")
+    parser.add_argument("--max_distance", type=float, default=MAX_DISTANCE,
+                        help="metres from a segment to snap within")
+    args = parser.parse_args()
+
+    index = SegmentIndex.cached(args.segments)
+    points = snap_frame(pd.read_csv(args.points), index, lat_col=args.lat,
+                        lon_col=args.lon, max_distance=args.max_distance)
+    print("Snapped {} of {} points".format(points.near_id.notna().sum(), len(points)))
+    points.to_csv(args.output or args.points, index=False)
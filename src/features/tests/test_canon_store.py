@@ -0,0 +1,69 @@
+import os
+import pandas as pd
+from ..Archive import canon_store, sparse_canon, time_buckets
+
+
+def make_canon(crashes):
+    aggregated = pd.DataFrame({'width': [10, 20]}, index=['001', '002'])
+    cr_con = pd.DataFrame(crashes, columns=['near_id', 'year', 'week', 'crash'])
+    periods = pd.DataFrame({'year': [2016, 2016, 2016], 'week': [1, 2, 3]})
+    return sparse_canon.SparseCanon.from_counts(
+        cr_con, aggregated, periods=periods[periods.week <= cr_con.week.max()])
+
+
+def test_update_rewrites_changed_weeks(tmpdir):
+    store = canon_store.PartitionedCanon(str(tmpdir))
+    canon = make_canon([('001', 2016, 1, 1), ('002', 2016, 2, 2)])
+    assert len(store.update(canon)) == 2
+
+    # A new week, and a late crash in week 2
+    canon = make_canon([('001', 2016, 1, 1), ('002', 2016, 2, 2),
+                        ('001', 2016, 2, 1), ('002', 2016, 3, 1)])
+    store = canon_store.PartitionedCanon(str(tmpdir))
+    written = store.update(canon)
+    assert sorted(os.path.basename(p) for p in written) == [
+        '2016-02.parquet', '2016-03.parquet']
+    assert store.update(canon) == []
+
+    pd.testing.assert_frame_equal(store.read(), canon.dense())
+    assert store.read(years=[2015]).empty
+
+
+def test_update_removes_weeks(tmpdir):
+    store = canon_store.PartitionedCanon(str(tmpdir))
+    store.update(make_canon([('001', 2016, 1, 1), ('002', 2016, 2, 2)]))
+
+    # Week 2's only crash moved to week 1, so it's no longer covered
+    changed = store.update(make_canon([('001', 2016, 1, 1), ('002', 2016, 1, 2)]))
+    assert sorted(os.path.basename(p) for p in changed) == [
+        '2016-01.parquet', '2016-02.parquet']
+    assert not os.path.exists(os.path.join(str(tmpdir), '2016-02.parquet'))
+
+
+def test_weekly_counts(tmpdir):
+    ids = pd.Series(['1', '1', '2', '2', None])
+    dates = pd.Series(pd.to_datetime(['2016-01-04', '2016-01-05', '2016-01-12',
+                                      '2016-01-20', '2016-01-20']))
+    expected = time_buckets.iso_weeks(time_buckets.count_by_period(ids, dates, 'week'))
+
+    counts = canon_store.WeeklyCounts(str(tmpdir))
+    result = counts.update(ids, time_buckets.period_start(dates))
+    assert result.to_dict() == expected.to_dict()
+    assert result.index.names == ['near_id', 'year', 'week']
+    assert counts.changed == [201601, 201602, 201603]
+
+    # A crash added to week 2 and one in a new week; only those are recounted
+    ids = pd.concat([ids, pd.Series(['1', '2'])], ignore_index=True)
+    dates = pd.concat([dates, pd.Series(pd.to_datetime(['2016-01-13', '2016-01-27']))],
+                      ignore_index=True)
+    expected = time_buckets.iso_weeks(time_buckets.count_by_period(ids, dates, 'week'))
+    counts = canon_store.WeeklyCounts(str(tmpdir))
+    assert counts.update(ids, time_buckets.period_start(dates)).to_dict() == expected.to_dict()
+    assert counts.changed == [201602, 201604]
+
+    # Week 4's crash removed
+    counts = canon_store.WeeklyCounts(str(tmpdir))
+    assert counts.update(ids[:-1], time_buckets.period_start(dates[:-1])).to_dict() == \
+        time_buckets.iso_weeks(time_buckets.count_by_period(
+            ids[:-1], dates[:-1], 'week')).to_dict()
+    assert counts.changed == [201604]
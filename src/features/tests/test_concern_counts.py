@@ -0,0 +1,24 @@
+import json
+import pandas as pd
+from ..Archive import concern_counts
+
+
+def test_read_concerns(tmpdir):
+    records = [
+        {'source': 'visionzero', 'near_id': '002'},
+        {'source': 'seeclickfix', 'near_id': '001'},
+        {'source': 'visionzero', 'near_id': '001'},
+        {'source': 'visionzero', 'near_id': '002'},
+        # Not on a segment
+        {'source': 'seeclickfix', 'near_id': ''},
+        {'source': 'seeclickfix', 'near_id': None},
+        {'source': 'other'},
+    ]
+    path = tmpdir.join('concern_joined.json')
+    path.write(json.dumps(records))
+
+    counts = concern_counts.read_concerns(str(path), 'near_id')
+    # One column per source, in the order they first appear
+    expected = pd.DataFrame({'visionzero': [1, 2], 'seeclickfix': [1, 0]},
+                            index=['001', '002'])
+    pd.testing.assert_frame_equal(counts, expected, check_dtype=False)
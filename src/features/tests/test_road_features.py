@@ -0,0 +1,69 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+from ..Archive import road_features
+
+INTERS = {
+    '1': [{'width': 10, 'lanes': 2, 'orig_id': 5, 'other': 'x'},
+          {'width': 30, 'lanes': None, 'orig_id': 6}],
+    '10': [{'width': 5, 'lanes': 1, 'orig_id': 7}],
+}
+NON_INTERS = {
+    'type': 'FeatureCollection',
+    'features': [
+        {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]},
+         'properties': {'id': '002', 'width': 12, 'lanes': 3, 'orig_id': 8}},
+        {'type': 'Feature', 'geometry': None,
+         'properties': {'id': '001', 'width': 8.5, 'lanes': 1, 'orig_id': 9}},
+    ],
+    'crs': {'type': 'name'},
+}
+
+
+def test_json_stream():
+    text = '{"a": [1, 22.5e3, {"b": "}]"}], "c" : 123456, "d": []}'
+    # Tiny chunks, so values are split across reads
+    stream = road_features.JsonStream(io.StringIO(text), chunk_size=3)
+    values = {}
+    for key in stream.items():
+        if key == 'a':
+            values[key] = list(stream.elements())
+        else:
+            values[key] = stream.value()
+    assert values == json.loads(text)
+
+
+def test_stream_road_features(tmpdir):
+    inters_fp = tmpdir.join('inters_data.json')
+    inters_fp.write(json.dumps(INTERS, indent=2))
+    non_inters_fp = tmpdir.join('non_inters_segments.geojson')
+    non_inters_fp.write(json.dumps(NON_INTERS))
+
+    aggregated, orig_ids = road_features.stream_road_features(
+        ['width', 'lanes'], str(inters_fp), str(non_inters_fp))
+
+    # The old version, loading everything
+    records = [line for lines in INTERS.values() for line in lines]
+    index = [idx for idx, lines in INTERS.items() for _ in lines]
+    combined = pd.concat([
+        pd.DataFrame(records, index=index),
+        pd.DataFrame([f['properties'] for f in NON_INTERS['features']]).set_index('id')])
+    expected = combined[['width', 'lanes']].groupby(combined.index).max()
+
+    pd.testing.assert_frame_equal(aggregated, expected, check_names=False)
+    assert orig_ids.to_dict() == combined['orig_id'].groupby(level=0).last().to_dict()
+    assert list(orig_ids.index) == list(combined.index)
+
+
+def test_feature_column():
+    def column(values):
+        col = road_features.FeatureColumn()
+        for value in values:
+            col.append(value)
+        return col.array()
+
+    assert column([1, 2]).dtype == 'int64'
+    assert column([1, 2.5]).dtype == 'float64'
+    assert np.isnan(column([1, None])).tolist() == [False, True]
+    assert column([1, 'a']).tolist() == [1, 'a']
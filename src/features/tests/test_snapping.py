@@ -0,0 +1,74 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from .. import snapping
+
+
+def write_segments(path):
+    # Two east-west streets about 111m apart, and a north-south one
+    features = [
+        {'type': 'Feature', 'properties': {'id': '001'},
+         'geometry': {'type': 'LineString',
+                      'coordinates': [[-71.06, 42.35], [-71.05, 42.35]]}},
+        {'type': 'Feature', 'properties': {'id': '002'},
+         'geometry': {'type': 'LineString',
+                      'coordinates': [[-71.06, 42.351], [-71.05, 42.351]]}},
+        {'type': 'Feature', 'properties': {'id': '003'},
+         'geometry': {'type': 'LineString',
+                      'coordinates': [[-71.07, 42.34], [-71.07, 42.36]]}},
+    ]
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+
+def test_snap_frame(tmpdir):
+    path = os.path.join(str(tmpdir), 'inter_and_non_int.geojson')
+    write_segments(path)
+    index = snapping.SegmentIndex.from_geojson(path)
+
+    points = pd.DataFrame({
+        'LAT': [42.3501, 42.3509, 42.355, 42.3505, None, 42.45],
+        'LON': [-71.055, -71.055, -71.0701, -71.055, -71.055, -71.055],
+    })
+    snapped = snapping.snap_frame(points, index, max_distance=30, batch_size=4)
+    assert snapped.near_id.tolist() == ['001', '002', '003', None, None, None]
+    # 0.0001 degrees of latitude is about 11m
+    assert np.allclose(snapped.near_distance[:2], 11.1, atol=0.1)
+    assert snapped.near_distance[3:].isna().all()
+
+
+def test_cached_index(tmpdir):
+    path = os.path.join(str(tmpdir), 'inter_and_non_int.geojson')
+    write_segments(path)
+    index = snapping.SegmentIndex.cached(path)
+    assert os.path.exists(path + snapping.INDEX_SUFFIX)
+
+    loaded = snapping.SegmentIndex.cached(path)
+    assert list(loaded.ids) == list(index.ids)
+    lon, lat = np.array([-71.055, -71.0701]), np.array([42.3509, 42.355])
+    assert list(loaded.snap(lon, lat)[0]) == list(index.snap(lon, lat)[0])
+
+    # A changed network is reindexed
+    with open(path) as f:
+        segments = json.load(f)
+    segments['features'] = segments['features'][:1]
+    with open(path, 'w') as f:
+        json.dump(segments, f)
+    assert list(snapping.SegmentIndex.cached(path).ids) == ['001']
+
+
+def test_int_ids(tmpdir):
+    path = os.path.join(str(tmpdir), 'inter_and_non_int.geojson')
+    write_segments(path)
+    with open(path) as f:
+        segments = json.load(f)
+    for i, feature in enumerate(segments['features']):
+        feature['properties']['id'] = i + 1
+    with open(path, 'w') as f:
+        json.dump(segments, f)
+
+    lon, lat = np.array([-71.055]), np.array([42.3501])
+    # Built and loaded indexes give the same ids
+    assert snapping.SegmentIndex.cached(path).snap(lon, lat)[0].tolist() == ['1']
+    assert snapping.SegmentIndex.cached(path).snap(lon, lat)[0].tolist() == ['1']
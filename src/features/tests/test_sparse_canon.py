@@ -0,0 +1,65 @@
+import pandas as pd
+from ..Archive import sparse_canon
+
+
+def dense_group_by_date(cr_con, aggregated):
+    """
+    The old, fully dense version of group_by_date
+    """
+    all_weeks = None
+    for y in cr_con.year.unique():
+        if y == 2017:
+            yr_max = cr_con[cr_con.year == 2017].week.max()
+        else:
+            yr_max = pd.Timestamp('12-31-{}'.format(y)).week
+            if yr_max == 1:
+                yr_max = 52
+        yr_min = cr_con[cr_con.year == y].week.min()
+        yr_index = pd.MultiIndex.from_product(
+            [aggregated.index, [y], list(range(yr_min, yr_max))],
+            names=['segment_id', 'year', 'week'])
+        all_weeks = yr_index if all_weeks is None else all_weeks.union(yr_index)
+    cr_con = cr_con.set_index(
+        ['near_id', 'year', 'week']).reindex(all_weeks, fill_value=0)
+    cr_con.reset_index(inplace=True)
+    return cr_con.merge(aggregated, left_on='segment_id', right_index=True, how='outer')
+
+
+def make_inputs():
+    aggregated = pd.DataFrame({'width': [10, 20, 30], 'lanes': [1, 2, 2]},
+                              index=['001', '002', '1'])
+    cr_con = pd.DataFrame({
+        'near_id': ['001', '001', '1', '1', '999'],
+        'year': [2016, 2016, 2016, 2017, 2017],
+        'week': [40, 45, 50, 3, 2],
+        'crash': [1, 2, 1, 4, 1],
+    })
+    return cr_con, aggregated
+
+
+def test_dense_matches_group_by_date():
+    cr_con, aggregated = make_inputs()
+    canon = sparse_canon.SparseCanon.from_counts(cr_con, aggregated)
+
+    expected = dense_group_by_date(cr_con, aggregated).reset_index(drop=True)
+    pd.testing.assert_frame_equal(canon.dense(), expected)
+    # Only the non-zero counts are stored; 2017 stops before its last
+    # week with a count, and 999 isn't a segment
+    assert canon.counts['crash'].nnz == 3
+    assert canon.shape == (3, len(expected) // 3)
+
+
+def test_slices_and_storage(tmpdir):
+    cr_con, aggregated = make_inputs()
+    canon = sparse_canon.SparseCanon.from_counts(cr_con, aggregated)
+    assert list(canon.nonzero_segments()) == ['001', '1']
+
+    chunks = list(canon.iter_dense(chunksize=2))
+    assert [len(c.segment_id.unique()) for c in chunks] == [2, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), canon.dense())
+
+    canon.save(str(tmpdir))
+    loaded = sparse_canon.SparseCanon.load(str(tmpdir))
+    one = loaded.dense(segments=['1'], features=False)
+    assert list(one.columns) == ['segment_id', 'year', 'week', 'crash']
+    assert one.crash.sum() == 1
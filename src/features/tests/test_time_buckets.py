@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+from ..Archive import time_buckets
+
+
+def test_period_start():
+    dates = pd.Series(pd.to_datetime(['2018-12-31 13:45', '2019-01-06 23:59']))
+    assert list(time_buckets.period_start(dates, 'hour')) == [
+        pd.Timestamp('2018-12-31 13:00'), pd.Timestamp('2019-01-06 23:00')]
+    assert list(time_buckets.period_start(dates, 'day')) == [
+        pd.Timestamp('2018-12-31'), pd.Timestamp('2019-01-06')]
+    assert list(time_buckets.period_start(dates, 'week')) == [
+        pd.Timestamp('2018-12-31'), pd.Timestamp('2018-12-31')]
+    assert list(time_buckets.period_start(dates, 'month')) == [
+        pd.Timestamp('2018-12-01'), pd.Timestamp('2019-01-01')]
+    with pytest.raises(ValueError):
+        time_buckets.period_start(dates, 'fortnight')
+
+
+def test_counts_match_isocalendar():
+    dates = pd.Series(pd.to_datetime([
+        '2016-01-01', '2016-01-03', '2016-01-04', '2017-12-31', '2018-01-01',
+        '2018-01-01 08:00', None]))
+    ids = pd.Series(['1', '1', '1', '2', '2', '2', '2'])
+
+    counts = time_buckets.iso_weeks(time_buckets.count_by_period(ids, dates, 'week'))
+    # The old row by row version
+    df = pd.DataFrame({'near_id': ids, 'date': dates}).dropna()
+    iso = df['date'].apply(lambda d: d.isocalendar())
+    df['year'] = iso.apply(lambda x: x[0])
+    df['week'] = iso.apply(lambda x: x[1])
+    expected = df.groupby(['near_id', 'year', 'week']).size()
+
+    assert counts.index.names == ['near_id', 'year', 'week']
+    assert counts.to_dict() == expected.to_dict()
+
+
+def test_count_by_hour():
+    dates = pd.Series(pd.to_datetime(['2018-01-01 08:10', '2018-01-01 08:50',
+                                      '2018-01-01 09:00']))
+    counts = time_buckets.count_by_period(['a', 'a', 'a'], dates, 'hour', id_name='segment')
+    assert counts.index.names == ['segment', 'period']
+    assert counts.tolist() == [2, 1]
+
+
+def test_daylight_saving_offsets():
+    # Either side of the change to daylight saving time in Boston
+    dates = pd.Series(['2018-03-10T23:30:00-05:00', '2018-03-11T00:30:00-05:00',
+                       '2018-03-12T08:00:00-04:00', None])
+    expected = [pd.Timestamp('2018-03-05'), pd.Timestamp('2018-03-05'),
+                pd.Timestamp('2018-03-12'), pd.NaT]
+    assert list(time_buckets.period_start(dates, 'week')) == expected
+    assert list(time_buckets.period_start(
+        dates, 'week', timezone='America/New_York')) == expected
+    assert list(time_buckets.period_start(dates, 'hour')) == [
+        pd.Timestamp('2018-03-10 23:00'), pd.Timestamp('2018-03-11 00:00'),
+        pd.Timestamp('2018-03-12 08:00'), pd.NaT]
+
+    counts = time_buckets.iso_weeks(time_buckets.count_by_period(['1'] * 4, dates))
+    assert counts.to_dict() == {('1', 2018, 10): 2, ('1', 2018, 11): 1}
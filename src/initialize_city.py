@@ -2,14 +2,12 @@ import argparse
 import os
 import shutil
 import tzlocal
-from data.util import geocode_address
+from tools.geocode_cache import cache_path, geocode_address
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
-def make_config_file(yml_file, timezone, city, folder, crash_file_path, map_file_path, map_inters_file_path, atmosphere_file_path, merged_file_path, cat_feat, cont_feat, keep_feat):
-
-    address = geocode_address(city)
+def make_config_file(yml_file, timezone, city, address, folder, crash_file_path, map_file_path, map_inters_file_path, atmosphere_file_path, merged_file_path, cat_feat, cont_feat, keep_feat):
 
     f = open(yml_file, 'w')
     f.write(
@@ -25,6 +23,15 @@ def make_config_file(yml_file, timezone, city, folder, crash_file_path, map_file
         "# Limit crashes to between start and end date\n" +
         "startdate: \n" +
         "enddate: \n" +
+        "# Stream the raw crash files to stay under this much memory (MB), leave blank to read them in full\n" +
+        "max_memory_mb: \n" +
+        "# Spec describing the raw crash files, a name in data_standardization/crash_specs or a path\n" +
+        "crash_standardization: vicroads\n" +
+        "# Only standardize accidents that are new or changed since the last run\n" +
+        "incremental_standardization: False\n" +
+        "# Concern files, as a list of sources (see data_standardization/concern_specs),\n" +
+        "# leave blank to use the city's spec in concern_specs\n" +
+        "concerns: \n" +
         "#################################################################\n" +
         "crash_files:\n" +
         "  {}\n".format(crash_file_path) +
@@ -41,8 +48,7 @@ def make_config_file(yml_file, timezone, city, folder, crash_file_path, map_file
     print("Wrote new configuration file in {}".format(yml_file))
 
 
-def make_js_config(jsfile, city, folder):
-    address = geocode_address(city)
+def make_js_config(jsfile, city, address, folder):
 
     f = open(jsfile, 'w')
     f.write(
@@ -129,10 +135,17 @@ if __name__ == '__main__':
     else:
         print(folder + "folder already initialized, skipping")
 
-    # Create our yml config file
     yml_file = os.path.join(BASE_DIR, 'src/config/' + folder + '.yml')
+    js_file_path = os.path.join(BASE_DIR, 'reports', folder, 'config.js')
+
+    # Geocode the city once for both config files, through the city's cache
+    address = None
+    if not os.path.exists(yml_file) or not os.path.exists(js_file_path):
+        address = geocode_address(city, cache_path(PROCESSED_DIR))
+
+    # Create our yml config file
     if not os.path.exists(yml_file):
-        make_config_file(yml_file, tzlocal.get_localzone().zone, city, folder, crash_file_path, map_file_path, map_inters_file_path, atmosphere_file_path, merged_file_path, cat_feat, cont_feat, keep_feat)
+        make_config_file(yml_file, tzlocal.get_localzone().zone, city, address, folder, crash_file_path, map_file_path, map_inters_file_path, atmosphere_file_path, merged_file_path, cat_feat, cont_feat, keep_feat)
 
     # Create our js config file
     reports_file_path = os.path.join(BASE_DIR, 'reports', folder)
@@ -141,7 +154,6 @@ if __name__ == '__main__':
         print('Making reports file path')
         os.makedirs(reports_file_path)
 
-    js_file_path = os.path.join(BASE_DIR, 'reports', folder, 'config.js')
     if not os.path.exists(js_file_path):
         print("Writing config.js")
-        make_js_config(js_file_path, city, folder)
+        make_js_config(js_file_path, city, address, folder)
@@ -9,6 +9,7 @@ import matplotlib.pyplot as plt
 from sklearn import metrics
 from sklearn.model_selection import RandomizedSearchCV, KFold, GroupShuffleSplit
 from sklearn.calibration import CalibratedClassifierCV
+from tools import run_report
 
 
 class Indata():
@@ -137,6 +138,7 @@ class Tuner():
 
         return(best, results)
 
+    @run_report.profiled('Tuner.tune')
     def tune(self, name, m_name, features, cvparams, mparams):
 
         # Check which model to use based on if m_name appears within relevant modules
@@ -155,6 +157,7 @@ class Tuner():
         # Returns a RandomizedSearchCV object
         print('Creating parameter grid for {}'.format(m_name))
         grid = self.make_grid(model, cvparams, mparams)
+        run_report.annotate(model=name, rows_in=len(self.train_x))
 
         print('Running the grid fit for {}'.format(m_name))
         best, results = self.run_grid(grid, self.train_x[features], self.train_y)
@@ -225,6 +228,7 @@ class Tester():
         result['brier'] = brier
         return(result)
 
+    @run_report.profiled('Tester.run_model')
     def run_model(self, name, model, features, cal=True, cal_m='sigmoid'):
         """
         Run a specific model (not from Tuner classs)
@@ -236,6 +240,8 @@ class Tester():
         results['features'] = list(features)
         results['model'] = model
         print("Fitting {} model with {} features".format(name, len(features)))
+        run_report.annotate(model=name, rows_in=len(self.data.train_x),
+                            rows_out=len(self.data.test_x))
         if cal:
             # Need disjoint calibration/training datasets
             # Split 50/50
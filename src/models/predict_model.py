@@ -1,6 +1,7 @@
 # Need to be able to process batch and single results
 # Need to load in data with near_id
 
+import numpy as np
 import pandas as pd
 import os
 import argparse
@@ -11,10 +12,15 @@ import pickle
 
 CURR_FP = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(CURR_FP)
+sys.path.append(os.path.dirname(CURR_FP))
 
 from model_utils import format_crash_data
 from model_classes import Indata, Tuner, Tester
 from train_model import process_features, get_features
+from tools.stage_cache import StageCache, MANIFEST_NAME
+from tools.segment_keys import SegmentKeys, SEGMENT_KEYS_NAME, NO_SEGMENT
+from tools import run_report
+from data_standardization.store import read_table
 import sklearn.linear_model as skl
 
 
@@ -24,8 +30,12 @@ BASE_DIR = os.path.dirname(
             os.path.abspath(__file__))))
 
 
-def predict(trained_model, predict_data, features, data_model_features, DATA_DIR):
+@run_report.profiled()
+def predict(trained_model, predict_data, features, data_model_features, DATA_DIR,
+            segment_keys=None):
     """
+    Args:
+        segment_keys - SegmentKeys to turn int segment keys back into ids
     Returns
         nothing, writes prediction segments to file
     """
@@ -34,50 +44,41 @@ def predict(trained_model, predict_data, features, data_model_features, DATA_DIR
     predict_data_reduced = predict_data[data_model_features]
     preds = trained_model.predict_proba(predict_data_reduced)[::, 1]
     predict_data['predictions'] = preds
+    run_report.annotate(rows_out=len(predict_data))
+    if segment_keys is not None:
+        predict_data['segment_id'] = segment_keys.decode(predict_data['segment_id'])
 
     predict_data.to_csv(os.path.join(DATA_DIR, 'predictions.csv'), index=False)
     predict_data.to_json(os.path.join(DATA_DIR, 'predictions.json'), orient='index')
 
 
+@run_report.profiled()
 def get_accident_count_recent(predict_data, data):
+    """
+    Count each segment's crashes over the last week, month, year,
+    5 years and 10 years
+    Args:
+        predict_data - roads, with int segment keys
+        data - crashes, with DATE_TIME and int segment keys
+    Returns:
+        predict_data, with a column of counts for each period
+    """
     data['DATE_TIME'] = pd.to_datetime(data['DATE_TIME'])
 
     current_date = datetime.now()
-    past_7_days = current_date - pd.to_timedelta("7day")
-    past_30_days = current_date - pd.to_timedelta("30day")
-    past_365_days = current_date - pd.to_timedelta("365day")
-    past_1825_days = current_date - pd.to_timedelta("1825day")
-    past_3650_days = current_date - pd.to_timedelta("3650day")
-
-    recent_crash_7 = data.loc[data['DATE_TIME'] > past_7_days]
-    recent_crash_30 = data.loc[data['DATE_TIME'] > past_30_days]
-    recent_crash_365 = data.loc[data['DATE_TIME'] > past_365_days]
-    recent_crash_1825 = data.loc[data['DATE_TIME'] > past_1825_days]
-    recent_crash_3650 = data.loc[data['DATE_TIME'] > past_3650_days]
-
-    column_names = ['LAST_7_DAYS', 'LAST_30_DAYS', 'LAST_365_DAYS', 'LAST_1825_DAYS', 'LAST_3650_DAYS']
-    recent_crashes = [recent_crash_7, recent_crash_30, recent_crash_365, recent_crash_1825, recent_crash_3650]
-
-    for col_name in column_names:
-        predict_data[col_name] = ""
-
-    i = 0
-    print('About to append recent accident counts. This will take some time.')
-    for i in range(len(predict_data)):
-        current_segment_id = predict_data.loc[i].segment_id
-
-        for j in range(len(recent_crashes)):
-
-            # Find number of crashes at same segment that have occured in appropriate time period
-            recent_crash = recent_crashes[j]
-            num_crashes = len(recent_crash.loc[recent_crash['segment_id'] == current_segment_id])
-
-            # Assign this number to predict_data
-            col_name = column_names[j]
-            predict_data.at[i, col_name] = num_crashes
-
-        if i % 5000 == 0:
-            print("Got through {}% of results".format(100 * i / len(predict_data)))
+    periods = [('LAST_7_DAYS', '7day'), ('LAST_30_DAYS', '30day'),
+               ('LAST_365_DAYS', '365day'), ('LAST_1825_DAYS', '1825day'),
+               ('LAST_3650_DAYS', '3650day')]
+
+    segments = predict_data['segment_id'].values
+    known = segments != NO_SEGMENT
+    crash_segments = data['segment_id'].values
+    for col_name, period in periods:
+        recent = (data['DATE_TIME'] > current_date - pd.to_timedelta(period)).values
+        recent &= crash_segments != NO_SEGMENT
+        counts = np.bincount(crash_segments[recent],
+                             minlength=segments.max() + 1 if len(segments) else 0)
+        predict_data[col_name] = np.where(known, counts[np.where(known, segments, 0)], 0)
 
     return predict_data
 
@@ -132,7 +133,14 @@ if __name__ == '__main__':
     predict_data.reset_index(inplace=True, drop=True)
 
     # Read in crash data. We shall use this to attach historic accident counts to road data.
-    data = pd.read_csv(crash_data_path)
+    # Only the date and segment are needed, so just read those columns
+    data = read_table(crash_data_path, columns=['DATE_TIME', 'segment_id'], parse_dates=['DATE_TIME'])
+
+    # Segments are keyed by int until the predictions are written out
+    keys = SegmentKeys(os.path.join(PROCESSED_DIR, SEGMENT_KEYS_NAME))
+    predict_data['segment_id'] = keys.encode(predict_data['segment_id'])
+    data['segment_id'] = keys.encode(data['segment_id'], add=False)
+    keys.save()
 
     # Check NA within both DF
     predict_na = (predict_data.isna().sum()) / len(predict_data)
@@ -161,10 +169,20 @@ if __name__ == '__main__':
     predict_data['HOUR'] = hour
 
     # Attach accident data
+    # Recent accident counts depend on the roads, the crashes and the
+    # current date, so only recompute them when one of those changes.
+    # They're stored by segment key, so the keys are an input too
     predict_path = os.path.join(PROCESSED_DIR, 'predict.csv.gz')
-    if not os.path.exists(predict_path) or args.forceupdate:
+    cache = StageCache(os.path.join(PROCESSED_DIR, MANIFEST_NAME))
+    fingerprint = cache.fingerprint(
+        files=[os.path.join(PROCESSED_DIR, 'roads.pk'), crash_data_path,
+               os.path.join(PROCESSED_DIR, SEGMENT_KEYS_NAME)],
+        config={'date': date_time.strftime('%Y-%m-%d')},
+        code=[__file__])
+    if args.forceupdate or not cache.is_fresh('predict_data', fingerprint, [predict_path]):
         predict_data = get_accident_count_recent(predict_data, data)
         predict_data.to_csv(predict_path, index=False, compression='gzip')
+        cache.record('predict_data', fingerprint, [predict_path])
     else:
         predict_data = pd.read_csv(predict_path)
 
@@ -183,4 +201,6 @@ if __name__ == '__main__':
         trained_model = pickle.load(fp)
 
     # Get predictions from model and prediction features
-    predict(trained_model=trained_model, predict_data=predict_data, features=features, data_model_features=data_model_features, DATA_DIR=DATA_DIR)
+    predict(trained_model=trained_model, predict_data=predict_data, features=features, data_model_features=data_model_features, DATA_DIR=DATA_DIR, segment_keys=keys)
+
+    run_report.REPORT.write(PROCESSED_DIR)
@@ -3,15 +3,20 @@ import pandas as pd
 import scipy.stats as ss
 import os
 import json
+import pickle
 import argparse
 import yaml
 import sys
 
 CURR_FP = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(CURR_FP)
+sys.path.append(os.path.dirname(CURR_FP))
 
 from model_utils import format_crash_data
 from model_classes import Indata, Tuner, Tester
+from tools.stage_cache import StageCache, MANIFEST_NAME
+from tools import run_report
+from data_standardization.store import read_table, columnar_path
 import sklearn.linear_model as skl
 
 BASE_DIR = os.path.dirname(
@@ -50,6 +55,7 @@ def get_features(config, data, datadir):
     return cont_feat_found, cat_feat_found, features
 
 
+@run_report.profiled()
 def process_features(data, features, config, f_cat, f_cont):
 
     print('Within train_model.process_features')
@@ -180,7 +186,7 @@ def initialize_and_run(data_model, features, linear_model_features, datadir, tar
     test.run_tuned('XG_base', cal=False)
 
     # choose best performing model
-    print('Within train_model. Have instantiated tuner object and completed tuning. Will now iterate over test.rundict to check for best performing model. Test.rundict has len:', len(test.rundict), 'and looks like:', test.rundict)
+    print('Within train_model. Have instantiated tuner object and completed tuning. Will now iterate over test.rundict to check for best performing model. Test.rundict has len:', len(test.rundict), 'with models:', list(test.rundict))
     best_perf = 0
     best_model = None
     for m in test.rundict:
@@ -195,7 +201,8 @@ def initialize_and_run(data_model, features, linear_model_features, datadir, tar
 
     # Train on full data
     print('Best performance was', best_perf, '\n Best model was', best_model, '\nBest model features were', best_model_features)
-    trained_model = best_model.fit(data_model[best_model_features], data_model[target])
+    with run_report.step('fit_best_model', rows_in=len(data_model)):
+        trained_model = best_model.fit(data_model[best_model_features], data_model[target])
 
     # Output feature importance
     output_importance(trained_model, features, datadir)
@@ -205,34 +212,36 @@ def initialize_and_run(data_model, features, linear_model_features, datadir, tar
         pickle.dump(trained_model, fp)
 
 
-if __name__ == '__main__':
-
-    print('Within train_model.py')
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-c', '--config', type=str, help="yml file for model config, default is a base config with open street map data and crashes only")
-    parser.add_argument('-d', '--datadir', type=str, help="data directory")
-    parser.add_argument('-f', '--forceupdate', type=str, help="force update our data model or not", default=False)
-    args = parser.parse_args()
-
-    config = {}
-    if args.config:
-        config_file = args.config
-        with open(config_file) as f:
-            config = yaml.safe_load(f)
-
-    # Print out various inputs for sanity
-    print('Parsed -config as', args.config, '\n', '-datadir as', args.datadir)
-    print('Reading in seg_data from config[seg_data] at: \n\n', config['seg_data'])
-    print('Config file looks like \n \n', config, '\n\n')
+def train(config, data=None, forceupdate=False):
+    """
+    Build the modelling dataset from the merged data and train the model
+    Args:
+        config - city config dict
+        data - optional merged data DataFrame; read from
+            config['merged_data'] if not given
+        forceupdate - whether to rewrite the data model and feature list
+    """
 
     # Create required data paths
-    DATA_DIR = os.path.join(BASE_DIR, 'data', config['name'])
     PROCESSED_DATA_DIR = os.path.join(BASE_DIR, 'data', config['name'], 'processed/')
-    merged_data_path = os.path.join(PROCESSED_DATA_DIR, config['merged_data'])
     print(('Outputting to: %s' % PROCESSED_DATA_DIR))
 
+    # Fingerprint everything the data model depends on, so it's only
+    # rewritten when the merged data, feature lists or this code change
+    cache = StageCache(os.path.join(PROCESSED_DATA_DIR, MANIFEST_NAME))
+    feature_config = {'cat_feat': config['cat_feat'], 'cont_feat': config['cont_feat']}
+
     # Read in data
-    data = pd.read_csv(merged_data_path)
+    if data is None:
+        merged_data_path = os.path.join(PROCESSED_DATA_DIR, config['merged_data'])
+        if os.path.exists(columnar_path(merged_data_path)):
+            merged_data_path = columnar_path(merged_data_path)
+        fingerprint = cache.fingerprint(
+            files=[merged_data_path], config=feature_config, code=[__file__])
+        data = read_table(merged_data_path)
+    else:
+        fingerprint = cache.fingerprint(
+            frames=[data], config=feature_config, code=[__file__])
     data.sort_values(['DATE_TIME'], inplace=True)
 
     # Get all features that exist within dataset and are being used
@@ -249,19 +258,47 @@ if __name__ == '__main__':
 
     # Print out various statistics to understand model parameters
     print("full features:{}".format(features))
-    print('\n\n Data_model: \n\n', data_model)
+    print('\n\n Data_model shape:', data_model.shape)
     print('\n\n features:', features)
     print('\n\n lm_features:', linear_model_features)
     print('\n\n Process_DATA_DIR:', PROCESSED_DATA_DIR)
 
     # Save out data_model and the features within
     data_model_path = os.path.join(PROCESSED_DATA_DIR, 'myDataModel.csv')
-    if not os.path.exists(data_model_path) or args.forceupdate:
+    features_path = os.path.join(PROCESSED_DATA_DIR, 'features.pk')
+    outputs = [data_model_path, features_path]
+    if forceupdate or not cache.is_fresh('data_model', fingerprint, outputs):
         data_model.to_csv(data_model_path, index=False)
-
-    features_path = data_model_path = os.path.join(PROCESSED_DATA_DIR, 'features.pk')
-    if not os.path.exists(features_path) or args.forceupdate:
         with open(features_path, 'wb') as fp:
             pickle.dump(features, fp)
+        cache.record('data_model', fingerprint, outputs)
+    else:
+        print('Data model unchanged, not rewriting', data_model_path)
 
     initialize_and_run(data_model, features, linear_model_features, PROCESSED_DATA_DIR, target='TARGET')
+
+
+if __name__ == '__main__':
+
+    print('Within train_model.py')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, help="yml file for model config, default is a base config with open street map data and crashes only")
+    parser.add_argument('-d', '--datadir', type=str, help="data directory")
+    parser.add_argument('-f', '--forceupdate', type=str, help="force update our data model or not", default=False)
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        config_file = args.config
+        with open(config_file) as f:
+            config = yaml.safe_load(f)
+
+    # Print out various inputs for sanity
+    print('Parsed -config as', args.config, '\n', '-datadir as', args.datadir)
+    print('Reading in seg_data from config[seg_data] at: \n\n', config['seg_data'])
+    print('Config file looks like \n \n', config, '\n\n')
+
+    try:
+        train(config, forceupdate=args.forceupdate)
+    finally:
+        run_report.REPORT.write(os.path.join(BASE_DIR, 'data', config['name'], 'processed'))
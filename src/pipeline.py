@@ -2,13 +2,49 @@ import argparse
 import yaml
 import os
 import subprocess
+import sys
+from tools.stage_graph import StageGraph
+from tools.stage_cache import StageCache, MANIFEST_NAME
+from tools import run_report
 
 BASE_DIR = os.path.dirname(
     os.path.dirname(
         os.path.abspath(__file__)))
 
+# Stages making up each of the steps that can be given to --onlysteps
+STEPS = {
+    'standardization': ['standardization', 'write_crash_csv', 'write_crash_json',
+                        'write_crash_parquet', 'write_crash_hashes'],
+    'generation': ['generation'],
+    'model': ['model'],
+    'visualization': ['visualization'],
+}
 
-def data_standardization(config_file, DATA_FP, verbose, forceupdate=False):
+
+def crash_paths(DATA_FP, spec=None):
+    """
+    Raw inputs and standardized outputs of crash standardization
+    Args:
+        DATA_FP - data directory for this city
+        spec - crash standardization spec, see column_mapping; its
+            sources are the raw files
+    Returns:
+        raw file list, csv output list, json output list, parquet output list
+    """
+    from data_standardization import column_mapping
+
+    RAW_CRASH_DIR = os.path.join(DATA_FP, 'raw', 'crash')
+    PROCESSED_CRASH_DIR = os.path.join(DATA_FP, 'processed', 'crash')
+    sources = column_mapping.load_spec(spec)['sources'].values()
+    raw_files = [os.path.join(RAW_CRASH_DIR, source['file']) for source in sources]
+    csv_outputs = [os.path.join(PROCESSED_CRASH_DIR, 'crashes.csv')]
+    json_outputs = [os.path.join(PROCESSED_CRASH_DIR, 'crashes.json')]
+    parquet_outputs = [os.path.join(PROCESSED_CRASH_DIR, 'crashes.parquet')]
+    return raw_files, csv_outputs, json_outputs, parquet_outputs
+
+
+def data_standardization(config_file, DATA_FP, verbose, cache, forceupdate=False,
+                         max_memory_mb=None, spec=None, incremental=False):
     """
     Standardize data from a csv file into compatible crashes and concerns
     according to a config file
@@ -16,29 +52,150 @@ def data_standardization(config_file, DATA_FP, verbose, forceupdate=False):
         config_file
         DATA_FP - data directory for this city
         verbose - if we have verbose diagnostics
-        forceupdate - whether to restandardize even if files already exist
+        cache - StageCache for this data directory
+        forceupdate - whether to restandardize even if nothing has changed
+        max_memory_mb - if given, stream the raw crash file to stay under
+            roughly this much memory
+        spec - crash standardization spec, see column_mapping
+        incremental - only standardize accidents that are new or changed
+            since the last run, and upsert them into the existing output
+    Returns:
+        dict with the standardized crashes DataFrame, the mappings, the
+        fingerprint of the inputs and (when incremental) the key hashes
+        and the parquet partitions that changed, or an empty dict if
+        standardization was skipped
     """
+    from data_standardization import standardize_crashes, column_mapping
 
-    if not os.path.exists(os.path.join(DATA_FP, 'standardized', 'crashes.json')) or forceupdate:
-        subprocess.check_call([
-            'python',
-            '-m',
-            'data_standardization.standardize_crashes',
-            '-c',
-            config_file,
-            '-d',
-            DATA_FP,
-            '-v',
-            verbose
-        ])
-    else:
-        print("Already standardized crash data, skipping")
+    RAW_CRASH_DIR = os.path.join(DATA_FP, 'raw', 'crash')
+    if not os.path.exists(RAW_CRASH_DIR):
+        raise SystemExit(RAW_CRASH_DIR + " not found, exiting")
+
+    spec = column_mapping.load_spec(spec)
+    raw_files, csv_outputs, json_outputs, parquet_outputs = crash_paths(DATA_FP, spec)
+    fingerprint = cache.fingerprint(
+        files=raw_files, config=spec,
+        code=[standardize_crashes.__file__, column_mapping.__file__])
+
+    if not forceupdate \
+       and cache.is_fresh('write_crash_csv', fingerprint, csv_outputs) \
+       and cache.is_fresh('write_crash_json', fingerprint, json_outputs) \
+       and cache.is_fresh('write_crash_parquet', fingerprint, parquet_outputs):
+        print("Crash data already standardized and unchanged, skipping")
+        return {}
+
+    if verbose:
+        print('Reading raw crash data from', RAW_CRASH_DIR)
+    if incremental:
+        crashes_df, mappings, hashes, partitions = \
+            standardize_crashes.read_clean_combine_crash_incremental(
+                RAW_CRASH_DIR, os.path.join(DATA_FP, 'processed', 'crash'),
+                os.path.join(DATA_FP, 'processed', 'mapping'), spec=spec)
+        return {'crashes': crashes_df, 'mappings': mappings,
+                'crash_fingerprint': fingerprint, 'crash_hashes': hashes,
+                'crash_partitions': partitions}
+
+    crashes_df, mappings = standardize_crashes.read_clean_combine_crash(
+        RAW_CRASH_DIR, max_memory_mb=max_memory_mb, spec=spec)
+    return {'crashes': crashes_df, 'mappings': mappings,
+            'crash_fingerprint': fingerprint}
+
+
+def write_crash_csv(DATA_FP, cache, crashes, mappings, crash_fingerprint):
+    """
+    Write standardized crashes and their mappings out as csv
+    Args:
+        DATA_FP - data directory for this city
+        cache - StageCache for this data directory
+        crashes - standardized crashes DataFrame, None if not regenerated
+        mappings - dict of mapping DataFrames
+        crash_fingerprint - fingerprint of the standardization inputs
+    """
+    from data_standardization.standardize_crashes import output_crash_csv
+
+    if crashes is None:
+        return {}
+    output_crash_csv(
+        os.path.join(DATA_FP, 'processed', 'crash'),
+        os.path.join(DATA_FP, 'processed', 'mapping'),
+        crashes, mappings)
+    _, csv_outputs, _, _ = crash_paths(DATA_FP)
+    cache.record('write_crash_csv', crash_fingerprint, csv_outputs)
+    return {'crash_csv': csv_outputs[0]}
+
+
+def write_crash_json(DATA_FP, cache, crashes, crash_fingerprint):
+    """
+    Write standardized crashes out as json
+    Args:
+        DATA_FP - data directory for this city
+        cache - StageCache for this data directory
+        crashes - standardized crashes DataFrame, None if not regenerated
+        crash_fingerprint - fingerprint of the standardization inputs
+    """
+    from data_standardization.standardize_crashes import output_crash_json
+
+    if crashes is None:
+        return {}
+    PROCESSED_CRASH_DIR = os.path.join(DATA_FP, 'processed', 'crash')
+    if not os.path.exists(PROCESSED_CRASH_DIR):
+        os.makedirs(PROCESSED_CRASH_DIR)
+    output_crash_json(PROCESSED_CRASH_DIR, crashes)
+    _, _, json_outputs, _ = crash_paths(DATA_FP)
+    cache.record('write_crash_json', crash_fingerprint, json_outputs)
+    return {'crash_json': json_outputs[0]}
+
+
+def write_crash_parquet(DATA_FP, cache, crashes, mappings, crash_fingerprint,
+                        spec=None, crash_partitions=None):
+    """
+    Write standardized crashes and their mappings out as parquet
+    Args:
+        DATA_FP - data directory for this city
+        cache - StageCache for this data directory
+        crashes - standardized crashes DataFrame, None if not regenerated
+        mappings - dict of mapping DataFrames
+        crash_fingerprint - fingerprint of the standardization inputs
+        spec - crash standardization spec, giving the column types
+        crash_partitions - only rewrite these partitions of crashes.parquet,
+            None to write them all
+    """
+    from data_standardization.standardize_crashes import output_crash_parquet
+
+    if crashes is None:
+        return {}
+    output_crash_parquet(
+        os.path.join(DATA_FP, 'processed', 'crash'),
+        os.path.join(DATA_FP, 'processed', 'mapping'),
+        crashes, mappings, spec=spec, partitions=crash_partitions)
+    _, _, _, parquet_outputs = crash_paths(DATA_FP)
+    cache.record('write_crash_parquet', crash_fingerprint, parquet_outputs)
+    return {'crash_parquet': parquet_outputs[0]}
+
+
+def write_crash_hashes(DATA_FP, crash_hashes):
+    """
+    Save the key hashes from incremental standardization
+    Runs after the other writers, so a failed write is redone next time
+    Args:
+        DATA_FP - data directory for this city
+        crash_hashes - Series of key hashes, None if not incremental
+            or not regenerated
+    """
+    from data_standardization.standardize_crashes import output_crash_hashes
+
+    if crash_hashes is None:
+        return {}
+    output_crash_hashes(os.path.join(DATA_FP, 'processed', 'crash'), crash_hashes)
+    return {}
 
 
 def data_generation(config_file, DATA_FP, startdate=None, enddate=None,
                     forceupdate=False):
     """
     Generate the map and feature data for this city
+    data.make_dataset is not part of this tree, so it is still run
+    as its own process
     Args:
         config_file - path to config file
         DATA_FP - path to data directory, e.g. ../data/boston/
@@ -47,7 +204,7 @@ def data_generation(config_file, DATA_FP, startdate=None, enddate=None,
     """
     print("Generating data and features...")
     subprocess.check_call([
-        'python',
+        sys.executable,
         '-m',
         'data.make_dataset',
         '-c',
@@ -61,34 +218,31 @@ def data_generation(config_file, DATA_FP, startdate=None, enddate=None,
     )
 
 
-def train_model(config_file, DATA_FP):
+def train_model(config, merged_data=None, forceupdate=False):
     """
     Trains the model
     Args:
-        config_file - path to config file
-        DATA_FP - path to data directory, e.g. ../data/boston/
+        config - city config dict
+        merged_data - optional merged DataFrame, read from disk if None
     """
+    from models.train_model import train
+
     print("Training model...")
-    subprocess.check_call([
-        'python',
-        '-m',
-        'models.train_model',
-        '-c',
-        config_file,
-        '-d',
-        DATA_FP
-    ])
+    train(config, data=merged_data, forceupdate=forceupdate)
 
 
-def visualize(DATA_FP):
+def visualize(config_file, DATA_FP):
     """
     Creates the visualization data set for a city
+    data.make_preds_viz is not part of this tree, so it is still run
+    as its own process
     Args:
+        config_file - path to config file
         DATA_FP - path to data directory, e.g. ../data/boston/
     """
     print("Generating visualization data")
     subprocess.check_call([
-        'python',
+        sys.executable,
         '-m',
         'data.make_preds_viz',
         '-c',
@@ -98,51 +252,114 @@ def visualize(DATA_FP):
     ])
 
 
+def make_graph(config_file, config, DATA_FP, verbose=False, forceupdate=False):
+    """
+    Build the stage graph for a full pipeline run
+    Args:
+        config_file - path to config file
+        config - the loaded config dict
+        DATA_FP - path to data directory, e.g. ../data/boston/
+        verbose
+        forceupdate
+    Returns:
+        a StageGraph
+    """
+    cache = StageCache(os.path.join(DATA_FP, 'processed', MANIFEST_NAME))
+
+    graph = StageGraph()
+    graph.add_stage(
+        'standardization',
+        lambda: data_standardization(config_file, DATA_FP, verbose, cache,
+                                     forceupdate=forceupdate,
+                                     max_memory_mb=config.get('max_memory_mb'),
+                                     spec=config.get('crash_standardization'),
+                                     incremental=config.get('incremental_standardization', False)),
+        outputs=['crashes', 'mappings', 'crash_fingerprint', 'crash_hashes',
+                 'crash_partitions'])
+    graph.add_stage(
+        'write_crash_csv',
+        lambda crashes, mappings, crash_fingerprint: write_crash_csv(
+            DATA_FP, cache, crashes, mappings, crash_fingerprint),
+        inputs=['crashes', 'mappings', 'crash_fingerprint'],
+        outputs=['crash_csv'])
+    graph.add_stage(
+        'write_crash_json',
+        lambda crashes, crash_fingerprint: write_crash_json(
+            DATA_FP, cache, crashes, crash_fingerprint),
+        inputs=['crashes', 'crash_fingerprint'],
+        outputs=['crash_json'])
+    graph.add_stage(
+        'write_crash_parquet',
+        lambda crashes, mappings, crash_fingerprint, crash_partitions: write_crash_parquet(
+            DATA_FP, cache, crashes, mappings, crash_fingerprint,
+            spec=config.get('crash_standardization'), crash_partitions=crash_partitions),
+        inputs=['crashes', 'mappings', 'crash_fingerprint', 'crash_partitions'],
+        outputs=['crash_parquet'])
+    graph.add_stage(
+        'write_crash_hashes',
+        lambda crash_hashes, crash_csv, crash_json, crash_parquet: write_crash_hashes(
+            DATA_FP, crash_hashes),
+        inputs=['crash_hashes', 'crash_csv', 'crash_json', 'crash_parquet'])
+    graph.add_stage(
+        'generation',
+        lambda crash_csv, crash_json: data_generation(
+            config_file, DATA_FP,
+            startdate=config['startdate'],
+            enddate=config['enddate'],
+            forceupdate=forceupdate),
+        inputs=['crash_csv', 'crash_json'],
+        outputs=['merged_data'])
+    graph.add_stage(
+        'model',
+        lambda merged_data: train_model(config, merged_data, forceupdate=forceupdate),
+        inputs=['merged_data'],
+        outputs=['model'])
+    graph.add_stage(
+        'visualization',
+        lambda model: visualize(config_file, DATA_FP),
+        inputs=['model'])
+    return graph
+
+
 if __name__ == '__main__':
 
     # Parse in arguments from the command line.
     # --config_file for config file
     # --forceupdate to force update on maps
     # --onlysteps to choose which steps to run
+    # --jobs to run independent stages in parallel
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config_file", required=True, type=str, help="config file location")
     parser.add_argument('--forceupdate', action='store_true', help='Whether to force update the maps')
     parser.add_argument('--onlysteps', help="Give list of steps to run, as comma-separated string.  Has to be among 'standardization', 'generation', 'model', 'visualization'")
     parser.add_argument("-v", "--verbose", required=False, default=False, help="Verbose diagnostics: True or False")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of independent stages to run at the same time")
     args = parser.parse_args()
 
     # If 'onlysteps' is specified, split the steps into list
+    # Each step can be made up of more than one stage
+    only = None
     if args.onlysteps:
-        steps = args.onlysteps.split(',')
+        only = []
+        for step in args.onlysteps.split(','):
+            if step not in STEPS:
+                raise SystemExit("Unknown step {}".format(step))
+            only += STEPS[step]
 
     # Read the config_file and create various variables from it.
     with open(args.config_file) as f:
         config = yaml.safe_load(f)
 
-    startdate = config['startdate']
-    enddate = config['enddate']
-
     DATA_FP = os.path.join(BASE_DIR, 'data', config['name'])
 
-    if not args.onlysteps or 'standardization' in args.onlysteps:
-        print('Running data standardization')
-        if args.verbose:
-            print('Args.config_file:', args.config_file)
-            print('DATA_FP:', DATA_FP)
-            print('forceupdate', args.forceupdate)
-        data_standardization(args.config_file, DATA_FP, verbose=args.verbose, forceupdate=args.forceupdate)
-
-    if not args.onlysteps or 'generation' in args.onlysteps:
-        print('Running data generation')
-        data_generation(args.config_file, DATA_FP,
-                        startdate=startdate,
-                        enddate=enddate,
-                        forceupdate=args.forceupdate)
-
-    if not args.onlysteps or 'model' in args.onlysteps:
-        print('Running train model')
-        train_model(args.config_file, DATA_FP)
-
-    if not args.onlysteps or 'visualization' in args.onlysteps:
-        print('Running visualisation')
-        visualize(DATA_FP)
+    if args.verbose:
+        print('Args.config_file:', args.config_file)
+        print('DATA_FP:', DATA_FP)
+        print('forceupdate', args.forceupdate)
+
+    graph = make_graph(args.config_file, config, DATA_FP,
+                       verbose=args.verbose, forceupdate=args.forceupdate)
+    try:
+        graph.run(jobs=args.jobs, only=only)
+    finally:
+        run_report.REPORT.write(os.path.join(DATA_FP, 'processed'))
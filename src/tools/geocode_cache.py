@@ -0,0 +1,237 @@
+# Shared cache of geocoded addresses, kept in sqlite
+# Addresses are keyed on a normalized form, so the same place written
+# slightly differently is only looked up once. Addresses the geocoder
+# couldn't find are cached too, for a shorter time, and every entry is
+# written as soon as it arrives, so an interrupted run keeps its progress
+# There is one cache per city, in its processed data directory
+# (data/<city>/processed), see cache_path
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Statuses, as in the old geocoded_addresses.csv
+SUCCESS, FAILED, TIMED_OUT = 'S', 'F', 'T'
+
+# Seconds an entry is trusted for
+SUCCESS_TTL = 365 * 24 * 60 * 60
+FAILED_TTL = 30 * 24 * 60 * 60
+
+CACHE_NAME = 'geocoded_addresses.sqlite'
+
+
+def cache_path(processed_dir):
+    """
+    The city's cache, in its processed data directory
+    """
+    return os.path.join(processed_dir, CACHE_NAME)
+
+
+def normalize_address(address):
+    """
+    Cache key for an address: lower case, with punctuation
+    and repeated whitespace removed
+    e.g. '147 TRAIN ST  Boston, MA' -> '147 train st boston ma'
+    """
+    return ' '.join(re.sub(r'[^\w\s]', ' ', address.lower()).split())
+
+
+class RateLimiter():
+    """
+    Spaces out calls from any number of threads to at most rate a second
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def nominatim_geocoder(user_agent='crash-model', timeout=10):
+    """
+    Geocoder backed by OpenStreetMap's Nominatim, through geopy
+    Returns:
+        function taking an address and returning (address, lat, lng),
+        or None if the address wasn't found
+    """
+    # Only needed when something actually has to be geocoded
+    from geopy.geocoders import Nominatim
+    locator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def geocode(address):
+        location = locator.geocode(address)
+        if location is None:
+            return None
+        return location.address, location.latitude, location.longitude
+    return geocode
+
+
+class GeocodeCache():
+    """
+    Looks addresses up in the cache, geocoding the ones that are
+    missing or expired
+    Args:
+        path - sqlite file
+        geocoder - function taking an address and returning
+            (address, lat, lng), or None if it wasn't found; any
+            exception it raises counts as a timeout, which isn't cached.
+            Defaults to nominatim_geocoder
+        rate - most geocoder calls a second
+        workers - geocoder calls in flight at once
+        ttl, failed_ttl - seconds found and not found addresses are kept
+    """
+
+    def __init__(self, path, geocoder=None, rate=1, workers=4,
+                 ttl=SUCCESS_TTL, failed_ttl=FAILED_TTL):
+        self.path = path
+        self._geocoder = geocoder
+        self.limiter = RateLimiter(rate)
+        self.workers = workers
+        self.ttl = ttl
+        self.failed_ttl = failed_ttl
+        self._lock = threading.Lock()
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS geocoded ('
+                'key TEXT PRIMARY KEY, input TEXT, address TEXT, '
+                'latitude REAL, longitude REAL, status TEXT, updated REAL)')
+
+    @property
+    def geocoder(self):
+        if self._geocoder is None:
+            self._geocoder = nominatim_geocoder()
+        return self._geocoder
+
+    def get(self, address):
+        """
+        Cached result for an address
+        Returns:
+            [address, lat, lng, status], or None if it isn't cached
+            or has expired
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT address, latitude, longitude, status, updated '
+                'FROM geocoded WHERE key = ?', (normalize_address(address),)).fetchone()
+        if row is None:
+            return None
+        ttl = self.ttl if row[3] == SUCCESS else self.failed_ttl
+        if row[4] + ttl < time.time():
+            return None
+        return list(row[:4])
+
+    def put(self, address, result, status, updated=None):
+        """
+        Cache a result, committing straight away
+        """
+        geocoded, lat, lng = result if result else (None, None, None)
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO geocoded VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (normalize_address(address), address, geocoded, lat, lng,
+                 status, time.time() if updated is None else updated))
+
+    def geocode(self, address):
+        """
+        Geocode an address, skipping the cache, and cache the result
+        Returns:
+            [address, lat, lng, status]
+        """
+        self.limiter.wait()
+        try:
+            result = self.geocoder(address)
+        except Exception as error:
+            print("Timed out geocoding {}: {}".format(address, error))
+            return [None, None, None, TIMED_OUT]
+        status = SUCCESS if result else FAILED
+        self.put(address, result, status)
+        return list(result) + [status] if result else [None, None, None, status]
+
+    def lookup(self, address):
+        """
+        Cached result for an address, geocoding it if needed
+        Returns:
+            [address, lat, lng, status]
+        """
+        cached = self.get(address)
+        if cached is not None:
+            return cached
+        return self.geocode(address)
+
+    def lookup_many(self, addresses):
+        """
+        Look up several addresses, geocoding the missing ones concurrently
+        Returns:
+            dict of address to [address, lat, lng, status]
+        """
+        results = {}
+        missing = {}
+        for address in addresses:
+            cached = self.get(address)
+            if cached is not None:
+                results[address] = cached
+            else:
+                missing.setdefault(normalize_address(address), address)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            geocoded = dict(zip(missing, executor.map(self.geocode, missing.values())))
+        for address in addresses:
+            if address not in results:
+                results[address] = geocoded[normalize_address(address)]
+        return results
+
+    def import_csv(self, filename):
+        """
+        Load the entries from an old geocoded_addresses.csv,
+        skipping timeouts and addresses that are already cached
+        Returns:
+            number of entries loaded
+        """
+        count = 0
+        updated = os.path.getmtime(filename)
+        with open(filename) as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) != 5 or row[4] not in (SUCCESS, FAILED) \
+                   or self.get(row[0]) is not None:
+                    continue
+                result = (row[1], float(row[2]), float(row[3])) \
+                    if row[4] == SUCCESS else None
+                self.put(row[0], result, row[4], updated=updated)
+                count += 1
+        return count
+
+    def close(self):
+        self.conn.close()
+
+
+def geocode_address(address, path):
+    """
+    Geocode a single address through a city's cache
+    Args:
+        address
+        path - sqlite file, see cache_path
+    Returns:
+        [address, lat, lng, status]
+    """
+    cache = GeocodeCache(path)
+    try:
+        return cache.lookup(address)
+    finally:
+        cache.close()
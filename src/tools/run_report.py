@@ -0,0 +1,203 @@
+# Per-step performance instrumentation
+# Steps record wall time, CPU time, peak memory and rows in/out into a
+# process-wide report, which is written out as run_report.json so runs
+# can be compared against each other
+# CPU time and peak memory are only measured for the whole process, so
+# they're recorded as process_cpu_seconds (the process's CPU time while
+# the step ran, including any other steps running alongside it on other
+# threads) and process_peak_rss_mb (the process's peak so far)
+from contextlib import contextmanager
+from datetime import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory won't be recorded there
+    resource = None
+
+REPORT_NAME = 'run_report.json'
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes on Linux
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def count_rows(obj):
+    """
+    Number of rows in a DataFrame or Series, or in the first DataFrame
+    of a tuple (e.g. a function returning (df, mappings))
+    Returns:
+        int, or None if there isn't a DataFrame to count
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, tuple):
+        for item in obj:
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                return len(item)
+    return None
+
+
+class RunReport():
+    """
+    Collects step records for a run
+    Steps can be nested and can run from several threads at once
+    """
+
+    def __init__(self):
+        self.started = datetime.now()
+        self.steps = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self):
+        """
+        Name of the innermost step running on this thread, if any
+        """
+        stack = self._stack()
+        return stack[-1]['name'] if stack else None
+
+    @contextmanager
+    def step(self, name, rows_in=None, parent=None):
+        """
+        Time the enclosed block
+        Args:
+            name - step name, e.g. 'process_features'
+            rows_in - number of rows going into the step, if known
+            parent - parent step name, for steps run on a worker thread;
+                defaults to the innermost step on this thread
+        Yields:
+            the step's record, which can be updated with rows_out etc.
+        """
+        stack = self._stack()
+        record = {
+            'name': name,
+            'parent': parent or self.current(),
+            'started': datetime.now().isoformat(),
+            'rows_in': rows_in,
+            'rows_out': None,
+        }
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        stack.append(record)
+        status = 'error'
+        try:
+            yield record
+            status = 'ok'
+        finally:
+            stack.pop()
+            record['status'] = status
+            record['wall_seconds'] = round(time.perf_counter() - wall_start, 3)
+            record['process_cpu_seconds'] = round(time.process_time() - cpu_start, 3)
+            record['process_peak_rss_mb'] = peak_rss_mb()
+            with self._lock:
+                self.steps.append(record)
+
+    def add(self, record, parent=None):
+        """
+        Add a step that was timed somewhere else, e.g. in a worker process
+        with its own report, under the innermost step on this thread
+        """
+        record = dict(record, parent=parent or record.get('parent') or self.current())
+        with self._lock:
+            self.steps.append(record)
+        return record
+
+    def annotate(self, **kwargs):
+        """
+        Add values (e.g. rows_in/rows_out) to the innermost step
+        currently running on this thread
+        """
+        stack = self._stack()
+        if stack:
+            stack[-1].update(kwargs)
+
+    def to_dict(self):
+        with self._lock:
+            steps = list(self.steps)
+        return {
+            'started': self.started.isoformat(),
+            'finished': datetime.now().isoformat(),
+            'argv': sys.argv,
+            'process_peak_rss_mb': peak_rss_mb(),
+            'steps': steps,
+        }
+
+    def write(self, directory):
+        """
+        Write the report to run_report.json in the given directory
+        Returns:
+            path of the report
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, REPORT_NAME)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print("Run report written to {}".format(path))
+        return path
+
+
+# Report shared by everything running in this process
+REPORT = RunReport()
+
+
+def step(name, rows_in=None, parent=None):
+    """
+    Time a block of code in the shared report
+    """
+    return REPORT.step(name, rows_in=rows_in, parent=parent)
+
+
+def annotate(**kwargs):
+    """
+    Add values to the current step in the shared report
+    """
+    REPORT.annotate(**kwargs)
+
+
+def profiled(name=None):
+    """
+    Decorator timing every call of a function in the shared report
+    rows_in is taken from the first DataFrame argument,
+    and rows_out from the return value
+    """
+    def decorator(func):
+        step_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = None
+            for arg in list(args) + list(kwargs.values()):
+                if isinstance(arg, pd.DataFrame):
+                    rows_in = len(arg)
+                    break
+            with REPORT.step(step_name, rows_in=rows_in) as record:
+                result = func(*args, **kwargs)
+                rows_out = count_rows(result)
+                if rows_out is not None:
+                    record['rows_out'] = rows_out
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,86 @@
+# Persisted dictionary of segment ids to dense integer keys
+# Segment ids are long strings (e.g. "[577183016, 569423096]-247172086-29897221"),
+# so tables, joins and groupbys within the pipeline use an int32 key for
+# each segment instead, and the strings are looked up again only when
+# writing output. Keys are only ever added, so a segment keeps its key
+# across runs and tables written earlier stay valid
+# There is one dictionary per city, in its processed data directory
+# (data/<city>/processed), shared by every stage that writes keys.
+# make_canon_dataset defaults to data/processed, so give it
+# --datadir data/<city> to share the city's keys with predict_model
+import os
+import numpy as np
+import pandas as pd
+
+SEGMENT_KEYS_NAME = 'segment_keys.parquet'
+# Key for missing or unknown segments
+NO_SEGMENT = -1
+
+
+class SegmentKeys():
+    """
+    Segment id to key mapping, where a segment's key is its position
+    Args:
+        path - parquet file the ids are kept in, read if it exists
+    """
+
+    def __init__(self, path):
+        self.path = path
+        ids = []
+        if os.path.exists(path):
+            ids = pd.read_parquet(path)['segment_id'].tolist()
+        self.ids = pd.Index(ids, dtype=object)
+        self.changed = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, segment_ids, add=True):
+        """
+        Keys for an array of segment ids
+        Args:
+            segment_ids - ids, converted to strings; missing and empty
+                ids get NO_SEGMENT
+            add - give ids that aren't in the dictionary new keys,
+                otherwise they get NO_SEGMENT
+        Returns:
+            int32 array of keys
+        """
+        values = pd.Series(segment_ids, dtype=object)
+        present = values.notna().values
+        values = values.astype(str).values
+        present &= values != ''
+
+        keys = np.full(len(values), NO_SEGMENT, dtype='int32')
+        keys[present] = self.ids.get_indexer(values[present])
+        if add:
+            new = pd.unique(values[present & (keys == NO_SEGMENT)])
+            if len(new):
+                self.ids = self.ids.append(pd.Index(new, dtype=object))
+                self.changed = True
+                keys[present] = self.ids.get_indexer(values[present])
+        return keys
+
+    def decode(self, keys):
+        """
+        Segment ids for an array of keys, None for NO_SEGMENT
+        """
+        keys = np.asarray(keys)
+        segment_ids = np.full(len(keys), None, dtype=object)
+        known = keys != NO_SEGMENT
+        segment_ids[known] = self.ids.values[keys[known]]
+        return segment_ids
+
+    def save(self):
+        """
+        Write the ids out if keys have been added
+        """
+        if not self.changed:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + '.tmp'
+        pd.DataFrame({'segment_id': self.ids.values}).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+        self.changed = False
@@ -0,0 +1,150 @@
+# Hourly archives of Waze feed snapshots
+# Each snapshot is appended to its hour's archive as its own gzip member,
+# and its name, byte offset and length are appended to the archive's
+# index, so a single snapshot can be read back without decompressing
+# the rest of the hour. Appending several gzip members to one file is
+# still a valid gzip file.
+# Writers hold an exclusive lock on the archive's lock file while they
+# recover, append and index, so a collector run from cron can overlap
+# with another one safely
+import datetime
+import fcntl
+import gzip
+import os
+
+# Snapshots are named by the minute they were fetched, in utc
+SNAPSHOT_NAME_FORMAT = '%Y-%m-%d-%H-%M'
+HOUR_FORMAT = '%Y-%m-%d-%H'
+ARCHIVE_SUFFIX = '.snapshots.gz'
+INDEX_SUFFIX = '.snapshots.idx'
+LOCK_SUFFIX = '.snapshots.lock'
+
+
+def archive_name(fetched):
+    """
+    Archive file for the hour a snapshot was fetched in
+    Args:
+        fetched - utc datetime
+    """
+    return fetched.strftime(HOUR_FORMAT) + ARCHIVE_SUFFIX
+
+
+def archive_hour(filename):
+    """
+    Start of the hour an archive covers, from its filename
+    Returns:
+        utc datetime, or None if the file isn't an archive
+    """
+    if not filename.endswith(ARCHIVE_SUFFIX):
+        return None
+    try:
+        hour = datetime.datetime.strptime(
+            filename[:-len(ARCHIVE_SUFFIX)], HOUR_FORMAT)
+    except ValueError:
+        return None
+    return hour.replace(tzinfo=datetime.timezone.utc)
+
+
+def index_path(archive_path):
+    return archive_path[:-len(ARCHIVE_SUFFIX)] + INDEX_SUFFIX
+
+
+def lock_path(archive_path):
+    return archive_path[:-len(ARCHIVE_SUFFIX)] + LOCK_SUFFIX
+
+
+def read_index(archive_path):
+    """
+    Snapshots in an archive, in the order they were appended
+    A partly written last line, from a collector that was killed
+    mid-write, is ignored
+    Args:
+        archive_path
+    Returns:
+        list of (snapshot name, offset, length)
+    """
+    entries = []
+    path = index_path(archive_path)
+    if not os.path.exists(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if not line.endswith('\n') or len(parts) != 3:
+                continue
+            entries.append((parts[0], int(parts[1]), int(parts[2])))
+    return entries
+
+
+def read_archived(archive_path, offset, length):
+    """
+    Read a single snapshot back out of an archive
+    Returns:
+        the snapshot's uncompressed bytes
+    """
+    with open(archive_path, 'rb') as f:
+        f.seek(offset)
+        return gzip.decompress(f.read(length))
+
+
+def recover(archive_path):
+    """
+    Trim anything past the last indexed snapshot, left behind if the
+    collector stopped between writing a snapshot and indexing it,
+    so the next snapshot is appended at an indexed offset
+    Only call it holding the archive's lock, as ArchiveWriter does,
+    or it can cut off another writer's snapshot before it's indexed
+    """
+    path = index_path(archive_path)
+    if os.path.exists(path):
+        with open(path, 'rb+') as f:
+            text = f.read()
+            if text and not text.endswith(b'\n'):
+                f.truncate(text.rfind(b'\n') + 1)
+    if os.path.exists(archive_path):
+        end = max([offset + length for _, offset, length in read_index(archive_path)],
+                  default=0)
+        if os.path.getsize(archive_path) > end:
+            with open(archive_path, 'rb+') as f:
+                f.truncate(end)
+
+
+class ArchiveWriter():
+    """
+    Appends snapshots to hourly archives in a directory
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+    def append(self, fetched, data):
+        """
+        Compress and append a snapshot, then index it
+        Args:
+            fetched - utc datetime the snapshot was fetched
+            data - the snapshot's bytes
+        Returns:
+            path of the archive, snapshot name, offset, length
+        """
+        path = os.path.join(self.dirname, archive_name(fetched))
+        name = fetched.strftime(SNAPSHOT_NAME_FORMAT)
+        member = gzip.compress(data)
+        with open(lock_path(path), 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                # Under the lock, anything unindexed was left by a writer
+                # that stopped part way
+                recover(path)
+                with open(path, 'ab') as f:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(member)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                with open(index_path(path), 'a') as f:
+                    f.write('{}\t{}\t{}\n'.format(name, offset, len(member)))
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        return path, name, offset, len(member)
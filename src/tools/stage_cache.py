@@ -0,0 +1,131 @@
+# Fingerprint-based caching for pipeline stages
+# A manifest records, for each stage, a hash of everything the stage's
+# output depends on (input files, the relevant config entries and the code
+# that produces it). A stage only needs to re-run when that hash changes
+import hashlib
+import json
+import os
+import threading
+import pandas as pd
+
+MANIFEST_NAME = 'cache_manifest.json'
+
+
+def hash_file(path, blocksize=1 << 20):
+    """
+    sha256 of a file's contents, read in blocks
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def hash_frame(df):
+    """
+    sha256 of a DataFrame's values, index and column names
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps([str(c) for c in df.columns]).encode('utf-8'))
+    sha.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return sha.hexdigest()
+
+
+class StageCache():
+    """
+    Reads and writes the cache manifest for a data directory
+    Files are hashed by content, but the hash is only recomputed
+    when a file's size or modification time changes
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+        self.manifest = {'stages': {}, 'files': {}}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def file_hash(self, path):
+        """
+        Content hash of a file, reusing the hash recorded in the manifest
+        if the file's size and mtime are unchanged
+        Returns:
+            hash string, or None if the file doesn't exist
+        """
+        if not os.path.exists(path):
+            return None
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            known = self.manifest['files'].get(path)
+        if known and known['size'] == stat.st_size \
+           and known['mtime'] == stat.st_mtime:
+            return known['sha256']
+
+        sha = hash_file(path)
+        with self._lock:
+            self.manifest['files'][path] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'sha256': sha
+            }
+        return sha
+
+    def fingerprint(self, files=None, config=None, code=None, frames=None):
+        """
+        Combine everything a stage depends on into one hash
+        Args:
+            files - list of input file paths
+            config - the config entries the stage uses (any json-able value)
+            code - list of source files whose changes should invalidate
+                the stage, e.g. [__file__]
+            frames - list of in-memory DataFrame inputs
+        Returns:
+            hash string
+        """
+        parts = {
+            'files': [(os.path.basename(f), self.file_hash(f)) for f in files or []],
+            'config': config,
+            'code': [self.file_hash(f) for f in code or []],
+            'frames': [hash_frame(df) for df in frames or []],
+        }
+        as_str = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(as_str.encode('utf-8')).hexdigest()
+
+    def is_fresh(self, stage, fingerprint, outputs=None):
+        """
+        Whether a stage was last run with this fingerprint,
+        and all its output files still exist
+        """
+        with self._lock:
+            entry = self.manifest['stages'].get(stage)
+        if not entry or entry['fingerprint'] != fingerprint:
+            return False
+        return all(os.path.exists(f) for f in outputs or [])
+
+    def record(self, stage, fingerprint, outputs=None):
+        """
+        Record a successful run of a stage, and save the manifest
+        """
+        with self._lock:
+            self.manifest['stages'][stage] = {
+                'fingerprint': fingerprint,
+                'outputs': [os.path.abspath(f) for f in outputs or []]
+            }
+        self.save()
+
+    def save(self):
+        """
+        Write the manifest, replacing the old one in a single step
+        so an interrupted run can't leave it half written
+        """
+        directory = os.path.dirname(self.manifest_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = self.manifest_path + '.tmp'
+        with self._lock:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,171 @@
+# In-process stage graph for running the pipeline
+# Stages declare the named artifacts they consume and produce, so results
+# (usually DataFrames) can be handed from one stage to the next in memory
+# and independent stages can run at the same time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+from .run_report import REPORT
+
+
+class Stage():
+    """
+    A single step of the pipeline
+    Args:
+        name - unique stage name, e.g. 'standardization'
+        func - callable taking the stage's inputs as keyword arguments,
+            and returning a dict of outputs (or None if it has none)
+        inputs - list of artifact names this stage needs
+        outputs - list of artifact names this stage produces
+    """
+
+    def __init__(self, name, func, inputs=None, outputs=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs) if inputs else []
+        self.outputs = list(outputs) if outputs else []
+
+    def __repr__(self):
+        return 'Stage({})'.format(self.name)
+
+
+class StageGraph():
+    """
+    Holds a set of stages and runs them in dependency order
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.artifacts = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, func, inputs=None, outputs=None):
+        """
+        Create a stage and add it to the graph
+        Returns:
+            the new Stage object
+        """
+        if name in [s.name for s in self.stages]:
+            raise ValueError('Stage {} already exists'.format(name))
+        stage = Stage(name, func, inputs=inputs, outputs=outputs)
+        self.stages.append(stage)
+        return stage
+
+    def producers(self):
+        """
+        Map each artifact name to the stage that produces it
+        """
+        producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError('Artifact {} is produced by both {} and {}'.format(
+                        output, producers[output].name, stage.name))
+                producers[output] = stage
+        return producers
+
+    def dependencies(self):
+        """
+        Map each stage name to the set of stage names it depends on
+        """
+        producers = self.producers()
+        deps = {}
+        for stage in self.stages:
+            deps[stage.name] = set()
+            for name in stage.inputs:
+                if name not in producers:
+                    raise ValueError('Stage {} needs {}, but no stage produces it'.format(
+                        stage.name, name))
+                deps[stage.name].add(producers[name].name)
+        return deps
+
+    def order(self):
+        """
+        Topologically sort the stages, preserving insertion order
+        between stages that don't depend on each other
+        Returns:
+            a list of Stage objects
+        """
+        deps = self.dependencies()
+        done = set()
+        ordered = []
+        while len(ordered) < len(self.stages):
+            ready = [s for s in self.stages
+                     if s.name not in done and deps[s.name] <= done]
+            if not ready:
+                remaining = [s.name for s in self.stages if s.name not in done]
+                raise ValueError('Cycle found between stages: {}'.format(
+                    ', '.join(remaining)))
+            for stage in ready:
+                done.add(stage.name)
+                ordered.append(stage)
+        return ordered
+
+    def _run_stage(self, stage, skip):
+        """
+        Run a single stage with its inputs taken from the artifacts
+        produced so far. Skipped stages produce None for each output
+        """
+        with self._lock:
+            kwargs = {name: self.artifacts.get(name) for name in stage.inputs}
+
+        if skip:
+            print("Skipping stage {}".format(stage.name))
+            results = {}
+        else:
+            with REPORT.step(stage.name):
+                results = stage.func(**kwargs) or {}
+
+        unexpected = set(results) - set(stage.outputs)
+        if unexpected:
+            raise ValueError('Stage {} returned undeclared outputs: {}'.format(
+                stage.name, ', '.join(sorted(unexpected))))
+
+        with self._lock:
+            for name in stage.outputs:
+                self.artifacts[name] = results.get(name)
+
+    def run(self, jobs=1, only=None):
+        """
+        Run every stage once its inputs are available
+        Args:
+            jobs - maximum number of stages to run at the same time
+            only - optional list of stage names to run; the other stages
+                are skipped, and their outputs are passed on as None
+        Returns:
+            dict of artifact name to value
+        """
+        if only is not None:
+            unknown = set(only) - set(s.name for s in self.stages)
+            if unknown:
+                raise ValueError('Unknown stages: {}'.format(', '.join(sorted(unknown))))
+
+        deps = self.dependencies()
+        stages = self.order()
+        done = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            while len(done) < len(stages):
+                for stage in stages:
+                    if stage.name in done or stage in running.values():
+                        continue
+                    if len(running) >= max(1, jobs):
+                        break
+                    if deps[stage.name] <= done:
+                        skip = only is not None and stage.name not in only
+                        future = executor.submit(self._run_stage, stage, skip)
+                        running[future] = stage
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        # Let the stages already in flight finish,
+                        # but don't start anything new
+                        for pending in running:
+                            pending.cancel()
+                        raise error
+                    done.add(stage.name)
+
+        return self.artifacts
@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from .. import geocode_cache
+
+
+class FakeGeocoder():
+    """
+    Stands in for a geocoding service, counting calls per address
+    """
+
+    def __init__(self, places):
+        self.places = places
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, address):
+        with self._lock:
+            self.calls.append(address)
+        if address == 'slow':
+            raise TimeoutError('timed out')
+        return self.places.get(geocode_cache.normalize_address(address))
+
+
+def test_lookup_many(tmpdir):
+    path = os.path.join(str(tmpdir), 'geocoded.sqlite')
+    geocoder = FakeGeocoder({'147 train st boston ma': ('147 Train St', 42.3, -71.0)})
+    cache = geocode_cache.GeocodeCache(path, geocoder=geocoder, rate=0, workers=3)
+
+    results = cache.lookup_many(['147 TRAIN ST Boston, MA', '147 Train St  Boston MA',
+                                 'nowhere', 'slow'])
+    assert results['147 TRAIN ST Boston, MA'] == ['147 Train St', 42.3, -71.0, 'S']
+    assert results['147 Train St  Boston MA'] == results['147 TRAIN ST Boston, MA']
+    assert results['nowhere'] == [None, None, None, 'F']
+    assert results['slow'] == [None, None, None, 'T']
+    assert sorted(geocoder.calls) == ['147 TRAIN ST Boston, MA', 'nowhere', 'slow']
+    cache.close()
+
+    # Found and not found addresses were written as they arrived;
+    # the timeout is tried again
+    cache = geocode_cache.GeocodeCache(path, geocoder=geocoder, rate=0)
+    assert cache.lookup('147 train st, boston, ma')[3] == 'S'
+    assert cache.lookup('nowhere')[3] == 'F'
+    cache.lookup('slow')
+    assert geocoder.calls.count('slow') == 2
+    assert len(geocoder.calls) == 4
+
+    # Expired entries are geocoded again
+    cache.failed_ttl = -1
+    cache.lookup('nowhere')
+    assert geocoder.calls.count('nowhere') == 2
+
+
+def test_rate_limiter():
+    limiter = geocode_cache.RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    assert time.monotonic() - start >= 4 / 50.
+
+
+def test_import_csv(tmpdir):
+    old = tmpdir.join('geocoded_addresses.csv')
+    old.write('Input Address,Output Address,Latitude,Longitude,Status\n'
+              '1 Main St,1 Main Street,42.1,-71.1,S\n'
+              'Nowhere,,,,F\n'
+              'Slow,,,,T\n')
+    geocoder = FakeGeocoder({})
+    cache = geocode_cache.GeocodeCache(
+        os.path.join(str(tmpdir), 'geocoded.sqlite'), geocoder=geocoder, rate=0)
+    assert cache.import_csv(str(old)) == 2
+    assert cache.lookup('1 main st') == ['1 Main Street', 42.1, -71.1, 'S']
+    assert cache.lookup('nowhere')[3] == 'F'
+    assert geocoder.calls == []
@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import pandas as pd
+from .. import run_report
+
+
+def test_step_records(tmpdir):
+    report = run_report.RunReport()
+    with report.step('outer', rows_in=10) as record:
+        with report.step('inner'):
+            report.annotate(rows_out=5)
+        record['rows_out'] = 8
+
+    inner, outer = report.steps
+    assert inner['name'] == 'inner'
+    assert inner['parent'] == 'outer'
+    assert inner['rows_out'] == 5
+    assert outer['rows_in'] == 10
+    assert outer['rows_out'] == 8
+    assert outer['status'] == 'ok'
+    assert outer['wall_seconds'] >= inner['wall_seconds']
+
+    path = report.write(str(tmpdir))
+    with open(path) as f:
+        written = json.load(f)
+    assert [s['name'] for s in written['steps']] == ['inner', 'outer']
+
+
+def test_profiled():
+
+    @run_report.profiled('double')
+    def double(df):
+        return pd.concat([df, df]), 'other'
+
+    before = len(run_report.REPORT.steps)
+    double(pd.DataFrame({'a': [1, 2, 3]}))
+    record = run_report.REPORT.steps[before]
+    assert record['name'] == 'double'
+    assert record['rows_in'] == 3
+    assert record['rows_out'] == 6
+
+
+def test_step_parent_from_other_thread():
+    report = run_report.RunReport()
+
+    with report.step('outer'):
+        parent = report.current()
+
+        def work():
+            with report.step('worker', parent=parent):
+                pass
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(work).result()
+
+    assert report.steps[0]['name'] == 'worker'
+    assert report.steps[0]['parent'] == 'outer'
+    assert report.current() is None
+
+
+def test_add():
+    report = run_report.RunReport()
+    worker = run_report.RunReport()
+    with worker.step('in_worker', rows_in=3):
+        pass
+    with report.step('outer'):
+        record = report.add(worker.steps[0])
+    assert record['parent'] == 'outer'
+    assert record['rows_in'] == 3
+    assert [s['name'] for s in report.steps] == ['in_worker', 'outer']
@@ -0,0 +1,21 @@
+import os
+import numpy as np
+from ..segment_keys import SegmentKeys, NO_SEGMENT
+
+
+def test_encode_and_decode(tmpdir):
+    path = os.path.join(str(tmpdir), 'segment_keys.parquet')
+    keys = SegmentKeys(path)
+    encoded = keys.encode(['[1, 2]-3-4', '005', None, '', '[1, 2]-3-4', 6])
+    assert encoded.dtype == np.int32
+    assert encoded.tolist() == [0, 1, NO_SEGMENT, NO_SEGMENT, 0, 2]
+    assert keys.decode(encoded).tolist() == [
+        '[1, 2]-3-4', '005', None, None, '[1, 2]-3-4', '6']
+    keys.save()
+
+    # Keys stay the same across runs, new ids are added after them
+    keys = SegmentKeys(path)
+    assert keys.encode(['007', '005'], add=False).tolist() == [NO_SEGMENT, 1]
+    assert keys.encode(['007', '005']).tolist() == [3, 1]
+    keys.save()
+    assert len(SegmentKeys(path)) == 4
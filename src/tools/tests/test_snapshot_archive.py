@@ -0,0 +1,61 @@
+import datetime
+import gzip
+import os
+import threading
+from .. import snapshot_archive
+
+
+def test_append_and_read(tmpdir):
+    writer = snapshot_archive.ArchiveWriter(str(tmpdir.join('waze')))
+    fetched = datetime.datetime(2018, 10, 15, 20, 13, tzinfo=datetime.timezone.utc)
+    path, name, _, _ = writer.append(fetched, b'{"a": 1}')
+    writer.append(fetched.replace(minute=14), b'{"b": 2}')
+    assert os.path.basename(path) == '2018-10-15-20.snapshots.gz'
+    assert name == '2018-10-15-20-13'
+    assert snapshot_archive.archive_hour(os.path.basename(path)) == fetched.replace(minute=0)
+    assert snapshot_archive.archive_hour('2018-10-15-20-13.json.gz') is None
+
+    entries = snapshot_archive.read_index(path)
+    assert [e[0] for e in entries] == ['2018-10-15-20-13', '2018-10-15-20-14']
+    assert snapshot_archive.read_archived(path, *entries[1][1:]) == b'{"b": 2}'
+    # Still a single valid gzip file
+    with gzip.open(path) as f:
+        assert f.read() == b'{"a": 1}{"b": 2}'
+
+
+def test_recover(tmpdir):
+    dirname = str(tmpdir)
+    fetched = datetime.datetime(2018, 10, 15, 20, 13, tzinfo=datetime.timezone.utc)
+    path, _, _, _ = snapshot_archive.ArchiveWriter(dirname).append(fetched, b'kept')
+    # Killed after writing a snapshot, and part way through indexing it
+    with open(path, 'ab') as f:
+        f.write(gzip.compress(b'lost'))
+    with open(snapshot_archive.index_path(path), 'a') as f:
+        f.write('2018-10-15-20-14\t3')
+
+    snapshot_archive.ArchiveWriter(dirname).append(fetched.replace(minute=15), b'new')
+    entries = snapshot_archive.read_index(path)
+    assert [e[0] for e in entries] == ['2018-10-15-20-13', '2018-10-15-20-15']
+    assert [snapshot_archive.read_archived(path, *e[1:]) for e in entries] == [
+        b'kept', b'new']
+
+
+def test_concurrent_writers(tmpdir):
+    dirname = str(tmpdir)
+    fetched = datetime.datetime(2018, 10, 15, 20, 0, tzinfo=datetime.timezone.utc)
+
+    def collect(minute):
+        # Separate writers, as from overlapping cron runs
+        for i in range(20):
+            snapshot_archive.ArchiveWriter(dirname).append(
+                fetched.replace(minute=minute), '{}-{}'.format(minute, i).encode())
+    threads = [threading.Thread(target=collect, args=(minute,)) for minute in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    path = os.path.join(dirname, snapshot_archive.archive_name(fetched))
+    entries = snapshot_archive.read_index(path)
+    assert sorted(snapshot_archive.read_archived(path, *e[1:]) for e in entries) == sorted(
+        '{}-{}'.format(minute, i).encode() for minute in range(4) for i in range(20))
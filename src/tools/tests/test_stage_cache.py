@@ -0,0 +1,43 @@
+import os
+import pandas as pd
+from ..stage_cache import StageCache
+
+
+def test_fingerprint_and_freshness(tmpdir):
+    raw = tmpdir.join('raw.csv')
+    raw.write('a,b\n1,2\n')
+    output = tmpdir.join('out.csv')
+    output.write('done')
+
+    manifest = os.path.join(str(tmpdir), 'manifest.json')
+    cache = StageCache(manifest)
+    config = {'cat_feat': ['HOUR'], 'cont_feat': ['width']}
+    fingerprint = cache.fingerprint(files=[str(raw)], config=config)
+
+    assert not cache.is_fresh('stage', fingerprint, [str(output)])
+    cache.record('stage', fingerprint, [str(output)])
+
+    # A new cache object reads the saved manifest
+    cache = StageCache(manifest)
+    assert cache.is_fresh('stage', fingerprint, [str(output)])
+    assert cache.fingerprint(files=[str(raw)], config=config) == fingerprint
+
+    # Changing the config or an input changes the fingerprint
+    assert cache.fingerprint(
+        files=[str(raw)], config={'cat_feat': [], 'cont_feat': ['width']}) != fingerprint
+    raw.write('a,b\n1,3\n')
+    os.utime(str(raw), (0, 0))
+    assert cache.fingerprint(files=[str(raw)], config=config) != fingerprint
+
+    # Missing outputs mean the stage has to run again
+    output.remove()
+    assert not cache.is_fresh('stage', fingerprint, [str(output)])
+
+
+def test_frame_fingerprint(tmpdir):
+    cache = StageCache(os.path.join(str(tmpdir), 'manifest.json'))
+    df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    fingerprint = cache.fingerprint(frames=[df])
+    assert cache.fingerprint(frames=[df.copy()]) == fingerprint
+    df.loc[1, 'a'] = 3
+    assert cache.fingerprint(frames=[df]) != fingerprint
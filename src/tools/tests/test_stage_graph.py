@@ -0,0 +1,61 @@
+import threading
+import pytest
+from ..stage_graph import StageGraph
+
+
+def test_run_passes_outputs_in_memory():
+    graph = StageGraph()
+    graph.add_stage('double', lambda number: {'doubled': number * 2},
+                    inputs=['number'], outputs=['doubled'])
+    graph.add_stage('start', lambda: {'number': 3}, outputs=['number'])
+    graph.add_stage('add', lambda doubled, number: {'total': doubled + number},
+                    inputs=['doubled', 'number'], outputs=['total'])
+
+    assert [s.name for s in graph.order()] == ['start', 'double', 'add']
+    artifacts = graph.run()
+    assert artifacts['total'] == 9
+
+
+def test_run_concurrently():
+    # Both stages wait on each other, so this only finishes
+    # if they are run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def wait_for_other():
+        barrier.wait()
+        return {}
+
+    graph = StageGraph()
+    graph.add_stage('a', wait_for_other)
+    graph.add_stage('b', wait_for_other)
+    graph.run(jobs=2)
+
+
+def test_run_only():
+    graph = StageGraph()
+    graph.add_stage('start', lambda: {'number': 3}, outputs=['number'])
+    graph.add_stage('end', lambda number: {'result': number},
+                    inputs=['number'], outputs=['result'])
+    artifacts = graph.run(only=['end'])
+    assert artifacts['result'] is None
+
+    with pytest.raises(ValueError):
+        graph.run(only=['missing'])
+
+
+def test_bad_graphs():
+    graph = StageGraph()
+    graph.add_stage('a', lambda y: {}, inputs=['y'], outputs=['x'])
+    graph.add_stage('b', lambda x: {}, inputs=['x'], outputs=['y'])
+    with pytest.raises(ValueError):
+        graph.order()
+
+    graph = StageGraph()
+    graph.add_stage('a', lambda missing: {}, inputs=['missing'])
+    with pytest.raises(ValueError):
+        graph.run()
+
+    graph = StageGraph()
+    graph.add_stage('a', lambda: {'x': 1})
+    with pytest.raises(ValueError):
+        graph.run()
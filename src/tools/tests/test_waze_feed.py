@@ -0,0 +1,78 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+import pytest
+from .. import snapshot_archive, waze_feed
+
+
+class FlakyFeed(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the Waze feed, answering with each of its
+    responses in turn and then repeating the last
+    """
+    responses = []
+    requests = 0
+
+    def do_GET(self):
+        cls = type(self)
+        status, body = cls.responses[min(cls.requests, len(cls.responses) - 1)]
+        cls.requests += 1
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def feed():
+    FlakyFeed.responses = [(200, b'{}')]
+    FlakyFeed.requests = 0
+    server = HTTPServer(('127.0.0.1', 0), FlakyFeed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/feed'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_transient_errors(feed, tmpdir):
+    FlakyFeed.responses = [(503, b''), (200, b'{"jams": [], "endTi'),
+                           (200, b'{"jams": []}')]
+    collector = waze_feed.WazeCollector(feed, str(tmpdir), interval=0, backoff=0)
+    waze_feed.run_collector(collector, collector.run(count=2))
+
+    assert collector.failures == 0
+    assert FlakyFeed.requests == 4
+    snapshots = []
+    for archive in tmpdir.listdir(lambda f: f.basename.endswith('.snapshots.gz')):
+        snapshots += [snapshot_archive.read_archived(str(archive), offset, length)
+                      for _, offset, length in snapshot_archive.read_index(str(archive))]
+    assert snapshots == [b'{"jams": []}'] * 2
+
+
+def test_gives_up(feed, tmpdir):
+    FlakyFeed.responses = [(500, b'')]
+    collector = waze_feed.WazeCollector(feed, str(tmpdir), retries=2, backoff=0)
+    assert waze_feed.run_collector(collector, collector.collect(None)) is None
+    assert collector.failures == 1
+    assert FlakyFeed.requests == 3
+
+    FlakyFeed.responses = [(404, b'')]
+    FlakyFeed.requests = 0
+    session = waze_feed.make_session()
+    with pytest.raises(waze_feed.requests.HTTPError):
+        waze_feed.fetch(session, feed)
+    assert FlakyFeed.requests == 1
+
+
+def test_reports_failed_writes(feed, tmpdir):
+    FlakyFeed.responses = [(200, b'{"jams": []}')]
+    collector = waze_feed.WazeCollector(feed, str(tmpdir), interval=0, backoff=0)
+
+    def append(fetched, data):
+        raise OSError('disk full')
+    collector.writer.append = append
+    waze_feed.run_collector(collector, collector.run(count=2))
+    assert collector.failures == 2
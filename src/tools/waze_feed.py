@@ -1,40 +1,213 @@
 #!/usr/bin/python
 
+# Collects a Waze feed once a minute into hourly snapshot archives
+# Runs as a long-lived process with one pooled http session, rather than
+# a process per snapshot from cron, and retries transient failures with
+# exponential backoff
 import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
-import gzip
 import os
+import sys
+import time
 import requests
+from requests.adapters import HTTPAdapter
 
+# Run as a script from cron, so src needs to be on the path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.snapshot_archive import ArchiveWriter
+
+# Responses worth trying again
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TransientError(Exception):
+    """
+    A failed fetch that may succeed if tried again
+    """
+
+
+def make_session(pool_size=2):
+    """
+    Session reused for every fetch, so the connection stays open
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch(session, feed, timeout=30):
+    """
+    Fetch the feed once
+    Args:
+        session - requests session
+        feed - Waze feed URL
+        timeout - seconds
+    Returns:
+        the response body, checked to be json
+    Raises:
+        TransientError for errors that may go away, requests.HTTPError otherwise
+    """
+    try:
+        response = session.get(feed, timeout=timeout)
+    except (requests.ConnectionError, requests.Timeout) as error:
+        raise TransientError(str(error))
+    if response.status_code in RETRY_STATUSES:
+        raise TransientError('status {}'.format(response.status_code))
+    response.raise_for_status()
+    try:
+        json.loads(response.content.decode('utf-8'))
+    except ValueError as error:
+        # Most likely cut off part way through
+        raise TransientError('invalid json: {}'.format(error))
+    return response.content
+
+
+class WazeCollector():
+    """
+    Fetches a Waze feed every interval seconds, on the interval's
+    boundary, and appends each snapshot to its hour's archive
+    Args:
+        feed - Waze feed URL
+        dirname - directory to write archives to
+        interval - seconds between snapshots
+        retries - number of times a failed fetch is tried again
+        backoff - seconds before the first retry, doubled for each one after
+        timeout - seconds to wait for a response
+    """
+
+    def __init__(self, feed, dirname, interval=60, retries=3, backoff=2, timeout=30):
+        self.feed = feed
+        self.interval = interval
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = make_session()
+        self.writer = ArchiveWriter(dirname)
+        # Fetches can overlap while one is retrying, but writes happen
+        # one at a time, in a single thread
+        self.fetch_executor = ThreadPoolExecutor(max_workers=2)
+        self.write_executor = ThreadPoolExecutor(max_workers=1)
+        self.failures = 0
+
+    async def fetch(self):
+        """
+        Fetch the feed, retrying transient errors
+        Raises:
+            the last error, once out of retries
+        """
+        loop = asyncio.get_event_loop()
+        for attempt in range(self.retries + 1):
+            try:
+                return await loop.run_in_executor(
+                    self.fetch_executor, fetch, self.session, self.feed, self.timeout)
+            except TransientError as error:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                print("Fetch failed ({}), retrying in {}s".format(error, delay))
+                await asyncio.sleep(delay)
+
+    async def collect(self, fetched):
+        """
+        Fetch and archive a single snapshot
+        Args:
+            fetched - utc datetime the snapshot is named by
+        Returns:
+            snapshot name, or None if it couldn't be fetched
+        """
+        try:
+            data = await self.fetch()
+        except (TransientError, requests.RequestException) as error:
+            self.failures += 1
+            print("Skipping snapshot {}: {}".format(fetched, error))
+            return None
+        loop = asyncio.get_event_loop()
+        _, name, _, _ = await loop.run_in_executor(
+            self.write_executor, self.writer.append, fetched, data)
+        return name
+
+    async def run(self, count=None):
+        """
+        Collect snapshots until stopped, or until count have been started
+        A slow fetch doesn't hold up the next one
+        """
+        tasks = set()
+        started = 0
+        while count is None or started < count:
+            now = time.time()
+            await asyncio.sleep(self.interval - now % self.interval if self.interval else 0)
+            fetched = datetime.datetime.now(datetime.timezone.utc).replace(
+                second=0, microsecond=0)
+            tasks.add(asyncio.ensure_future(self.collect(fetched)))
+            done = {task for task in tasks if task.done()}
+            self.check(done)
+            tasks -= done
+            started += 1
+        if tasks:
+            await asyncio.wait(tasks)
+            self.check(tasks)
+
+    def check(self, tasks):
+        """
+        Report snapshots that failed on something other than a fetch,
+        like writing the archive, and count them as failures
+        """
+        for task in tasks:
+            error = task.exception()
+            if error is not None:
+                self.failures += 1
+                print("Failed to collect snapshot: {!r}".format(error))
+
+    def close(self):
+        self.session.close()
+        self.fetch_executor.shutdown()
+        self.write_executor.shutdown()
+
+
+def run_collector(collector, coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        collector.close()
+        loop.close()
 
 
 if __name__ == '__main__':
     """
-    Given a link to a waze feed, and a directory to write to, zip and write
-    the resulting json file to the directory
+    Given a link to a waze feed, and a directory to write to, collect
+    the feed into hourly archives in the directory
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('-f', "--feed", type=str, required=True,
                         help="Waze feed URL")
     parser.add_argument('-d', "--dirname", type=str, required=True,
                         help="directory to write results to")
-    
-    args = parser.parse_args()
-
-    if not os.path.exists(args.dirname):
-        os.makedirs(args.dirname)
-
-    response = requests.get(args.feed)
-    # Filename is the current minute, in utc time
-    timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%d-%H-%M")
-    json_str = json.dumps(response.json())
-    json_bytes = json_str.encode('utf-8')
-
-    outfile = os.path.join(args.dirname,
-                           timestamp + '.json.gz')
-
-    with gzip.open(outfile, 'wb') as f:
-        f.write(json_bytes)
+    parser.add_argument('-i', "--interval", type=int, default=60,
+                        help="seconds between snapshots")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="times to retry a failed fetch")
+    parser.add_argument("--backoff", type=float, default=2,
+                        help="seconds before the first retry, doubling after that")
+    parser.add_argument("--once", action='store_true',
+                        help="fetch a single snapshot and exit, e.g. from cron")
 
+    args = parser.parse_args()
 
+    collector = WazeCollector(args.feed, args.dirname, interval=args.interval,
+                              retries=args.retries, backoff=args.backoff)
+    if args.once:
+        fetched = datetime.datetime.now(datetime.timezone.utc).replace(
+            second=0, microsecond=0)
+        run_collector(collector, collector.collect(fetched))
+    else:
+        try:
+            run_collector(collector, collector.run())
+        except KeyboardInterrupt:
+            print("Stopped after {} failed snapshots".format(collector.failures))
@@ -34,26 +34,40 @@ BASE_DIR = os.path.dirname(
 
 DATA_FP = os.path.join(BASE_DIR, 'data')
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_standardization.standardize_crashes import read_crashes
+
 
 def make_crash_df(city):
     print('Within make_viz_data. Making crash data-frame.')
-    crash_fp = os.path.join(DATA_FP, 'processed', 'crash', 'crashes.json')
-    print('crash_fp is:', crash_fp)
-
-    with open(crash_fp, 'r') as json_file:
-        crashes_json = json.load(json_file)
-    crashes_df = json_normalize(crashes_json)
+    crash_dir = os.path.join(DATA_FP, 'processed', 'crash')
+    crash_fp = os.path.join(crash_dir, 'crashes.json')
+
+    # Prefer the typed columnar crashes, reading only the columns needed here
+    if os.path.exists(os.path.join(crash_dir, 'crashes.parquet')):
+        print('crash_fp is:', os.path.join(crash_dir, 'crashes.parquet'))
+        crashes_df = read_crashes(crash_dir, columns=['DATE_TIME', 'LAT', 'LON'])
+        crashes_df = crashes_df.reset_index(drop=True).rename(columns={
+            'DATE_TIME': 'dateOccurred',
+            'LAT': 'location.latitude',
+            'LON': 'location.longitude'
+        })
+    else:
+        print('crash_fp is:', crash_fp)
+        with open(crash_fp, 'r') as json_file:
+            crashes_json = json.load(json_file)
+        crashes_df = json_normalize(crashes_json)
 
     crashes_df['city'] = city
     crashes_df['dateOccurred'] = pd.to_datetime(crashes_df['dateOccurred'])
 
-    print('crashes_df is:', crashes_df)
+    print('crashes_df has shape:', crashes_df.shape)
 
     # get year and ISO week number
     print('Creating year and week data from DateOccured in crashes.json')
     crashes_df['year'] = crashes_df['dateOccurred'].dt.year
     crashes_df['week'] = crashes_df['dateOccurred'].dt.week
-    print('Having made year / week crashes_df now looks like:\n', crashes_df)
+    print('Having made year / week crashes_df has columns:', list(crashes_df))
 
     # some years the last week = 1, make it 52 in that case
     crashes_df.loc[(crashes_df.week == 1) & (crashes_df.dateOccurred.dt.month == 12), 'week'] = 52
@@ -64,7 +78,7 @@ def make_crash_df(city):
 
     crashes_df_return = crashes_df[['city', 'location.latitude', 'location.longitude', 'year', 'week', 'dateOccurred']]
 
-    print('Returning crashes_df_return as:\n', crashes_df_return)
+    print('Returning crashes_df_return with shape:', crashes_df_return.shape)
 
     return crashes_df_return
 
@@ -75,7 +89,7 @@ def make_preds_gdf(city, year):
 
     output = pd.read_csv(seg_file, dtype={'segment_id': str})
 
-    print('Read in model output from seg_with_predicted. Looks like: \n', output)
+    print('Read in model output from seg_with_predicted with shape:', output.shape)
     print('Has the following headers', list(output))
 
     output['id'] = output['segment_id']